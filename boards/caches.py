@@ -0,0 +1,9 @@
+from django.conf import settings
+
+from vivacity_api.cache import PayloadCache
+
+forum_widget_cache = PayloadCache(
+    'boards:forum_widget:boards_and_authors',
+    timeout=getattr(settings, 'FORUM_WIDGET_TIMEOUT', 300),
+    alias=getattr(settings, 'FORUM_WIDGET_CACHE', 'default'),
+)
@@ -1,24 +1,16 @@
-import random
-
 import factory
-from faker import Factory
 
-from users.models import User
+from users.factories import UserFactory
 from .models import Board, Topic
 
-faker = Factory.create()
-
 
 class TopicFactory(factory.django.DjangoModelFactory):
     class Meta:
         model = Topic
+        django_get_or_create = ('title',)
 
-    title = faker.text(20)
-    desc = faker.text()
-
-
-AUTHORS = User.objects.all()
-BOARD_AUTHOR = AUTHORS[random.randint(0, len(AUTHORS) - 1)]
+    title = factory.Sequence(lambda n: f'Topic {n}')
+    desc = factory.Faker('text')
 
 
 class BoardFactory(factory.django.DjangoModelFactory):
@@ -26,8 +18,8 @@ class BoardFactory(factory.django.DjangoModelFactory):
         model = Board
         django_get_or_create = ('title',)
 
-    author = BOARD_AUTHOR
-    topic = factory.Iterator(Topic.objects.all())
-    title = faker.text(50)
-    desc = faker.text()
-    content = faker.paragraphs(5)
+    author = factory.SubFactory(UserFactory)
+    topic = factory.SubFactory(TopicFactory)
+    title = factory.Sequence(lambda n: f'Board {n}')
+    desc = factory.Faker('text')
+    content = factory.Faker('text', max_nb_chars=2000)
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from boards.models import expire_boards
+
+
+class Command(BaseCommand):
+    help = "Deactivates boards past their expiry date, once or every --interval seconds"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=None,
+            help="Keep sweeping every INTERVAL seconds instead of once",
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            expired = expire_boards()
+            self.stdout.write(self.style.SUCCESS(f'Expired {expired} boards'))
+            if interval is None:
+                break
+            time.sleep(interval)
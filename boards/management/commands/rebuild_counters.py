@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from boards.models import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Recounts the stored like/comment counters of every board and comment"
+
+    def handle(self, *args, **options):
+        boards, comments = rebuild_counters()
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt counters for {boards} boards and {comments} comments')
+        )
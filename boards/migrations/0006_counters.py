@@ -0,0 +1,52 @@
+# Generated by Django 3.0.4 on 2026-10-18 18:23
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    counted = model.objects.filter(**{field: OuterRef('pk')})\
+        .order_by()\
+        .values(field)\
+        .annotate(total=Count('pk'))\
+        .values('total')
+    return Coalesce(Subquery(counted, output_field=models.IntegerField()), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Board = apps.get_model('boards', 'Board')
+    Comment = apps.get_model('boards', 'Comment')
+    BoardLike = apps.get_model('boards', 'BoardLike')
+    CommentLike = apps.get_model('boards', 'CommentLike')
+    Board.objects.update(
+        like_count=count_of(BoardLike, 'board'),
+        comment_count=count_of(Comment, 'board'),
+    )
+    Comment.objects.update(like_count=count_of(CommentLike, 'comment'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0005_auto_20200404_1529'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='comment_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='board',
+            name='like_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.4 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0006_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='board',
+            index=models.Index(fields=['published_on_date', 'id'], name='board_published_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.4 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0007_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='board',
+            index=models.Index(fields=['is_active', 'expires_on_date'], name='board_expiry_idx'),
+        ),
+    ]
@@ -1,8 +1,13 @@
 from django.db import models
+from django.db.models import F, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.text import slugify
 
 from vivacity_api.settings import AUTH_USER_MODEL as User
+from .caches import forum_widget_cache
 
 
 def deactivate(obj):
@@ -11,6 +16,19 @@ def deactivate(obj):
     return True
 
 
+def expire_boards(now=None) -> int:
+    """Deactivates every active board past its expires_on_date in
+    one UPDATE, returns the amount of boards expired
+    """
+    now = now or timezone.now()
+    expired = Board.objects.filter(is_active=True, expires_on_date__lt=now)\
+        .update(is_active=False, removed_on_date=now)
+    if expired:
+        # update() sends no signals so the widget is invalidated here
+        forum_widget_cache.invalidate()
+    return expired
+
+
 class Topic(models.Model):
     title = models.CharField(max_length=250, default="", unique=True)
     desc = models.CharField(max_length=500, default="", blank=True)
@@ -30,6 +48,14 @@ TYPES = (
 
 
 class Board(models.Model):
+    class Meta:
+        indexes = [
+            # Backs the keyset pagination of the board listing
+            models.Index(fields=['published_on_date', 'id'], name='board_published_idx'),
+            # Backs the expiry sweep and the widget's unexpired filter
+            models.Index(fields=['is_active', 'expires_on_date'], name='board_expiry_idx'),
+        ]
+
     # General  Board Information
     type = models.IntegerField(choices=TYPES, blank=True, default=1)
     created_on_date = models.DateTimeField(auto_now_add=True)
@@ -62,17 +88,22 @@ class Board(models.Model):
     # TODO create stats class that can be associated with different models
     views = models.IntegerField(default=0)
     last_viewed_date = models.DateTimeField(null=True, blank=True)
+    # Stored counters kept in step by the like/comment signals below,
+    # listings read these instead of counting per row
+    like_count = models.IntegerField(default=0, editable=False)
+    comment_count = models.IntegerField(default=0, editable=False)
 
     @property
     def likes(self):
-        # Determine how many like the boards has
-        board_likes = BoardLike.objects.filter(board=self).count()
+        # Determine how many like the boards has, uses the
+        # prefetched likes when the board was loaded for detail
+        board_likes = self.boardlike_set.count()
         return board_likes
 
     @property
     def liked_by(self):
         # Gets all users who have liked the board
-        likes = BoardLike.objects.filter(board=self)
+        likes = self.boardlike_set.all()
         liked_by = [like.author for like in likes]
         return liked_by
 
@@ -123,6 +154,7 @@ class Comment(models.Model):
     published_on_date = models.DateTimeField(blank=True, null=True, default=timezone.now)
     is_active = models.BooleanField(blank=True, default=False)
     content = models.TextField(max_length=2400, default="")
+    like_count = models.IntegerField(default=0, editable=False)
 
     @property
     def by_board_author(self):
@@ -131,7 +163,7 @@ class Comment(models.Model):
 
     @property
     def likes(self):
-        comment_likes = CommentLike.objects.filter(comment=self).count()
+        comment_likes = self.commentlike_set.count()
         return comment_likes
 
     def __str__(self):
@@ -161,3 +193,93 @@ class BoardLike(Like):
 # TODO Add AvatarLikes once Avatar component is up
 # class AvatarLike(Like):
 #     avatar = models.ForeignKey(Avatar, on_delete=models.CASCADE)
+
+
+def adjust_counter(model, pk, field, amount):
+    """Atomically adds 'amount' to the counter 'field' of the row,
+    done in the database with F() so concurrent writes are not lost
+    """
+    return model.objects.filter(pk=pk).update(**{field: F(field) + amount})
+
+
+@receiver(post_save, sender=BoardLike)
+def board_like_created(sender, instance=None, created=False, **kwargs):
+    if created:
+        adjust_counter(Board, instance.board_id, 'like_count', 1)
+
+
+@receiver(post_delete, sender=BoardLike)
+def board_like_deleted(sender, instance=None, **kwargs):
+    adjust_counter(Board, instance.board_id, 'like_count', -1)
+
+
+@receiver(post_save, sender=CommentLike)
+def comment_like_created(sender, instance=None, created=False, **kwargs):
+    if created:
+        adjust_counter(Comment, instance.comment_id, 'like_count', 1)
+
+
+@receiver(post_delete, sender=CommentLike)
+def comment_like_deleted(sender, instance=None, **kwargs):
+    adjust_counter(Comment, instance.comment_id, 'like_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance=None, created=False, **kwargs):
+    if created:
+        adjust_counter(Board, instance.board_id, 'comment_count', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance=None, **kwargs):
+    adjust_counter(Board, instance.board_id, 'comment_count', -1)
+
+
+@receiver(post_save, sender=Board)
+@receiver(post_delete, sender=Board)
+@receiver(post_save, sender=BoardLike)
+@receiver(post_delete, sender=BoardLike)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_forum_widget(sender, **kwargs):
+    forum_widget_cache.invalidate()
+
+
+#  Fields of an author the widget shows next to their boards
+WIDGET_AUTHOR_FIELDS = {'username', 'avatar', 'avatar_image'}
+
+
+@receiver(post_save, sender=User)
+def invalidate_forum_widget_author(sender, created=False, update_fields=None, **kwargs):
+    # New users have no boards yet, partial saves may leave the
+    # shown fields alone
+    if created:
+        return
+    if update_fields is None or WIDGET_AUTHOR_FIELDS.intersection(update_fields):
+        forum_widget_cache.invalidate()
+
+
+def count_of(model, field):
+    """Correlated subquery counting the 'model' rows pointing at
+    the outer row through 'field'
+    """
+    counted = model.objects.filter(**{field: OuterRef('pk')})\
+        .order_by()\
+        .values(field)\
+        .annotate(total=Count('pk'))\
+        .values('total')
+    return Coalesce(Subquery(counted, output_field=models.IntegerField()), 0)
+
+
+def rebuild_counters():
+    """Recounts every stored like/comment counter from scratch,
+    one UPDATE per counted model
+    """
+    boards = Board.objects.update(
+        like_count=count_of(BoardLike, 'board'),
+        comment_count=count_of(Comment, 'board'),
+    )
+    comments = Comment.objects.update(
+        like_count=count_of(CommentLike, 'comment'),
+    )
+    return boards, comments
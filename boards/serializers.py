@@ -1,16 +1,45 @@
+from django.db.models import QuerySet
 from rest_framework import serializers
 from rest_framework.fields import CurrentUserDefault
 
 from boards.models import Board, Topic, Comment
-
-
-class TopicSerializer(serializers.ModelSerializer):
+from users.avatars import avatar_url, avatar_sources
+from users.presence import presence
+from vivacity_api.middleware import TimedSerializerMixin
+
+
+def online_authors(serializer) -> set:
+    """Pks of the online authors of everything the root serializer is
+    serializing, looked up once in one batch
+    """
+    root = serializer.root
+    if not hasattr(root, '_online_authors'):
+        instances = root.instance if isinstance(root.instance, (list, tuple, QuerySet)) else [root.instance]
+        root._online_authors = presence.online({obj.author_id for obj in instances})
+    return root._online_authors
+
+
+def author_block(serializer, author, online=True):
+    """Without 'online' for payloads that are cached, their online
+    status is added as they are served
+    """
+    block = {
+        'username': author.username,
+        'thumbnail': avatar_url(author, 'icon'),
+        'thumbnail_sources': avatar_sources(author, 'icon'),
+    }
+    if online:
+        block['online'] = author.pk in online_authors(serializer)
+    return block
+
+
+class TopicSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Topic
         fields = "__all__"
 
 
-class BoardSerializer(serializers.ModelSerializer):
+class BoardSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Board
         fields = "__all__"
@@ -25,7 +54,7 @@ class BoardSerializer(serializers.ModelSerializer):
         return board.pk
 
     def get_likes(self, board):
-        return board.likes
+        return board.like_count
 
     def get_liked_by(self, board):
         liked_by = board.liked_by
@@ -33,14 +62,10 @@ class BoardSerializer(serializers.ModelSerializer):
         return users
 
     def get_author(self, board):
-        return {
-            'username': board.author.username,
-            'online': board.author.online,
-            'thumbnail': board.author.avatar_thumbnail.url
-        }
+        return author_block(self, board.author)
 
 
-class ForumWidgetSerializer(serializers.ModelSerializer):
+class ForumWidgetSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Board
         fields = [
@@ -57,14 +82,12 @@ class ForumWidgetSerializer(serializers.ModelSerializer):
 
     published_on_date = serializers.DateTimeField(format='%B.%d.%Y')
     author = serializers.SerializerMethodField()
+    likes = serializers.IntegerField(source='like_count', read_only=True)
     liked_by = serializers.SerializerMethodField()
 
     def get_author(self, board):
-        return {
-            'username': board.author.username,
-            'online': board.author.online,
-            'thumbnail': board.author.avatar_thumbnail.url
-        }
+        # The widget is cached, ForumWidgetView adds who is online
+        return author_block(self, board.author, online=False)
 
     def get_liked_by(self, board):
         liked_by = board.liked_by
@@ -72,13 +95,13 @@ class ForumWidgetSerializer(serializers.ModelSerializer):
         return users
 
 
-class CreateCommentSerializer(serializers.ModelSerializer):
+class CreateCommentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = '__all__'
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = "__all__"
@@ -87,8 +110,4 @@ class CommentSerializer(serializers.ModelSerializer):
     author = serializers.SerializerMethodField()
 
     def get_author(self, board):
-        return {
-            'username': board.author.username,
-            'online': board.author.online,
-            'thumbnail': board.author.avatar_thumbnail.url
-        }
\ No newline at end of file
+        return author_block(self, board.author)
\ No newline at end of file
@@ -1,8 +1,19 @@
+import os
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError
 from django.test import TestCase, Client
 from django.utils import timezone
 
-from boards.models import Board, Comment, Topic, deactivate, BoardLike, CommentLike
+from boards.models import Board, Comment, Topic, deactivate, expire_boards, BoardLike, CommentLike
+from boards import view_counter as view_counter_module
+from boards.view_counter import ViewCounter, view_counter
+from vivacity_api.cache import PayloadCache
 from users.models import User
+from users.presence import presence, LocalRedis
 
 
 class BoardTestCase(TestCase):
@@ -249,3 +260,434 @@ class TopicTestCase(TestCase):
         self.client.login(username="UserUnAuth", password="nonAuthPassword")
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
+
+
+class BoardViewQueryTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.client = Client()
+        self.user = User.objects.create(
+            email="boardUser@email.com",
+            date_of_birth="1980-03-20",
+            username="UserUnAuth",
+            password="nonAuthPassword"
+        )
+        self.board = Board.objects.create(
+            author=self.user,
+            title="This is the test title",
+            desc="Obviously it is a test, it is only a test",
+            content="This could go on and on, so i won't let it."
+        )
+        self.url = f'/api/board/view/{self.board.slug}'
+        #  Keep the shared view buffer from flushing mid request
+        for attribute, value in (('interval', None), ('pending_views', {})):
+            patcher = mock.patch.object(view_counter, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add_activity(self, amount):
+        for i in range(amount):
+            user = User.objects.create(
+                email=f"commenter{i}@email.com",
+                date_of_birth="1980-03-20",
+                username=f"Commenter{i}",
+                password="nonAuthPassword"
+            )
+            Comment.objects.create(
+                board=self.board,
+                author=user,
+                content="This comment is here because I am grateful for this test!"
+            )
+            BoardLike.objects.create(board=self.board, author=user)
+
+    def test_board_view_query_count(self):
+        #  Board, likes and comments
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+        #  Query count does not grow with comments or likes
+        self.add_activity(10)
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        data = response.json()
+        self.assertEqual(len(data['comments']), 10)
+        self.assertEqual(data['board']['likes'], 10)
+        self.assertEqual(len(data['board']['liked_by']), 10)
+
+    def test_author_presence(self):
+        self.add_activity(3)
+        commenter = User.objects.get(username="Commenter1")
+        with mock.patch.object(presence, 'client', LocalRedis()):
+            presence.heartbeat(commenter.pk)
+            with mock.patch.object(presence, 'online', wraps=presence.online) as online:
+                data = self.client.get(self.url).json()
+            #  One lookup for the board, one for all of its comments
+            self.assertEqual(online.call_count, 2)
+        self.assertFalse(data['board']['author']['online'])
+        online_comments = [comment['author']['username'] for comment in data['comments'] if comment['author']['online']]
+        self.assertEqual(online_comments, ["Commenter1"])
+
+    def test_board_view_buffers_views(self):
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        #  Pending views are shown but not yet written
+        self.assertEqual(response.json()['board']['views'], 2)
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.views, 0)
+
+        view_counter.flush()
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.views, 2)
+        self.assertIsNotNone(self.board.last_viewed_date)
+
+
+class CounterTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email="boardUser@email.com",
+            date_of_birth="1980-03-20",
+            username="UserUnAuth",
+            password="nonAuthPassword"
+        )
+        self.board = Board.objects.create(
+            author=self.user,
+            title="This is the test title",
+            desc="Obviously it is a test, it is only a test",
+            content="This could go on and on, so i won't let it."
+        )
+
+    def like_url(self, action):
+        return f'/api/board/like/{action}/{self.board.pk}/{self.user.username}'
+
+    def test_board_like_counter(self):
+        self.client.put(self.like_url('create'))
+        #  Liking twice does not count twice
+        self.client.put(self.like_url('create'))
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.like_count, 1)
+
+        self.client.put(self.like_url('delete'))
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.like_count, 0)
+
+    def test_comment_counters(self):
+        self.client.login(username="UserUnAuth", password="nonAuthPassword")
+        response = self.client.post('/api/board/comment/create', {
+            'board': self.board.pk,
+            'author': self.user.username,
+            'content': "This comment is here because I am grateful for this test!"
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.comment_count, 1)
+
+        comment = Comment.objects.get(pk=response.json()['id'])
+        CommentLike.objects.create(comment=comment, author=self.user)
+        comment.refresh_from_db()
+        self.assertEqual(comment.like_count, 1)
+
+        comment.delete()
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.comment_count, 0)
+
+    def test_rebuild_counters(self):
+        comment = Comment.objects.create(
+            board=self.board,
+            author=self.user,
+            content="This comment is here because I am grateful for this test!"
+        )
+        BoardLike.objects.create(board=self.board, author=self.user)
+        CommentLike.objects.create(comment=comment, author=self.user)
+        #  Drift the counters away from the real totals
+        Board.objects.update(like_count=7, comment_count=7)
+        Comment.objects.update(like_count=7)
+
+        call_command('rebuild_counters', stdout=open(os.devnull, 'w'))
+        self.board.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual(self.board.like_count, 1)
+        self.assertEqual(self.board.comment_count, 1)
+        self.assertEqual(comment.like_count, 1)
+
+
+class ViewCounterTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(
+            email="boardUser@email.com",
+            date_of_birth="1980-03-20",
+            username="UserUnAuth",
+            password="nonAuthPassword"
+        )
+        self.boards = [
+            Board.objects.create(
+                author=self.user,
+                title=f"This is test title {i}",
+                content="This could go on and on, so i won't let it."
+            ) for i in range(3)
+        ]
+
+    def test_flush(self):
+        counter = ViewCounter()
+        counter.record(self.boards[0].slug)
+        counter.record(self.boards[0].slug, 4)
+        counter.record(self.boards[1].slug)
+        self.assertEqual(counter.pending(self.boards[0].slug), 5)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(counter.flush(), 2)
+        self.assertEqual(counter.pending(self.boards[0].slug), 0)
+
+        views = [board.views for board in Board.objects.order_by('pk')]
+        self.assertEqual(views, [5, 1, 0])
+        self.assertIsNone(Board.objects.get(pk=self.boards[2].pk).last_viewed_date)
+
+        #  Nothing buffered, nothing written
+        with self.assertNumQueries(0):
+            self.assertEqual(counter.flush(), 0)
+
+    def test_flush_on_interval(self):
+        counter = ViewCounter(interval=0)
+        self.assertEqual(counter.record(self.boards[0].slug), 1)
+        self.boards[0].refresh_from_db()
+        self.assertEqual(self.boards[0].views, 1)
+
+    def test_failed_flush_keeps_newest_view(self):
+        counter = ViewCounter()
+        slug = self.boards[0].slug
+        counter.record(slug)
+
+        newest = []
+
+        def write(slugs, pending_views):
+            #  A view comes in while the flush is failing
+            counter.record(slug)
+            newest.append(counter.pending_views[slug][1])
+            raise DatabaseError()
+
+        with mock.patch.object(counter, 'write', side_effect=write):
+            with self.assertRaises(DatabaseError):
+                counter.flush()
+        #  The restored older view doesn't set the date back
+        self.assertEqual(counter.pending_views[slug], (2, newest[0]))
+
+    def test_periodic_flush(self):
+        counter = ViewCounter(interval=60)
+        with mock.patch.object(ViewCounter, 'flush_periodically') as flush_periodically:
+            counter.record(self.boards[0].slug)
+            counter.record(self.boards[1].slug)
+            counter.flusher.join()
+        #  One thread per counter
+        flush_periodically.assert_called_once_with()
+
+        def flush():
+            counter.interval = None
+        with mock.patch.object(view_counter_module.time, 'sleep') as sleep, \
+                mock.patch.object(counter, 'flush', side_effect=flush) as flushed:
+            counter.flush_periodically()
+        sleep.assert_called_once_with(60)
+        flushed.assert_called_once_with()
+
+
+class BoardPaginationTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.client = Client()
+        self.user = User.objects.create(
+            email="boardUser@email.com",
+            date_of_birth="1980-03-20",
+            username="UserUnAuth",
+            password="nonAuthPassword"
+        )
+        published_on_date = timezone.now()
+        #  Two boards share each date so the pk breaks the ties
+        for i in range(7):
+            Board.objects.create(
+                author=self.user,
+                title=f"This is test title {i}",
+                content="This could go on and on, so i won't let it.",
+                published_on_date=published_on_date - timezone.timedelta(days=i // 2)
+            )
+        self.expected = list(
+            Board.objects.order_by('-published_on_date', '-pk').values_list('slug', flat=True)
+        )
+
+    def walk(self, url, link):
+        slugs = []
+        while url:
+            data = self.client.get(url).json()
+            slugs += [board['slug'] for board in data['results']]
+            last = url
+            url = data[link]
+        return slugs, last
+
+    def test_pages(self):
+        slugs, last = self.walk('/api/board/view', 'next')
+        self.assertEqual(slugs, self.expected)
+
+        #  Walking back from the last page returns the same boards
+        previous = self.client.get(last).json()['previous']
+        back, _ = self.walk(previous, 'previous')
+        pages = [self.expected[i:i + 2] for i in range(0, 6, 2)]
+        self.assertEqual(back, pages[2] + pages[1] + pages[0])
+
+    def test_page_query_count(self):
+        url = '/api/board/view?page_size=3'
+        while url:
+            #  Boards and their likes, whichever page
+            with self.assertNumQueries(2):
+                url = self.client.get(url).json()['next']
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/board/view?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+class ForumWidgetCacheTestCase(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create(
+            email="boardUser@email.com",
+            date_of_birth="1980-03-20",
+            username="UserUnAuth",
+            password="nonAuthPassword"
+        )
+        self.board = Board.objects.create(
+            author=self.user,
+            title="This is the test title",
+            content="This could go on and on, so i won't let it.",
+            is_active=True
+        )
+        self.url = '/api/board/forum/widget'
+
+    def test_cached_payload(self):
+        first = self.client.get(self.url).json()
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url).json()
+        self.assertEqual(first, second)
+
+    def test_invalidation(self):
+        self.client.get(self.url)
+        BoardLike.objects.create(board=self.board, author=self.user)
+        self.assertEqual(self.client.get(self.url).json()[0]['likes'], 1)
+
+        Comment.objects.create(board=self.board, author=self.user, content="Grateful")
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+
+        self.board.title = "A new title"
+        self.board.save()
+        self.assertEqual(self.client.get(self.url).json()[0]['title'], "A new title")
+
+    def test_author_changes(self):
+        self.client.get(self.url)
+        #  Saves that leave the shown fields alone keep the payload
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+        self.user.username = "Renamed"
+        self.user.save(update_fields=['username'])
+        self.assertEqual(self.client.get(self.url).json()[0]['author']['username'], "Renamed")
+
+    def test_presence_not_cached(self):
+        with mock.patch.object(presence, 'client', LocalRedis()):
+            self.assertFalse(self.client.get(self.url).json()[0]['author']['online'])
+            presence.heartbeat(self.user.pk)
+            #  Cached payload, current online status
+            with self.assertNumQueries(0):
+                self.assertTrue(self.client.get(self.url).json()[0]['author']['online'])
+
+
+class PayloadCacheTestCase(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.payload_cache = PayloadCache('tests:payload', timeout=60, lock_timeout=0.2)
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return self.builds
+
+    def test_read_through(self):
+        self.assertEqual(self.payload_cache.get(self.build), 1)
+        self.assertEqual(self.payload_cache.get(self.build), 1)
+        self.payload_cache.invalidate()
+        self.assertEqual(self.payload_cache.get(self.build), 2)
+
+    def test_stale_served_while_rebuilding(self):
+        self.payload_cache.get(self.build)
+        #  Expired while another worker holds the lock
+        key = self.payload_cache.key('payload')
+        version, _, payload = cache.get(key)
+        cache.set(key, (version, 0, payload))
+        self.payload_cache.lock()
+        self.assertEqual(self.payload_cache.get(self.build), 1)
+        self.assertEqual(self.builds, 1)
+
+        #  Lock released, the next reader rebuilds
+        cache.delete(self.payload_cache.key('lock'))
+        self.assertEqual(self.payload_cache.get(self.build), 2)
+
+    def test_waits_for_lock_holder(self):
+        self.payload_cache.lock()
+        #  Nothing to serve and the holder never finishes, so it
+        #  builds after waiting out the lock
+        self.assertEqual(self.payload_cache.get(self.build), 1)
+
+
+class BoardExpiryTestCase(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create(
+            email="boardUser@email.com",
+            date_of_birth="1980-03-20",
+            username="UserUnAuth",
+            password="nonAuthPassword"
+        )
+        now = timezone.now()
+        for i, expires_on_date in enumerate([None, now + timezone.timedelta(days=1), now]):
+            Board.objects.create(
+                author=self.user,
+                title=f"This is test title {i}",
+                content="This could go on and on, so i won't let it.",
+                is_active=True,
+                expires_on_date=expires_on_date
+            )
+
+    def test_widget_leaves_out_expired(self):
+        response = self.client.get('/api/board/forum/widget')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_expire_boards(self):
+        self.client.get('/api/board/forum/widget')
+        with self.assertNumQueries(1):
+            self.assertEqual(expire_boards(), 1)
+        self.assertEqual(expire_boards(), 0)
+
+        expired = Board.objects.get(slug="this-is-test-title-2")
+        self.assertFalse(expired.is_active)
+        self.assertIsNotNone(expired.removed_on_date)
+        self.assertEqual(Board.objects.filter(is_active=True).count(), 2)
+
+    def test_expire_boards_command(self):
+        out = StringIO()
+        call_command('expire_boards', stdout=out)
+        self.assertIn('Expired 1 boards', out.getvalue())
+        #  Only the board past its expiry date is removed
+        expired = Board.objects.get(slug="this-is-test-title-2")
+        self.assertFalse(expired.is_active)
+        self.assertIsNotNone(expired.removed_on_date)
+        kept = Board.objects.filter(slug__in=["this-is-test-title-0", "this-is-test-title-1"])
+        self.assertEqual([board.is_active for board in kept], [True, True])
+        self.assertEqual([board.removed_on_date for board in kept], [None, None])
@@ -0,0 +1,121 @@
+"""Write-behind buffer for board views. Views are collected in
+memory per slug and written in bulk with F() updates instead of
+saving the whole Board row on every GET. A thread flushes them every
+interval, so a quiet process doesn't sit on buffered views until the
+next one comes in
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Case, When, Value, IntegerField, DateTimeField
+from django.utils import timezone
+
+from .models import Board
+
+# Slugs written per UPDATE, keeps the statement under the
+# database's bound parameter limit
+FLUSH_CHUNK_SIZE = 200
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+
+    def __init__(self, interval=None):
+        # Seconds between flushes, None only flushes when asked to
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending_views = {}
+        self.last_flush = time.monotonic()
+        self.flusher = None
+
+    def record(self, slug, amount=1):
+        """Buffers 'amount' views of the board 'slug' and flushes
+        if the interval has passed. Returns the views of the board
+        buffered since it was last read from the database
+        """
+        with self.lock:
+            views, _ = self.pending_views.get(slug, (0, None))
+            self.pending_views[slug] = (views + amount, timezone.now())
+            pending = views + amount
+            due = self.interval is not None and \
+                time.monotonic() - self.last_flush >= self.interval
+            if self.interval and self.flusher is None:
+                self.flusher = threading.Thread(
+                    target=self.flush_periodically, name='board-views', daemon=True
+                )
+                self.flusher.start()
+        if due:
+            self.flush()
+        return pending
+
+    def pending(self, slug):
+        with self.lock:
+            views, _ = self.pending_views.get(slug, (0, None))
+        return views
+
+    def flush(self):
+        """Writes every buffered view to the database, returns the
+        amount of boards updated
+        """
+        with self.lock:
+            pending_views = self.pending_views
+            self.pending_views = {}
+            self.last_flush = time.monotonic()
+
+        slugs = list(pending_views)
+        updated = 0
+        try:
+            for start in range(0, len(slugs), FLUSH_CHUNK_SIZE):
+                chunk = slugs[start:start + FLUSH_CHUNK_SIZE]
+                updated += self.write(chunk, pending_views)
+                for slug in chunk:
+                    del pending_views[slug]
+        except Exception:
+            # Put back what was not written so no views are lost
+            self.restore(pending_views)
+            raise
+        return updated
+
+    def flush_periodically(self):
+        """Flushes every interval, until the interval is unset"""
+        while self.interval:
+            time.sleep(self.interval)
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                # Restored by flush, the next round tries again
+                logger.exception("Could not flush board views")
+
+    def write(self, slugs, pending_views):
+        views = Case(
+            *[When(slug=slug, then=Value(pending_views[slug][0], output_field=IntegerField())) for slug in slugs],
+            default=Value(0),
+            output_field=IntegerField()
+        )
+        last_viewed = Case(
+            *[When(slug=slug, then=Value(pending_views[slug][1], output_field=DateTimeField())) for slug in slugs],
+            default=F('last_viewed_date'),
+            output_field=DateTimeField()
+        )
+        return Board.objects.filter(slug__in=slugs).update(
+            views=F('views') + views,
+            last_viewed_date=last_viewed
+        )
+
+    def restore(self, pending_views):
+        with self.lock:
+            for slug, (views, viewed_on) in pending_views.items():
+                buffered, buffered_on = self.pending_views.get(slug, (0, viewed_on))
+                # Views recorded since the failed flush are newer
+                self.pending_views[slug] = (buffered + views, max(buffered_on, viewed_on))
+
+
+view_counter = ViewCounter(getattr(settings, 'BOARD_VIEWS_FLUSH_INTERVAL', 10))
+# Force out whatever is still buffered when the process exits
+atexit.register(view_counter.flush)
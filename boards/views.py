@@ -1,4 +1,6 @@
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Prefetch, Q
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.generics import ListAPIView
@@ -6,10 +8,14 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from users.models import User
+from users.presence import presence
 from vivacity_api import settings
+from vivacity_api.pagination import KeysetPagination
 from .models import Topic, Board, Comment, BoardLike
 from .serializers import TopicSerializer, BoardSerializer, ForumWidgetSerializer, CommentSerializer, \
     CreateCommentSerializer
+from .caches import forum_widget_cache
+from .view_counter import view_counter
 
 
 class TopicView(ListAPIView):
@@ -17,9 +23,25 @@ class TopicView(ListAPIView):
     serializer_class = TopicSerializer
 
 
+def board_detail_queryset():
+    """Board queryset for BoardSerializer. Loads the author (with
+    their avatar) and the likes (with their authors) up front so
+    serializing boards costs the same number of queries however
+    popular they are
+    """
+    likes = BoardLike.objects.select_related('author')
+    return Board.objects.select_related('author__avatar_image')\
+        .prefetch_related(Prefetch('boardlike_set', queryset=likes))
+
+
+class BoardPagination(KeysetPagination):
+    ordering = ('-published_on_date', '-pk')
+
+
 class BoardViewAll(ListAPIView):
-    queryset = Board.objects.all()
+    queryset = board_detail_queryset()
     serializer_class = BoardSerializer
+    pagination_class = BoardPagination
 
 
 class BoardView(APIView):
@@ -27,34 +49,52 @@ class BoardView(APIView):
     def get(self, request, *args, **kwargs):
         payload = {}
         slug = kwargs["slug"]
-        board = Board.objects.get(slug=slug)
-        board.is_viewed()
-        board.last_viewed_date = timezone.now()
-        board.save()
+        board = board_detail_queryset().get(slug=slug)
+        #  Buffered and written in bulk, adds the views not yet written
+        board.is_viewed(view_counter.record(slug))
         serialized_board = BoardSerializer(board)
         payload['board'] = serialized_board.data
 
         #  Get comments
-        comments = Comment.objects.filter(board=board).order_by('-published_on_date')
-        serialized_comments = [CommentSerializer(comment).data for comment in comments]
-        payload['comments'] = serialized_comments
+        comments = Comment.objects.filter(board=board)\
+            .select_related('author__avatar_image')\
+            .order_by('-published_on_date')
+        payload['comments'] = CommentSerializer(comments, many=True).data
 
         return Response(payload, status=status.HTTP_200_OK)
 
 
+def build_forum_widget():
+    # Boards are expired by the expire_boards command, this only
+    # leaves out those it has not swept yet
+    unexpired = Q(expires_on_date__isnull=True) | Q(expires_on_date__gte=timezone.now())
+    boards = board_detail_queryset().filter(type=1)\
+        .filter(is_active=True)\
+        .filter(unexpired)\
+        .order_by('published_on_date')
+    boards = list(boards)
+    #  Author pks are kept to add their current online status
+    return {
+        'boards': ForumWidgetSerializer(boards, many=True).data,
+        'authors': [board.author_id for board in boards],
+    }
+
+
+def with_presence(widget) -> list:
+    """The cached widget boards with whether their authors are online
+    now, which would be up to the cache timeout old if cached
+    """
+    online = presence.online(set(widget['authors']))
+    return [
+        dict(board, author=dict(board['author'], online=author_pk in online))
+        for board, author_pk in zip(widget['boards'], widget['authors'])
+    ]
+
+
 class ForumWidgetView(ListAPIView):
 
     def get(self, request, *args, **kwargs):
-        boards = Board.objects.filter(type=1)\
-            .filter(is_active=True)\
-            .order_by('published_on_date')
-        for board in boards:
-            if board.expires_on_date and (board.expires_on_date < timezone.now()):
-                board.is_active = False
-                board.removed_on_date = timezone.now()
-                board.save()
-                boards.pop(board)
-        serialized_boards = [ForumWidgetSerializer(board, context={'request': request}).data for board in boards]
+        serialized_boards = with_presence(forum_widget_cache.get(build_forum_widget))
 
         return Response(serialized_boards, status=status.HTTP_200_OK)
 
@@ -72,7 +112,9 @@ class BoardCommentCreateView(APIView):
         comment_serialized = CreateCommentSerializer(data=comment)
 
         if comment_serialized.is_valid():
-            comment_serialized.save()
+            with transaction.atomic():
+                # Comment and the board's comment_count commit together
+                comment_serialized.save()
             comment = comment_serialized.data
             new_comment = Comment.objects.get(pk=comment['id'])
             serialized_comment = CommentSerializer(new_comment)
@@ -88,10 +130,9 @@ class BoardLikeCreateView(APIView):
     def put(self, request, object_pk, username):
         board = Board.objects.get(pk=object_pk)
         user = User.objects.get(username=username)
-        try:
-            like = BoardLike.objects.get(board=board, author=user)
-        except ObjectDoesNotExist:
-            like = BoardLike.objects.create(board=board, author=user)
+        with transaction.atomic():
+            # Like and the board's like_count commit together
+            BoardLike.objects.get_or_create(board=board, author=user)
 
         return Response({"Liked": True}, status=status.HTTP_200_OK)
 
@@ -102,7 +143,8 @@ class BoardLikeDeleteView(APIView):
         board = Board.objects.get(pk=object_pk)
         user = User.objects.get(username=username)
         try:
-            BoardLike.objects.get(board=board, author=user).delete()
+            with transaction.atomic():
+                BoardLike.objects.get(board=board, author=user).delete()
             return Response({"Success": "Removed like"}, status=status.HTTP_200_OK)
         except ObjectDoesNotExist:
             return Response({"Error": "Couldn't remove like"}, status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.4 on 2026-10-18 18:57
+
+from django.db import migrations, models
+import vivacity_api.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0002_auto_20200404_1252'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=vivacity_api.storage.ContentAddressedStorage(), upload_to='items/item_image/'),
+        ),
+    ]
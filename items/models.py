@@ -4,6 +4,7 @@ from django.utils import timezone
 
 from stats.models import ObjectStats
 from vivacity_api.settings import AUTH_USER_MODEL as User
+from vivacity_api.storage import content_storage
 
 
 def deactivate(obj):
@@ -55,6 +56,7 @@ class Item(models.Model):
     )
     image = models.ImageField(
         upload_to='items/item_image/',
+        storage=content_storage,
         blank=True,
         null=True
     )
@@ -1,8 +1,20 @@
 from django.contrib import admin
 
-from .models import FullSizeNPC, HeaderImage, Dialogue
+from .models import FullSizeNPC, HeaderImage, Dialogue, OutboxMessage, StoredFile
 
 
 @admin.register(FullSizeNPC, HeaderImage, Dialogue)
 class MainAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'created_on_date', 'sent_on_date', 'attempts', 'failed')
+    list_filter = ('failed',)
+
+
+@admin.register(StoredFile)
+class StoredFileAdmin(admin.ModelAdmin):
+    list_display = ('name', 'refs')
+    search_fields = ('name',)
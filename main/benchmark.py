@@ -0,0 +1,285 @@
+"""Benchmark harness. Seeds a large dataset with bulk inserts and
+times the main API endpoints against it through the test client.
+Seeded rows are prefixed with 'bench' so a database is only seeded
+once. Run with the seed_benchmark and benchmark commands
+"""
+import datetime
+import itertools
+import os
+import random
+import statistics
+import threading
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+from faker import Faker
+
+from boards.caches import forum_widget_cache
+from boards.models import Board, Comment, BoardLike, CommentLike, Topic, rebuild_counters
+from boards.views import BoardPagination
+from users.hashers import hash_slots
+from users.models import User
+
+PREFIX = 'bench'
+PASSWORD = 'benchmark'
+BATCH_SIZE = 5000
+#  Skew of who posts and what gets attention, higher is more skewed
+ZIPF_EXPONENT = 1.1
+
+
+class Skewed:
+    """Picks from 'items' so that the first ones are picked far more
+    often, like the few boards and users that draw most activity
+    """
+
+    def __init__(self, items, rng):
+        self.items = items
+        self.rng = rng
+        weights = (1 / (rank ** ZIPF_EXPONENT) for rank in range(1, len(items) + 1))
+        self.cum_weights = list(itertools.accumulate(weights))
+
+    def pick(self, k):
+        return self.rng.choices(self.items, cum_weights=self.cum_weights, k=k)
+
+
+def chunks(total, size=BATCH_SIZE):
+    for start in range(0, total, size):
+        yield start, min(size, total - start)
+
+
+def seeded_pks(model, **lookup):
+    return list(model.objects.filter(**lookup).order_by('pk').values_list('pk', flat=True))
+
+
+def is_seeded():
+    return User.objects.filter(username=f'{PREFIX}0').exists()
+
+
+def seed(users=100000, boards=1000000, comments=1000000, likes=1000000, seed=0, log=print):
+    """Bulk inserts the dataset, returns False if already seeded"""
+    if is_seeded():
+        log("Already seeded")
+        return False
+
+    rng = random.Random(seed)
+    faker = Faker()
+    faker.seed_instance(seed)
+    now = timezone.now()
+    # One hash for every user, hashing 100k passwords would take hours
+    password = make_password(PASSWORD)
+    first_names = [faker.first_name() for _ in range(500)]
+    paragraphs = [faker.paragraph(nb_sentences=5) for _ in range(200)]
+
+    for start, size in chunks(users):
+        # Wallets, tokens and search index come with the users
+        User.objects.provision([
+            User(
+                username=f'{PREFIX}{i}',
+                email=f'{PREFIX}{i}@example.com',
+                password=password,
+                first_name=rng.choice(first_names),
+                display_full_name=rng.random() < 0.3,
+                joined_on=(now - datetime.timedelta(days=rng.randrange(3 * 365))).date(),
+            ) for i in range(start, start + size)
+        ])
+        log(f'Users {start + size}/{users}')
+    user_pks = seeded_pks(User, username__startswith=PREFIX)
+
+    Topic.objects.bulk_create([
+        Topic(title=f'{PREFIX} topic {i}', desc=faker.sentence()) for i in range(10)
+    ])
+    topic_pks = seeded_pks(Topic, title__startswith=PREFIX)
+    authors = Skewed(user_pks, rng)
+    for start, size in chunks(boards):
+        picked = authors.pick(size)
+        Board.objects.bulk_create([
+            Board(
+                author_id=author,
+                topic_id=rng.choice(topic_pks),
+                title=f'{PREFIX} board {i}',
+                slug=f'{PREFIX}-board-{i}',
+                desc=paragraphs[i % 200][:120],
+                content=paragraphs[i % 200],
+                published_on_date=now - datetime.timedelta(minutes=boards - i),
+                # Only the newest boards show on the forum widget
+                is_active=i >= boards - 20,
+            ) for i, author in zip(range(start, start + size), picked)
+        ])
+        log(f'Boards {start + size}/{boards}')
+    # Newest boards are the popular ones
+    board_pks = seeded_pks(Board, slug__startswith=f'{PREFIX}-board-')[::-1]
+    popular_boards = Skewed(board_pks, rng)
+
+    for start, size in chunks(comments):
+        Comment.objects.bulk_create([
+            Comment(
+                board_id=board,
+                author_id=author,
+                content=paragraphs[rng.randrange(200)][:400],
+                published_on_date=now - datetime.timedelta(seconds=rng.randrange(86400 * 30)),
+            ) for board, author in zip(popular_boards.pick(size), authors.pick(size))
+        ])
+        log(f'Comments {start + size}/{comments}')
+
+    # Likes come mostly from the newer users
+    likers = Skewed(user_pks[::-1], rng)
+    liked = set()
+    for start, size in chunks(likes):
+        pairs = set(zip(popular_boards.pick(size), likers.pick(size))) - liked
+        liked |= pairs
+        BoardLike.objects.bulk_create([BoardLike(board_id=board, author_id=author) for board, author in pairs])
+        log(f'Board likes {len(liked)}/{likes}')
+    comment_pks = seeded_pks(Comment, board_id__in=board_pks[:100])
+    CommentLike.objects.bulk_create([
+        CommentLike(comment_id=comment, author_id=author)
+        for comment, author in zip(comment_pks, authors.pick(len(comment_pks)))
+    ])
+
+    rebuild_counters()
+    forum_widget_cache.invalidate()
+    log("Rebuilt counters")
+    return True
+
+
+def scenarios():
+    """(name, method, url, data, authenticated) of every scenario"""
+    user = User.objects.filter(username__startswith=PREFIX).order_by('pk').first()
+    boards = Board.objects.filter(slug__startswith=f'{PREFIX}-board-')
+    hot = boards.order_by('-comment_count', 'pk').first()
+    typical = boards.order_by('-published_on_date')[boards.count() // 2]
+    deep = boards.order_by('published_on_date', 'pk')[boards.count() // 10]
+    return [
+        ('home', 'get', '/api/main/home', None, False),
+        ('forum widget (cached)', 'get', '/api/board/forum/widget', None, False),
+        ('forum widget (cold)', 'get', '/api/board/forum/widget', None, False),
+        ('board list first page', 'get', '/api/board/view', None, False),
+        ('board list deep page', 'get', f'/api/board/view?cursor={BoardPagination().cursor_for(deep)}', None, False),
+        ('board detail (hot)', 'get', f'/api/board/view/{hot.slug}', None, False),
+        ('board detail (typical)', 'get', f'/api/board/view/{typical.slug}', None, False),
+        ('user search', 'get', '/api/user/search?search_terms=ann', None, True),
+        ('user list', 'get', '/api/user/view/all', None, True),
+        ('profile', 'get', f'/api/user/profile/{user.username}', None, True),
+        ('login', 'post', '/api/user/login', {'username': user.username, 'password': PASSWORD}, False),
+    ], user
+
+
+def server_timing(response):
+    """Queries and database milliseconds from the Server-Timing
+    header set by TimingMiddleware
+    """
+    queries = db = None
+    for part in response.get('Server-Timing', '').split(','):
+        fields = dict(field.strip().split('=', 1) for field in part.split(';')[1:])
+        if part.strip().startswith('db'):
+            db = float(fields['dur'])
+            queries = int(fields['desc'].strip('"').split()[0])
+    return queries, db
+
+
+def run(iterations=20, only=None):
+    """Times every scenario, returns a report per scenario name"""
+    plan, user = scenarios()
+    anonymous = Client()
+    authenticated = Client()
+    authenticated.force_login(user)
+
+    report = {}
+    for name, method, url, data, needs_auth in plan:
+        if only and only not in name:
+            continue
+        client = authenticated if needs_auth else anonymous
+        request = getattr(client, method)
+        request(url, data)  # warm up
+        wall = []
+        db = []
+        queries = statuses = None
+        for _ in range(iterations):
+            if name.endswith('(cold)'):
+                forum_widget_cache.invalidate()
+            start = time.perf_counter()
+            response = request(url, data)
+            wall.append((time.perf_counter() - start) * 1000)
+            queries, db_ms = server_timing(response)
+            db.append(db_ms or 0)
+            statuses = response.status_code
+        wall.sort()
+        report[name] = {
+            'status': statuses,
+            'queries': queries,
+            'p50': round(statistics.median(wall), 2),
+            'p95': round(wall[min(len(wall) - 1, len(wall) * 95 // 100)], 2),
+            'max': round(wall[-1], 2),
+            'db_p50': round(statistics.median(db), 2),
+        }
+    return report
+
+
+def format_report(report, baseline=None) -> str:
+    header = f'{"scenario":<26}{"status":>7}{"queries":>9}{"p50 ms":>10}{"p95 ms":>10}{"max ms":>10}{"db ms":>9}'
+    if baseline:
+        header += f'{"p50 vs base":>13}'
+    lines = [header, '-' * len(header)]
+    for name, row in report.items():
+        line = f'{name:<26}{row["status"]:>7}{str(row["queries"]):>9}' \
+               f'{row["p50"]:>10}{row["p95"]:>10}{row["max"]:>10}{row["db_p50"]:>9}'
+        if baseline and name in baseline and baseline[name]['p50']:
+            change = (row['p50'] - baseline[name]['p50']) / baseline[name]['p50'] * 100
+            line += f'{change:>+12.1f}%'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def login_throughput(threads=None, seconds=10.0) -> dict:
+    """Logs seeded users in through the login endpoint from 'threads'
+    threads for 'seconds'. Logins per core divides by the cores that
+    can hash at once, the fewest of the threads, the hash slots and
+    the CPUs
+    """
+    threads = threads or os.cpu_count() or 1
+    usernames = list(
+        User.objects.filter(username__startswith=PREFIX)
+        .order_by('pk')
+        .values_list('username', flat=True)[:threads * 10]
+    )
+    outcomes = {'logins': 0, 'busy': 0, 'failed': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def login(index):
+        client = Client()
+        done = {'logins': 0, 'busy': 0, 'failed': 0}
+        try:
+            for attempt in itertools.count():
+                if time.perf_counter() >= deadline:
+                    break
+                username = usernames[(index + attempt * threads) % len(usernames)]
+                status = client.post('/api/user/login', {'username': username, 'password': PASSWORD}).status_code
+                done['logins' if status == 200 else 'busy' if status == 503 else 'failed'] += 1
+        finally:
+            # Every thread has its own connection
+            connection.close()
+            with lock:
+                for outcome, count in done.items():
+                    outcomes[outcome] += count
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=login, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    cores = min(threads, hash_slots.size, os.cpu_count() or 1)
+    per_second = outcomes['logins'] / elapsed
+    return dict(
+        outcomes,
+        threads=threads,
+        cores=cores,
+        seconds=round(elapsed, 2),
+        per_second=round(per_second, 1),
+        per_core=round(per_second / cores, 1),
+    )
@@ -0,0 +1,6 @@
+from django.conf import settings
+
+from vivacity_api.cache import WarmPool
+
+#  Serialized NPCs with their dialogue, for the home page
+npc_pool = WarmPool(ttl=getattr(settings, 'NPC_POOL_TTL', 300))
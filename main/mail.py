@@ -0,0 +1,119 @@
+"""Outbound mail queue. Requests queue messages in the OutboxMessage
+table and return at once. The send_queued_mail worker sends them in
+batches over one reused backend connection, retrying failures with
+exponential backoff until MAIL_MAX_ATTEMPTS. The worker sends through
+MAIL_QUEUE_BACKEND, or EMAIL_BACKEND when that is not set (the locmem
+backend under tests)
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+#  How long a worker holds the messages it is sending
+LEASE = datetime.timedelta(minutes=5)
+
+
+def queue_mail(subject, body, to, from_email="") -> OutboxMessage:
+    return OutboxMessage.objects.create(
+        subject=subject,
+        body=body,
+        to='\n'.join(to),
+        from_email=from_email,
+    )
+
+
+def backoff(attempts) -> datetime.timedelta:
+    """Wait before the next attempt, doubling every failed attempt"""
+    seconds = settings.MAIL_RETRY_DELAY * 2 ** (attempts - 1)
+    return datetime.timedelta(seconds=min(seconds, settings.MAIL_RETRY_MAX_DELAY))
+
+
+def claim(batch_size, now) -> list:
+    """Leases a batch of due messages to this worker. Other workers skip
+    them until the lease runs out, which only matters if this worker
+    dies before marking them sent or failed
+    """
+    with transaction.atomic():
+        pks = list(
+            OutboxMessage.objects
+            .select_for_update(skip_locked=True)
+            .filter(sent_on_date=None, failed=False, send_after__lte=now)
+            .order_by('send_after', 'pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        OutboxMessage.objects.filter(pk__in=pks).update(send_after=now + LEASE)
+    return list(OutboxMessage.objects.filter(pk__in=pks).order_by('pk'))
+
+
+def send_queued(batch_size=BATCH_SIZE, now=None) -> dict:
+    """Sends one batch of due messages over one connection, returns
+    how many were sent, are to be retried and were given up on
+    """
+    now = now or timezone.now()
+    report = {'sent': 0, 'retrying': 0, 'failed': 0}
+    messages = claim(batch_size, now)
+    if not messages:
+        return report
+
+    connection = get_connection(backend=getattr(settings, 'MAIL_QUEUE_BACKEND', None))
+    try:
+        connection.open()
+    except Exception as error:
+        # Nothing can be sent this batch, all of it is retried
+        logger.warning("Could not open the mail connection: %s", error)
+        for message in messages:
+            fail(message, error, now, report)
+        return report
+
+    try:
+        for message in messages:
+            email = EmailMessage(
+                message.subject,
+                message.body,
+                message.from_email or None,
+                message.to.splitlines(),
+                connection=connection,
+            )
+            try:
+                email.send()
+            except Exception as error:
+                fail(message, error, now, report)
+            else:
+                message.sent_on_date = timezone.now()
+                message.save(update_fields=['sent_on_date'])
+                report['sent'] += 1
+    finally:
+        connection.close()
+    return report
+
+
+def fail(message, error, now, report):
+    message.attempts += 1
+    message.last_error = str(error)
+    if message.attempts >= settings.MAIL_MAX_ATTEMPTS:
+        message.failed = True
+        report['failed'] += 1
+    else:
+        message.send_after = now + backoff(message.attempts)
+        report['retrying'] += 1
+    message.save(update_fields=['attempts', 'last_error', 'failed', 'send_after'])
+
+
+def send_all_queued(batch_size=BATCH_SIZE, now=None) -> dict:
+    """Sends batches until no message is due"""
+    total = {'sent': 0, 'retrying': 0, 'failed': 0}
+    while True:
+        report = send_queued(batch_size, now)
+        for outcome, count in report.items():
+            total[outcome] += count
+        if not any(report.values()):
+            return total
@@ -0,0 +1,28 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import benchmark
+
+
+class Command(BaseCommand):
+    help = "Times the main endpoints against a seeded database (see seed_benchmark)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--scenario', default=None, help="Only run scenarios containing this text")
+        parser.add_argument('--json', default=None, help="Save the report to this file")
+        parser.add_argument('--compare', default=None, help="Report saved by an earlier --json run")
+
+    def handle(self, *args, **options):
+        if not benchmark.is_seeded():
+            raise CommandError("Nothing to benchmark, run seed_benchmark first")
+        report = benchmark.run(iterations=options['iterations'], only=options['scenario'])
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as saved:
+                baseline = json.load(saved)
+        self.stdout.write(benchmark.format_report(report, baseline))
+        if options['json']:
+            with open(options['json'], 'w') as saved:
+                json.dump(report, saved, indent=2)
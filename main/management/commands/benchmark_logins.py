@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main import benchmark
+
+
+class Command(BaseCommand):
+    help = "Measures logins per second and per core against a seeded database (see seed_benchmark)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=None, help="Concurrent logins, the CPU count by default")
+        parser.add_argument('--seconds', type=float, default=10.0)
+
+    def handle(self, *args, **options):
+        if not benchmark.is_seeded():
+            raise CommandError("Nothing to benchmark, run seed_benchmark first")
+        report = benchmark.login_throughput(options['threads'], options['seconds'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{settings.PASSWORD_HASH_ALGORITHM}: {report["per_second"]} logins/s, '
+            f'{report["per_core"]} logins/s per core over {report["cores"]} cores '
+            f'({report["threads"]} threads, {report["busy"]} busy, {report["failed"]} failed)'
+        ))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from vivacity_api.storage import CONTENT_PREFIX, content_fields, recount
+
+
+class Command(BaseCommand):
+    help = "Moves the media saved before content addressing into content_storage, " \
+           "one copy per distinct file, and points every row at its new name"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delete-originals',
+            action='store_true',
+            help="Remove the old files once moved, field defaults are kept",
+        )
+        parser.add_argument(
+            '--recount',
+            action='store_true',
+            help="Count references again and remove unreferenced files afterwards",
+        )
+
+    def handle(self, *args, **options):
+        moved = missing = 0
+        for model, field_name in content_fields():
+            field = model._meta.get_field(field_name)
+            storage = field.storage
+            #  Rows sharing an old name (defaults mostly) are moved together
+            names = model.objects\
+                .exclude(**{f'{field_name}__startswith': CONTENT_PREFIX})\
+                .exclude(**{field_name: ''})\
+                .exclude(**{f'{field_name}__isnull': True})\
+                .values_list(field_name, flat=True)\
+                .distinct()
+            for old_name in list(names):
+                if not storage.exists(old_name):
+                    missing += 1
+                    continue
+                rows = model.objects.filter(**{field_name: old_name})
+                with transaction.atomic():
+                    count = rows.count()
+                    with storage.open(old_name) as file:
+                        new_name = storage.save(old_name, file)
+                    if count > 1:
+                        storage.retain(new_name, count - 1)
+                    rows.update(**{field_name: new_name})
+                if options['delete_originals'] and old_name != field.default:
+                    storage.delete(old_name)
+                moved += 1
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved} files, {missing} files missing'))
+
+        if options['recount']:
+            report = recount()
+            self.stdout.write(self.style.SUCCESS(
+                f'Counted {report["counted"]} files, removed {report["removed"]}'
+            ))
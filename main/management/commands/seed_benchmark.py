@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from main import benchmark
+
+
+class Command(BaseCommand):
+    help = "Bulk inserts a large skewed dataset into the configured database for benchmarking"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--boards', type=int, default=1000000)
+        parser.add_argument('--comments', type=int, default=1000000)
+        parser.add_argument('--likes', type=int, default=1000000)
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, same seed same data")
+
+    def handle(self, *args, **options):
+        benchmark.seed(
+            users=options['users'],
+            boards=options['boards'],
+            comments=options['comments'],
+            likes=options['likes'],
+            seed=options['seed'],
+            log=self.stdout.write,
+        )
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.mail import send_all_queued, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Sends the queued outbound mail, once or every --interval seconds"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Messages sent per connection")
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=None,
+            help="Keep sending every INTERVAL seconds instead of once",
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            report = send_all_queued(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Sent {report["sent"]}, retrying {report["retrying"]}, gave up on {report["failed"]}'
+            ))
+            if interval is None:
+                break
+            time.sleep(interval)
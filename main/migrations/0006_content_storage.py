@@ -0,0 +1,32 @@
+# Generated by Django 3.0.4 on 2026-10-18 18:57
+
+from django.db import migrations, models
+import vivacity_api.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('refs', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='fullsizenpc',
+            name='image',
+            field=models.ImageField(storage=vivacity_api.storage.ContentAddressedStorage(), upload_to='main/images/NPC'),
+        ),
+        migrations.AlterField(
+            model_name='headerimage',
+            name='image',
+            field=models.ImageField(storage=vivacity_api.storage.ContentAddressedStorage(), upload_to='main/images/header'),
+        ),
+    ]
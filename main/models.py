@@ -2,8 +2,12 @@
 including Images, Non playable Characters, Stats
 """
 from django.db import models
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
 from django.utils import timezone
 
+from main.caches import npc_pool
+from vivacity_api.storage import content_storage, content_fields, loaded_names, release
 from vivacity_api.settings import AUTH_USER_MODEL as User
 
 
@@ -21,7 +25,7 @@ class StaticImage(models.Model):
         blank=True,
         null=True,
     )
-    image = models.ImageField(upload_to="main/images")
+    image = models.ImageField(upload_to="main/images", storage=content_storage)
     title = models.CharField(max_length=250, blank=True, default="")
     alt = models.CharField(max_length=250, blank=True, default="")
     created_on_date = models.DateTimeField(default=timezone.now)
@@ -45,15 +49,120 @@ class FullSizeNPC(StaticImage):
     """Full sized NPC images as displayed on the header and
     anywhere else that a NPC will be valuable
     """
-    image = models.ImageField(upload_to="main/images/NPC")
+    image = models.ImageField(upload_to="main/images/NPC", storage=content_storage)
     dialogue = models.ManyToManyField(Dialogue, blank=True)
 
 
+@receiver(post_save, sender=FullSizeNPC)
+@receiver(post_delete, sender=FullSizeNPC)
+@receiver(post_save, sender=Dialogue)
+@receiver(post_delete, sender=Dialogue)
+@receiver(m2m_changed, sender=FullSizeNPC.dialogue.through)
+def invalidate_npc_pool(sender, **kwargs):
+    npc_pool.invalidate()
+
+
 class HeaderImage(StaticImage):
     """The main header background image. Not expected to change
     but better to have the option now
     """
-    image = models.ImageField(upload_to="main/images/header")
+    image = models.ImageField(upload_to="main/images/header", storage=content_storage)
+
+
+class StoredFile(models.Model):
+    """Reference count of a file in content_storage, see
+    vivacity_api/storage.py
+    """
+    name = models.CharField(max_length=255, unique=True)
+    refs = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name} ({self.refs})'
+
+
+#  Rows of these models, with their content_storage fields, release
+#  the names they stop using. Filled by track_content_fields
+content_models = {}
+
+
+def track_content_fields():
+    """Connects the receivers below to every model with content_storage
+    fields, once the app registry is ready
+    """
+    for model, field in content_fields():
+        content_models.setdefault(model, []).append(field)
+    for model in content_models:
+        pre_save.connect(read_replaced_content, sender=model)
+        post_save.connect(release_replaced_content, sender=model)
+        pre_delete.connect(read_deleted_content, sender=model)
+        post_delete.connect(release_deleted_content, sender=model)
+
+
+def stored_names(instance, fields) -> dict:
+    """The names the row of 'instance' holds in 'fields', one query"""
+    row = type(instance)._base_manager.using(instance._state.db)\
+        .filter(pk=instance.pk).values(*fields).first()
+    return row or {}
+
+
+def read_replaced_content(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Reads the names a save may replace, only when it writes them"""
+    fields = [
+        field for field in content_models[sender]
+        if update_fields is None or field in update_fields
+    ]
+    if raw or instance._state.adding or not fields:
+        return
+    instance._stored_names = stored_names(instance, fields)
+
+
+def release_replaced_content(sender, instance, **kwargs):
+    # Released once the row points at the new names
+    stored = instance.__dict__.pop('_stored_names', {})
+    current = loaded_names(instance, stored)
+    release(name for field, name in stored.items() if current.get(field) != name)
+
+
+def read_deleted_content(sender, instance, **kwargs):
+    fields = content_models[sender]
+    names = loaded_names(instance, fields)
+    if len(names) < len(fields):
+        # Deferred fields are read from the row
+        names = stored_names(instance, fields)
+    instance._stored_names = names
+
+
+def release_deleted_content(sender, instance, **kwargs):
+    release(instance.__dict__.pop('_stored_names', {}).values())
+
+
+class OutboxMessage(models.Model):
+    """Email waiting to be sent by the send_queued_mail worker, queued
+    with main.mail.queue_mail so requests never wait on SMTP
+    """
+
+    class Meta:
+        indexes = [
+            # Backs the worker's scan for due messages
+            models.Index(fields=['sent_on_date', 'send_after'], name='outbox_due_idx'),
+        ]
+
+    subject = models.CharField(max_length=250)
+    body = models.TextField()
+    from_email = models.CharField(max_length=250, blank=True, default="")
+    # One address per line
+    to = models.TextField()
+    created_on_date = models.DateTimeField(default=timezone.now)
+    # Not sent before this, pushed back after every failed attempt
+    send_after = models.DateTimeField(default=timezone.now)
+    sent_on_date = models.DateTimeField(blank=True, null=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    # Gave up after MAIL_MAX_ATTEMPTS
+    failed = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'{self.subject} to {self.to.replace(chr(10), ", ")}'
 
 
 MONTHS = (
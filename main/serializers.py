@@ -1,15 +1,16 @@
 from rest_framework import serializers
 
 from main.models import FullSizeNPC, Dialogue
+from vivacity_api.middleware import TimedSerializerMixin
 
 
-class DialogueSerializer(serializers.ModelSerializer):
+class DialogueSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Dialogue
         fields = '__all__'
 
 
-class NPCSerializer(serializers.ModelSerializer):
+class NPCSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = FullSizeNPC
         fields = '__all__'
@@ -1 +1,351 @@
+import datetime
+import shutil
+import smtplib
+import tempfile
+from io import StringIO
+from unittest import mock
 
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.db import DatabaseError, transaction
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.utils import timezone
+from rest_framework.serializers import BaseSerializer
+
+from boards.models import Board
+from boards.view_counter import view_counter
+from items.models import Item
+from main import benchmark
+from main.caches import npc_pool
+from main.mail import queue_mail, send_queued, send_all_queued
+from main.models import FullSizeNPC, Dialogue, OutboxMessage, StoredFile
+from users.models import User
+from users.presence import presence, LocalRedis
+from vivacity_api.middleware import metrics
+from vivacity_api.storage import content_storage, recount, serve_media, IMMUTABLE
+
+
+class TimingMiddlewareTestCase(TestCase):
+
+    def setUp(self) -> None:
+        metrics.reset()
+        #  Keep board views from being written after the test database
+        for attribute, value in (('interval', None), ('pending_views', {})):
+            patcher = mock.patch.object(view_counter, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = Client()
+        self.su = User.objects.create_superuser(
+            email="sudo@email.com",
+            date_of_birth="1970-03-10",
+            username="sudoUser",
+            password="sudoPassword1"
+        )
+        self.user = User.objects.create_user(
+            email="user@email.com",
+            date_of_birth="1980-03-20",
+            username="UserUnAuth",
+            password="nonAuthPassword"
+        )
+        self.board = Board.objects.create(
+            author=self.user,
+            title="This is the test title",
+            content="This could go on and on, so i won't let it."
+        )
+
+    def test_server_timing(self):
+        response = self.client.get(f'/api/board/view/{self.board.slug}')
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="3 queries"', timing)
+        self.assertIn('ser;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    def test_serializer_time(self):
+        #  Timed through TimedSerializerMixin, DRF itself is left alone
+        self.assertFalse(hasattr(BaseSerializer, '_untimed_data'))
+        response = self.client.get(f'/api/board/view/{self.board.slug}')
+        serializer_ms = float(response['Server-Timing'].split('ser;dur=')[1].split(',')[0])
+        self.assertGreater(serializer_ms, 0)
+
+    def test_metrics(self):
+        for _ in range(3):
+            self.client.get(f'/api/board/view/{self.board.slug}')
+
+        self.client.login(username="UserUnAuth", password="nonAuthPassword")
+        self.assertEqual(self.client.get('/api/main/metrics').status_code, 403)
+
+        self.client.login(username="sudoUser", password="sudoPassword1")
+        summary = self.client.get('/api/main/metrics').json()
+        board_view = summary['api/board/view/<str:slug>']
+        self.assertEqual(board_view['view'], 'BoardView')
+        self.assertEqual(board_view['requests'], 3)
+        self.assertEqual(board_view['queries']['p50'], 3)
+        self.assertGreater(board_view['wall']['p99'], 0)
+
+
+class BenchmarkTestCase(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        for attribute, value in (('interval', None), ('pending_views', {})):
+            patcher = mock.patch.object(view_counter, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_seed_and_run(self):
+        log = []
+        self.assertTrue(benchmark.seed(users=30, boards=40, comments=60, likes=50, log=log.append))
+        self.assertFalse(benchmark.seed(users=30, log=log.append))
+        self.assertEqual(User.objects.filter(username__startswith='bench').count(), 30)
+        self.assertEqual(Board.objects.filter(slug__startswith='bench').count(), 40)
+
+        #  Counters match the bulk inserted rows
+        hot = Board.objects.order_by('-comment_count').first()
+        self.assertEqual(hot.comment_count, hot.comment.count())
+        self.assertGreater(hot.comment_count, 1)
+
+        report = benchmark.run(iterations=2)
+        for name, row in report.items():
+            self.assertEqual(row['status'], 200, name)
+        self.assertIsNotNone(report['home']['queries'])
+        self.assertIn('p50', benchmark.format_report(report, report))
+
+
+class LoginBenchmarkTestCase(TransactionTestCase):
+    """Logins run in other threads, which only see committed rows"""
+
+    def setUp(self) -> None:
+        patcher = mock.patch.object(presence, 'client', LocalRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for attribute, value in (('interval', None), ('pending_views', {})):
+            patcher = mock.patch.object(view_counter, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_login_throughput(self):
+        benchmark.seed(users=4, boards=2, comments=2, likes=2, log=lambda line: None)
+        report = benchmark.login_throughput(threads=2, seconds=0.3)
+        self.assertGreater(report['logins'], 0)
+        self.assertEqual(report['failed'], 0)
+        self.assertEqual(report['per_core'], round(report['per_second'] / report['cores'], 1))
+
+
+class HomeViewTestCase(TestCase):
+
+    def setUp(self) -> None:
+        #  Tests run inside a transaction, keep the pool regardless
+        npc_pool.invalidate()
+        for patcher in (mock.patch.object(npc_pool, 'keepable', return_value=True),
+                        mock.patch.object(presence, 'client', LocalRedis())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(npc_pool.invalidate)
+        self.client = Client()
+
+    def add_npc(self, title, lines):
+        npc = FullSizeNPC.objects.create(image="main/images/NPC/npc.png", title=title, alt=title)
+        npc.dialogue.set([Dialogue.objects.create(content=line) for line in lines])
+        return npc
+
+    def test_default_npc(self):
+        data = self.client.get('/api/main/home').json()
+        self.assertEqual(data['NPC']['title'], "Hunter")
+        self.assertEqual(data['NPC']['dialogue'][0]['content'], "Welcome to Vivacity")
+        self.assertEqual(data['online_users'], 0)
+
+    def test_pool(self):
+        self.add_npc("Hunter", ["Hello"])
+        self.add_npc("Gatherer", ["Hi", "Bye"])
+        self.client.get('/api/main/home')
+        #  Served from the pool
+        with self.assertNumQueries(0):
+            titles = {self.client.get('/api/main/home').json()['NPC']['title'] for _ in range(30)}
+        self.assertEqual(titles, {"Hunter", "Gatherer"})
+
+    def test_pool_invalidation(self):
+        npc = self.add_npc("Hunter", ["Hello"])
+        self.client.get('/api/main/home')
+        npc.dialogue.add(Dialogue.objects.create(content="Welcome back"))
+        lines = [line['content'] for line in self.client.get('/api/main/home').json()['NPC']['dialogue']]
+        self.assertEqual(lines, ["Hello", "Welcome back"])
+
+        npc.title = "Hunted"
+        npc.save()
+        self.assertEqual(self.client.get('/api/main/home').json()['NPC']['title'], "Hunted")
+
+
+class MailQueueTestCase(TestCase):
+
+    def setUp(self) -> None:
+        #  Just after the messages of the test are queued
+        self.now = timezone.now() + datetime.timedelta(seconds=1)
+
+    def test_signup_queues_mail(self):
+        response = Client().post('/api/user/create', {
+            'email': 'newuser@email.com',
+            'username': 'NewUser',
+            'password': 'NewUserPassword',
+            'date_of_birth': '1990-06-20'
+        })
+        self.assertEqual(response.status_code, 201)
+        #  Nothing sent during the request
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxMessage.objects.get().subject, 'Activate your Vivacity account.')
+
+        self.assertEqual(send_all_queued(), {'sent': 1, 'retrying': 0, 'failed': 0})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("NewUser", mail.outbox[0].body)
+        self.assertIsNotNone(OutboxMessage.objects.get().sent_on_date)
+
+    def test_batches_share_a_connection(self):
+        for i in range(5):
+            queue_mail(f"Message {i}", "Body", [f"to{i}@email.com"])
+        with mock.patch('main.mail.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertEqual(send_queued(batch_size=3)['sent'], 3)
+            self.assertEqual(send_queued(batch_size=3)['sent'], 2)
+        self.assertEqual(get_connection.call_count, 2)
+        self.assertEqual([message.subject for message in mail.outbox], [f"Message {i}" for i in range(5)])
+        self.assertEqual(mail.outbox[4].to, ["to4@email.com"])
+
+    def test_retry_with_backoff(self):
+        queue_mail("Flaky", "Body", ["to@email.com"])
+        error = smtplib.SMTPException("Try again later")
+        with mock.patch.object(EmailMessage, 'send', side_effect=error):
+            self.assertEqual(send_queued(now=self.now)['retrying'], 1)
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.attempts, 1)
+        self.assertEqual(message.last_error, "Try again later")
+        self.assertEqual(message.send_after, self.now + datetime.timedelta(seconds=60))
+
+        #  Not retried before its backoff ran out
+        self.assertEqual(send_queued(now=self.now + datetime.timedelta(seconds=30))['sent'], 0)
+        with mock.patch.object(EmailMessage, 'send', side_effect=error):
+            send_queued(now=self.now + datetime.timedelta(seconds=61))
+        #  Waits twice as long after the second failure
+        message.refresh_from_db()
+        self.assertEqual(message.send_after, self.now + datetime.timedelta(seconds=61 + 120))
+
+        self.assertEqual(send_queued(now=self.now + datetime.timedelta(seconds=200))['sent'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(MAIL_MAX_ATTEMPTS=2)
+    def test_gives_up(self):
+        queue_mail("Doomed", "Body", ["to@email.com"])
+        with mock.patch.object(EmailMessage, 'send', side_effect=smtplib.SMTPException("No")):
+            send_queued(now=self.now)
+            report = send_queued(now=self.now + datetime.timedelta(days=1))
+        self.assertEqual(report['failed'], 1)
+        self.assertTrue(OutboxMessage.objects.get().failed)
+        self.assertEqual(send_queued(now=self.now + datetime.timedelta(days=2))['sent'], 0)
+
+
+class ContentStorageTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings = override_settings(MEDIA_ROOT=self.media, MEDIA_MAX_AGE=600)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def refs(self, name):
+        return StoredFile.objects.get(name=name).refs
+
+    def test_identical_files_stored_once(self):
+        first = content_storage.save('items/item_image/a.PNG', ContentFile(b'same'))
+        second = content_storage.save('main/images/b.png', ContentFile(b'same'))
+        other = content_storage.save('items/item_image/a.png', ContentFile(b'other'))
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith('cas/') and first.endswith('.png'))
+        self.assertNotEqual(first, other)
+        self.assertEqual(self.refs(first), 2)
+
+        #  The file stays until its last reference goes
+        content_storage.delete(first)
+        self.assertTrue(content_storage.exists(first))
+        self.assertEqual(self.refs(first), 1)
+        content_storage.delete(first)
+        self.assertFalse(content_storage.exists(first))
+        self.assertFalse(StoredFile.objects.filter(name=first).exists())
+
+    def test_replaced_and_deleted_rows_release(self):
+        #  Nothing commits inside a test, run what waits on it
+        patcher = mock.patch.object(transaction, 'on_commit', side_effect=lambda run: run())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        item = Item.objects.create(title="Sword", create_stats=False, image=ContentFile(b'old', name='old.png'))
+        old = item.image.name
+        self.assertEqual(self.refs(old), 1)
+
+        item = Item.objects.get(pk=item.pk)
+        item.image = ContentFile(b'new', name='new.png')
+        item.save()
+        new = item.image.name
+        self.assertFalse(content_storage.exists(old))
+        self.assertFalse(StoredFile.objects.filter(name=old).exists())
+        self.assertEqual(self.refs(new), 1)
+
+        #  A save that fails keeps the file its row still points at
+        item.image = ContentFile(b'newer', name='newer.png')
+        with mock.patch.object(Item, '_save_table', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                item.save()
+        self.assertTrue(content_storage.exists(new))
+        item = Item.objects.get(pk=item.pk)
+
+        #  Saves that keep the file keep its reference
+        item.title = "Renamed"
+        item.save()
+        #  and read no names when they don't write the file
+        with self.assertNumQueries(1):
+            item.save(update_fields=['title'])
+        self.assertEqual(self.refs(new), 1)
+        item.delete()
+        self.assertFalse(content_storage.exists(new))
+
+    def test_content_address_media(self):
+        for name in ('items/item_image/sword.png', 'main/images/NPC/npc.png', 'main/images/NPC/copy.png'):
+            default_storage.save(name, ContentFile(b'image'))
+        item = Item.objects.create(title="Sword", create_stats=False, image='items/item_image/sword.png')
+        npc = FullSizeNPC.objects.create(title="NPC", image='main/images/NPC/npc.png')
+        copy = FullSizeNPC.objects.create(title="Copy", image='main/images/NPC/copy.png')
+        same = FullSizeNPC.objects.create(title="Same", image='main/images/NPC/npc.png')
+        lost = FullSizeNPC.objects.create(title="Lost", image='main/images/NPC/lost.png')
+
+        out = StringIO()
+        call_command('content_address_media', '--delete-originals', stdout=out)
+        self.assertIn('Moved 3 files, 1 files missing', out.getvalue())
+        name = Item.objects.get(pk=item.pk).image.name
+        self.assertTrue(name.startswith('cas/'))
+        for row in (npc, copy, same):
+            self.assertEqual(FullSizeNPC.objects.get(pk=row.pk).image.name, name)
+        self.assertEqual(FullSizeNPC.objects.get(pk=lost.pk).image.name, 'main/images/NPC/lost.png')
+        self.assertEqual(self.refs(name), 4)
+        self.assertFalse(default_storage.exists('items/item_image/sword.png'))
+
+    def test_recount(self):
+        used = content_storage.save('main/images/used.png', ContentFile(b'used'))
+        unused = content_storage.save('main/images/unused.png', ContentFile(b'unused'))
+        FullSizeNPC.objects.create(title="NPC", image=used)
+        FullSizeNPC.objects.create(title="Again", image=used)
+        StoredFile.objects.filter(name=used).update(refs=7)
+
+        self.assertEqual(recount(), {'counted': 1, 'removed': 1})
+        self.assertEqual(self.refs(used), 2)
+        self.assertFalse(content_storage.exists(unused))
+
+    def test_cache_headers(self):
+        name = content_storage.save('main/images/cached.png', ContentFile(b'cached'))
+        default_storage.save('items/item_image/legacy.png', ContentFile(b'legacy'))
+        #  Only routed under DEBUG, which the url patterns read on import
+        request = RequestFactory().get('/media/')
+        response = serve_media(request, name, self.media)
+        self.assertEqual(response['Cache-Control'], IMMUTABLE)
+        response = serve_media(request, 'items/item_image/legacy.png', self.media)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=600')
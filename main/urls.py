@@ -5,4 +5,5 @@ from . import views
 
 urlpatterns = [
     path('home', views.HomeView.as_view(), name="home"),
+    path('metrics', views.MetricsView.as_view(), name="metrics"),
 ]
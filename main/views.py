@@ -1,20 +1,19 @@
-import random
-
+from django.conf import settings
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from main.caches import npc_pool
 from main.models import FullSizeNPC, Dialogue
 from main.serializers import NPCSerializer
-from users.models import User
+from users.presence import presence
+from vivacity_api.middleware import metrics
 
 
-def get_NPC():
-    all_NPC_characters = FullSizeNPC.objects.all()
-    if all_NPC_characters.count() > 0:
-        rand_int = random.randint(0, (len(all_NPC_characters) - 1))
-        npc = all_NPC_characters[rand_int]
-    else:
+def load_NPCs():
+    """Every NPC serialized with its dialogue, for npc_pool"""
+    if not FullSizeNPC.objects.exists():
         if Dialogue.objects.all().count() < 1:
             Dialogue.objects.create(
                 content="Welcome to Vivacity"
@@ -27,20 +26,33 @@ def get_NPC():
         )
         npc.dialogue.add(Dialogue.objects.all()[0])
 
-    return npc
+    return NPCSerializer(FullSizeNPC.objects.prefetch_related('dialogue'), many=True).data
+
+
+def get_NPC():
+    """A random serialized NPC, from the pool kept in memory"""
+    return npc_pool.pick(load_NPCs)
 
 
 def get_online_users():
-    users_count = User.objects.filter(online=True).count()
-    return users_count
+    return presence.online_count()
 
 
 class HomeView(APIView):
 
     def get(self, request, *args, **kwargs):
         data = {}
-        npc = get_NPC()
-        serialized_npc = NPCSerializer(npc)
-        data['NPC'] = serialized_npc.data
+        data['NPC'] = get_NPC()
         data['online_users'] = get_online_users()
         return Response(data, status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """Per view query count, database, serializer and wall time
+    percentiles (in milliseconds) gathered by TimingMiddleware
+    """
+    authentication_classes = settings.AUTH_CLASSES
+    permission_classes = [IsAdminUser, ]
+
+    def get(self, request, *args, **kwargs):
+        return Response(metrics.summary(), status=status.HTTP_200_OK)
@@ -0,0 +1,62 @@
+"""User activity stats. Boards, comments, likes given and likes
+received are counted for any amount of users in one grouped query,
+and kept per user in UserActivity so profiles read a single row
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from boards.models import Board, Comment, BoardLike, CommentLike, count_of
+from .models import UserActivity
+
+FIELDS = ('boards', 'comments', 'likes_given', 'likes_received')
+
+
+def activity_annotations():
+    return {
+        'boards': count_of(Board, 'author'),
+        'comments': count_of(Comment, 'author'),
+        'likes_given': count_of(BoardLike, 'author') + count_of(CommentLike, 'author'),
+        'likes_received': count_of(BoardLike, 'board__author') + count_of(CommentLike, 'comment__author'),
+    }
+
+
+def activity_for(users) -> dict:
+    """Live activity of 'users' (users or pks) in one query, keyed
+    by user pk
+    """
+    pks = [getattr(user, 'pk', user) for user in users]
+    rows = get_user_model().objects.filter(pk__in=pks)\
+        .annotate(**activity_annotations())\
+        .values('pk', *FIELDS)
+    return {row.pop('pk'): row for row in rows}
+
+
+def materialize(users, replace=False) -> list:
+    """Counts and stores the UserActivity rows of 'users', with
+    'replace' existing rows are recounted from scratch
+    """
+    with transaction.atomic():
+        # Counted in the transaction that stores it
+        counted = activity_for(users)
+        if replace:
+            UserActivity.objects.filter(user__in=list(counted)).delete()
+        # Another request may have stored the same row meanwhile
+        return UserActivity.objects.bulk_create([
+            UserActivity(user_id=pk, **totals) for pk, totals in counted.items()
+        ], ignore_conflicts=True)
+
+
+def activity_of(users) -> dict:
+    """UserActivity of every one of 'users' keyed by user pk, the
+    rows missing are counted and stored in one more query
+    """
+    pks = [getattr(user, 'pk', user) for user in users]
+    rows = UserActivity.objects.in_bulk(pks)
+    missing = [pk for pk in pks if pk not in rows]
+    if missing:
+        rows.update({row.user_id: row for row in materialize(missing)})
+    return rows
+
+
+def user_activity(user) -> UserActivity:
+    return activity_of([user])[user.pk]
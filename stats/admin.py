@@ -1 +1,10 @@
-# Register your models here.
+from django.contrib import admin
+
+from .models import UserActivity
+
+
+@admin.register(UserActivity)
+class UserActivityAdmin(admin.ModelAdmin):
+    list_display = ('user', 'boards', 'comments', 'likes_given', 'likes_received')
+    list_select_related = ('user', )
+    readonly_fields = ('user', 'boards', 'comments', 'likes_given', 'likes_received')
@@ -0,0 +1,16 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from stats.activity import materialize
+
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = "Recounts the stored activity totals of every user"
+
+    def handle(self, *args, **options):
+        pks = list(get_user_model().objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(pks), CHUNK_SIZE):
+            materialize(pks[start:start + CHUNK_SIZE], replace=True)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt activity of {len(pks)} users'))
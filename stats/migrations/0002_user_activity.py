@@ -0,0 +1,26 @@
+# Generated by Django 3.0.4 on 2026-10-18 18:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_search_index'),
+        ('stats', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserActivity',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='activity', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('boards', models.IntegerField(default=0)),
+                ('comments', models.IntegerField(default=0)),
+                ('likes_given', models.IntegerField(default=0)),
+                ('likes_received', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,4 +1,11 @@
-from django.db import models
+from django.contrib.auth import get_user_model
+from django.db import models, transaction
+from django.db.models import F, Subquery
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from boards.models import Board, Comment, BoardLike, CommentLike
+from vivacity_api.settings import AUTH_USER_MODEL as User
 
 
 class ObjectStats(models.Model):
@@ -19,3 +26,90 @@ class ObjectStats(models.Model):
 
     def __str__(self):
         return self.object_class
+
+
+class UserActivity(models.Model):
+    """Materialized activity totals of one user, created on first
+    use by stats.activity or the receivers below, which keep it current
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="activity"
+    )
+    boards = models.IntegerField(default=0)
+    comments = models.IntegerField(default=0)
+    likes_given = models.IntegerField(default=0)
+    likes_received = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.user}'
+
+
+def adjust_activity(user, created=False, **amounts):
+    """Adds 'amounts' to the activity row of 'user' (a pk or a
+    subquery selecting one) in a single UPDATE. A user without a row
+    yet gets it counted when something of theirs is 'created', in the
+    same transaction, so the row never misses it. Deletions skip them,
+    their row is counted without what was deleted
+    """
+    if user is None:
+        return 0
+    with transaction.atomic():
+        updated = UserActivity.objects.filter(user=user)\
+            .update(**{field: F(field) + amount for field, amount in amounts.items()})
+        if not updated and created:
+            from .activity import materialize
+            materialize(get_user_model().objects.filter(pk=user).values_list('pk', flat=True))
+    return updated
+
+
+def author_of(model, pk):
+    return Subquery(model.objects.filter(pk=pk).values('author')[:1])
+
+
+@receiver(post_save, sender=Board)
+def board_created(sender, instance=None, created=False, **kwargs):
+    if created:
+        adjust_activity(instance.author_id, created=True, boards=1)
+
+
+@receiver(post_delete, sender=Board)
+def board_deleted(sender, instance=None, **kwargs):
+    adjust_activity(instance.author_id, boards=-1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance=None, created=False, **kwargs):
+    if created:
+        adjust_activity(instance.author_id, created=True, comments=1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance=None, **kwargs):
+    adjust_activity(instance.author_id, comments=-1)
+
+
+@receiver(post_save, sender=BoardLike)
+@receiver(post_save, sender=CommentLike)
+def like_created(sender, instance=None, created=False, **kwargs):
+    if created:
+        adjust_like(instance, 1)
+
+
+@receiver(post_delete, sender=BoardLike)
+@receiver(post_delete, sender=CommentLike)
+def like_deleted(sender, instance=None, **kwargs):
+    # Cascades delete likes before what was liked, so its author
+    # can still be looked up here
+    adjust_like(instance, -1)
+
+
+def adjust_like(like, amount):
+    adjust_activity(like.author_id, created=amount > 0, likes_given=amount)
+    if isinstance(like, BoardLike):
+        liked = author_of(Board, like.board_id)
+    else:
+        liked = author_of(Comment, like.comment_id)
+    adjust_activity(liked, created=amount > 0, likes_received=amount)
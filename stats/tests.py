@@ -1,6 +1,12 @@
+import os
+
+from django.core.management import call_command
 from django.test import TestCase
 
+from boards.models import Board, Comment, BoardLike, CommentLike
 from items.models import Item, ItemCategory
+from stats.activity import activity_for, activity_of, user_activity
+from stats.models import UserActivity
 from users.models import User
 
 
@@ -33,3 +39,71 @@ class StatsTestCase(TestCase):
             f'{type(self.item1).__name__}#{self.item1.item_number}',
             self.item1.stats.object_class
         )
+
+
+class UserActivityTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.users = [
+            User.objects.create(
+                email=f"user{i}@email.com",
+                date_of_birth="1980-03-20",
+                username=f"User{i}",
+                password="nonAuthPassword"
+            ) for i in range(3)
+        ]
+        author, fan, _ = self.users
+        self.board = Board.objects.create(
+            author=author,
+            title="This is the test title",
+            content="This could go on and on, so i won't let it."
+        )
+        self.comment = Comment.objects.create(board=self.board, author=fan, content="Grateful")
+        BoardLike.objects.create(board=self.board, author=fan)
+        CommentLike.objects.create(comment=self.comment, author=author)
+
+    def test_activity_for(self):
+        with self.assertNumQueries(1):
+            activity = activity_for(self.users)
+        author, fan, idle = [activity[user.pk] for user in self.users]
+        self.assertEqual(author, {'boards': 1, 'comments': 0, 'likes_given': 1, 'likes_received': 1})
+        self.assertEqual(fan, {'boards': 0, 'comments': 1, 'likes_given': 1, 'likes_received': 1})
+        self.assertEqual(idle, {'boards': 0, 'comments': 0, 'likes_given': 0, 'likes_received': 0})
+
+    def test_materialized(self):
+        author, fan, idle = self.users
+        #  Counted once for every user, then read back in one query
+        activity_of(self.users)
+        with self.assertNumQueries(1):
+            activity_of(self.users)
+
+        Board.objects.create(author=author, title="Second", content="More")
+        BoardLike.objects.create(board=self.board, author=idle)
+        self.assertEqual(user_activity(author).boards, 2)
+        self.assertEqual(user_activity(author).likes_received, 2)
+        self.assertEqual(user_activity(idle).likes_given, 1)
+
+        #  Cascading deletes take their likes with them
+        self.board.delete()
+        self.assertEqual(user_activity(author).boards, 1)
+        self.assertEqual(user_activity(author).likes_received, 0)
+        self.assertEqual(user_activity(author).likes_given, 0)
+        self.assertEqual(user_activity(fan).comments, 0)
+        self.assertEqual(user_activity(fan).likes_received, 0)
+
+    def test_created_on_first_activity(self):
+        author, fan, idle = self.users
+        #  The setUp activity stored a row for both, idle has none yet
+        self.assertEqual(UserActivity.objects.get(user=author).likes_received, 1)
+        self.assertFalse(UserActivity.objects.filter(user=idle).exists())
+        CommentLike.objects.create(comment=self.comment, author=idle)
+        self.assertEqual(UserActivity.objects.get(user=idle).likes_given, 1)
+        #  Read from the stored row
+        with self.assertNumQueries(1):
+            self.assertEqual(idle.has_liked_count, 1)
+
+    def test_rebuild(self):
+        activity_of(self.users)
+        UserActivity.objects.update(boards=9)
+        call_command('rebuild_user_activity', stdout=open(os.devnull, 'w'))
+        self.assertEqual(user_activity(self.users[0]).boards, 1)
@@ -0,0 +1,183 @@
+"""Avatar image pipeline. An uploaded avatar is hashed while the user
+is saved. Variants of an image that was already processed are reused
+at once, anything new is resized into fixed size variants in every
+format the installed Pillow can write, by a pool of AVATAR_WORKERS
+threads once the upload is committed. Variants are named by the
+image's sha256, so identical uploads share one set of files and a
+name never changes content. Serializers ask avatar_url for the size
+they show, falling back to the uploaded files until processing is done
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from boards.caches import forum_widget_cache
+from vivacity_api.authentication import forget_user
+from .models import User, AvatarImage
+
+logger = logging.getLogger(__name__)
+
+#  Variant: (size, crop to fill it). Uncropped variants keep their
+#  aspect ratio and fit inside the size
+VARIANTS = {
+    'full': ((300, 516), False),
+    'thumbnail': ((120, 120), True),
+    'icon': ((48, 48), True),
+}
+#  Every variant exists in this format, whatever else is available
+FALLBACK_FORMAT = 'png'
+ENCODERS = {
+    'avif': ('AVIF', {'quality': 60}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'png': ('PNG', {'optimize': True}),
+}
+
+
+def available_formats() -> list:
+    """The AVATAR_FORMATS the installed Pillow can write"""
+    try:
+        # AVIF comes from a plugin on Pillow before 11
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        pass
+    Image.init()
+    formats = [fmt for fmt in settings.AVATAR_FORMATS if ENCODERS[fmt][0] in Image.SAVE]
+    if FALLBACK_FORMAT not in formats:
+        formats.append(FALLBACK_FORMAT)
+    return formats
+
+
+def file_digest(file) -> str:
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def variant_name(digest, variant, fmt) -> str:
+    return f'avatars/variants/{digest[:2]}/{digest}-{variant}.{fmt}'
+
+
+def render(file, formats) -> dict:
+    """Encoded bytes of every variant in every format, by (variant, format)"""
+    with Image.open(file) as uploaded:
+        image = ImageOps.exif_transpose(uploaded).convert('RGBA')
+    rendered = {}
+    for variant, (size, crop) in VARIANTS.items():
+        if crop:
+            resized = ImageOps.fit(image, size, Image.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+        for fmt in formats:
+            encoder, options = ENCODERS[fmt]
+            buffer = io.BytesIO()
+            resized.save(buffer, encoder, **options)
+            rendered[(variant, fmt)] = buffer.getvalue()
+    return rendered
+
+
+def process_avatar(digest, source, user_pk=None):
+    """Makes the variants of the image 'digest' from the file 'source'
+    unless they exist, then shows them on the avatar of 'user_pk' if it
+    is still that upload
+    """
+    image = AvatarImage.objects.get(pk=digest)
+    if not image.ready:
+        formats = available_formats()
+        with User._meta.get_field('avatar').storage.open(source) as file:
+            rendered = render(file, formats)
+        for (variant, fmt), data in rendered.items():
+            name = variant_name(digest, variant, fmt)
+            if not default_storage.exists(name):
+                default_storage.save(name, ContentFile(data))
+        AvatarImage.objects.filter(pk=digest).update(
+            formats=','.join(formats),
+            processed_on_date=timezone.now()
+        )
+    if user_pk is not None:
+        User.objects.filter(pk=user_pk, avatar=source).update(avatar_image=digest)
+        forget_user(user_pk)
+        # update() sends no signals, the widget shows author avatars
+        forum_widget_cache.invalidate()
+
+
+def prepare_avatar(user) -> bool:
+    """Called as 'user' is saved. Returns True when it carries a new
+    upload that needs processing, an upload of an image that was
+    processed before gets its variants straight away
+    """
+    avatar = user.avatar
+    if not avatar or avatar._committed:
+        return False
+    user._avatar_digest = file_digest(avatar.file)
+    image = AvatarImage.objects.filter(pk=user._avatar_digest).first()
+    user.avatar_image = image if image is not None and image.ready else None
+    return user.avatar_image is None
+
+
+def schedule_avatar(user):
+    """Queues processing of the upload prepare_avatar found, once the
+    transaction that saved it commits
+    """
+    digest, source, user_pk = user._avatar_digest, user.avatar.name, user.pk
+    AvatarImage.objects.get_or_create(digest=digest, defaults={'source': source})
+    transaction.on_commit(lambda: submit(digest, source, user_pk))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def submit(digest, source, user_pk):
+    global _executor
+    if not settings.AVATAR_WORKERS:
+        return run(digest, source, user_pk)
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.AVATAR_WORKERS, thread_name_prefix='avatars')
+    return _executor.submit(run, digest, source, user_pk)
+
+
+def run(digest, source, user_pk):
+    try:
+        process_avatar(digest, source, user_pk)
+    except Exception:
+        # The upload keeps being served, process_avatars retries it
+        logger.exception("Could not process avatar %s", digest)
+    finally:
+        if settings.AVATAR_WORKERS:
+            # Worker threads each hold their own connection
+            connection.close()
+
+
+def avatar_url(user, variant='thumbnail', fmt=FALLBACK_FORMAT):
+    """URL of the 'variant' of the avatar of 'user' in 'fmt', or of the
+    uploaded avatar or thumbnail until the variants exist
+    """
+    image = user.avatar_image
+    if image is None or fmt not in image.format_list:
+        uploaded = user.avatar if variant == 'full' else user.avatar_thumbnail
+        return uploaded.url
+    return default_storage.url(variant_name(image.pk, variant, fmt))
+
+
+def avatar_sources(user, variant='thumbnail') -> dict:
+    """URLs of 'variant' in the formats smaller than the fallback, for
+    clients that pick by what they support
+    """
+    image = user.avatar_image
+    if image is None:
+        return {}
+    return {fmt: avatar_url(user, variant, fmt) for fmt in image.format_list if fmt != FALLBACK_FORMAT}
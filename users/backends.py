@@ -0,0 +1,48 @@
+"""Authentication backend for logins. It is ModelBackend loading the
+wallet and token a login responds with in the same query as the user,
+so a login costs one query besides the password hash. Hashes wait for
+one of the hash_slots, see users/hashers.py. When none frees up the
+login fails like a wrong password would, for every caller of
+authenticate, and the request is marked hashing_busy for views that
+answer it differently
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from .hashers import hash_slots, HashingBusy
+
+UserModel = get_user_model()
+
+
+class LoginBackend(ModelBackend):
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        try:
+            return self.check_login(username, password, **kwargs)
+        except HashingBusy:
+            if request is not None:
+                request.hashing_busy = True
+            return None
+
+    def check_login(self, username, password, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager\
+                .select_related('wallet', 'auth_token')\
+                .get(**{UserModel.USERNAME_FIELD: username})
+        except UserModel.DoesNotExist:
+            # Hash the password anyway so an unknown username takes as
+            # long as a wrong password (see ModelBackend)
+            with hash_slots.hold():
+                UserModel().set_password(password)
+            return None
+        # Also rehashes a password whose hasher or parameters are not
+        # the current ones
+        with hash_slots.hold():
+            correct = user.check_password(password)
+        if correct and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,6 @@
+from django.conf import settings
+
+from vivacity_api.cache import WarmPool
+
+#  Interest titles sorted for prefix lookups, see users/interests.py
+interest_index = WarmPool(ttl=getattr(settings, 'INTEREST_INDEX_TTL', 300))
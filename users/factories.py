@@ -1,34 +1,29 @@
-from faker import Faker
 import factory
-from .models import User
-import factory
-from faker import Faker
 
 from .models import User
 
-faker = Faker()
-
 
 class UserFactory(factory.django.DjangoModelFactory):
     class Meta:
         model = User
         django_get_or_create = ('username',)
 
-    email = faker.ascii_safe_email()
-    username = email.split('@')[0]
-    password = faker.word(ext_word_list=None)
-    first_name = faker.first_name()
-    last_name = faker.last_name()
-    date_of_birth = faker.date_of_birth(
+    username = factory.Sequence(lambda n: f'user{n}')
+    email = factory.LazyAttribute(lambda user: f'{user.username}@example.com')
+    password = factory.Faker('word')
+    first_name = factory.Faker('first_name')
+    last_name = factory.Faker('last_name')
+    date_of_birth = factory.Faker(
+        'date_of_birth',
         tzinfo=None,
         minimum_age=18,
         maximum_age=115
     )
-    location = faker.state()
-    occupation = faker.job()
-    tag = faker.paragraph(nb_sentences=1, variable_nb_sentences=True, ext_word_list=None)
-    bio = faker.paragraph(nb_sentences=4, variable_nb_sentences=True, ext_word_list=None)
-    display_full_name = faker.pybool()
-    display_date_of_birth = faker.pybool()
-    display_location = faker.pybool()
-    display_occupation = faker.pybool()
+    location = factory.Faker('state')
+    occupation = factory.Faker('job')
+    tag = factory.Faker('paragraph', nb_sentences=1, variable_nb_sentences=True, ext_word_list=None)
+    bio = factory.Faker('paragraph', nb_sentences=4, variable_nb_sentences=True, ext_word_list=None)
+    display_full_name = factory.Faker('pybool')
+    display_date_of_birth = factory.Faker('pybool')
+    display_location = factory.Faker('pybool')
+    display_occupation = factory.Faker('pybool')
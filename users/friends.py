@@ -0,0 +1,98 @@
+"""Friends graph. User.friends is symmetrical, so every friendship is
+two rows of its through table, one from each side, and a user's friends
+are the to_user of the rows from them. Lookups here are subqueries over
+those rows, so a friend list, a mutual list or a suggestion ranking is
+one query whatever the number of friends, and nothing loads every
+friend of a user. Profiles show the first FRIENDS_PREVIEW friends and
+the count, the rest is paged through the friends API
+"""
+from django.db.models import Count
+
+from .models import User
+
+Friendship = User.friends.through
+
+FRIENDS_PREVIEW = 20
+SUGGESTIONS = 10
+#  Most usernames one bulk add or remove takes
+MAX_BULK = 500
+
+
+def friend_ids(user_pk):
+    """Subquery of the pks of the friends of 'user_pk'"""
+    return Friendship.objects.filter(from_user=user_pk).values('to_user')
+
+
+def friends_of(user_pk):
+    return User.objects.filter(pk__in=friend_ids(user_pk))
+
+
+def friend_count(user_pk) -> int:
+    return Friendship.objects.filter(from_user=user_pk).count()
+
+
+def preview(user_pk, limit=None) -> list:
+    """The first friends of 'user_pk' by username, as profiles show them"""
+    friends = friends_of(user_pk).select_related('avatar_image').order_by('username')
+    return list(friends[:limit or FRIENDS_PREVIEW])
+
+
+def bulk(usernames) -> list:
+    usernames = list(usernames)
+    if len(usernames) > MAX_BULK:
+        raise ValueError(f'At most {MAX_BULK} usernames at once, not {len(usernames)}')
+    return usernames
+
+
+def add_friends(user, usernames) -> list:
+    """Befriends 'user' with the active users among 'usernames', both
+    ways, in a query per side. Returns the pks of the users found,
+    friends before or not
+    """
+    pks = list(
+        User.objects.filter(username__in=bulk(usernames), is_active=True)
+        .exclude(pk=user.pk)
+        .values_list('pk', flat=True)
+    )
+    if pks:
+        # Rows that already exist are skipped by add
+        user.friends.add(*pks)
+    return pks
+
+
+def remove_friends(user, usernames) -> int:
+    """Unfriends 'user' and 'usernames' both ways in one delete,
+    returns how many friendships ended
+    """
+    pks = list(User.objects.filter(username__in=bulk(usernames)).values_list('pk', flat=True))
+    ended = Friendship.objects.filter(from_user=user.pk, to_user__in=pks).count()
+    if ended:
+        user.friends.remove(*pks)
+    return ended
+
+
+def mutual_friends(user_pk, other_pk):
+    """Queryset of the users both 'user_pk' and 'other_pk' are friends with"""
+    return friends_of(user_pk).filter(pk__in=friend_ids(other_pk))
+
+
+def suggestions(user_pk, limit=SUGGESTIONS) -> list:
+    """Friends of friends 'user_pk' is not friends with, most mutual
+    friends first. Every user returned carries its 'mutual' count
+    """
+    friends = friend_ids(user_pk)
+    ranked = Friendship.objects\
+        .filter(from_user__in=friends, to_user__is_active=True)\
+        .exclude(to_user__in=friends)\
+        .exclude(to_user=user_pk)\
+        .values('to_user')\
+        .annotate(mutual=Count('from_user'))\
+        .order_by('-mutual', 'to_user')[:limit]
+    mutual = {row['to_user']: row['mutual'] for row in ranked}
+    users = User.objects.select_related('avatar_image').in_bulk(list(mutual))
+    suggested = []
+    for pk, count in mutual.items():
+        if pk in users:
+            users[pk].mutual = count
+            suggested.append(users[pk])
+    return suggested
@@ -0,0 +1,177 @@
+"""Password hashing policy. PASSWORD_HASH_ALGORITHM picks the hasher
+new passwords are hashed with, the other hashers in PASSWORD_HASHERS
+still check older hashes. A successful login rehashes a password made
+by another hasher, or with other parameters than PASSWORD_SCRYPT or
+PASSWORD_ARGON2 now give, through check_password in LoginBackend.
+Parameters are measured for a server with the calibrate_hashing
+command.
+
+Logins hash through hash_slots, which lets LOGIN_HASH_CONCURRENCY
+hashes run at once per process. A burst of logins waits its turn
+instead of taking every core from the other requests, and gets
+HashingBusy after LOGIN_HASH_TIMEOUT seconds
+"""
+import base64
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.utils.crypto import constant_time_compare
+from django.utils.translation import gettext_noop as _
+
+
+class ScryptPasswordHasher(hashers.BasePasswordHasher):
+    """scrypt from the standard library, in the format of the scrypt
+    hasher of later Django versions: scrypt$n$salt$r$p$hash
+    """
+    algorithm = 'scrypt'
+
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_SCRYPT['n']
+
+    @property
+    def block_size(self):
+        return settings.PASSWORD_SCRYPT['r']
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_SCRYPT['p']
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        assert password is not None
+        assert salt and '$' not in salt
+        n = n or self.work_factor
+        r = r or self.block_size
+        p = p or self.parallelism
+        hash = hashlib.scrypt(
+            password.encode(),
+            salt=salt.encode(),
+            n=n,
+            r=r,
+            p=p,
+            # Twice what n and r need, OpenSSL refuses past 32MB otherwise
+            maxmem=256 * n * r,
+            dklen=64,
+        )
+        hash = base64.b64encode(hash).decode('ascii').strip()
+        return '%s$%d$%s$%d$%d$%s' % (self.algorithm, n, salt, r, p, hash)
+
+    def decode(self, encoded) -> dict:
+        algorithm, n, salt, r, p, hash = encoded.split('$', 5)
+        assert algorithm == self.algorithm
+        return {'n': int(n), 'salt': salt, 'r': int(r), 'p': int(p), 'hash': hash}
+
+    def verify(self, password, encoded):
+        decoded = self.decode(encoded)
+        encoded_2 = self.encode(password, decoded['salt'], decoded['n'], decoded['r'], decoded['p'])
+        return constant_time_compare(encoded, encoded_2)
+
+    def safe_summary(self, encoded):
+        decoded = self.decode(encoded)
+        return OrderedDict([
+            (_('algorithm'), self.algorithm),
+            (_('work factor'), decoded['n']),
+            (_('block size'), decoded['r']),
+            (_('parallelism'), decoded['p']),
+            (_('salt'), hashers.mask_hash(decoded['salt'])),
+            (_('hash'), hashers.mask_hash(decoded['hash'])),
+        ])
+
+    def must_update(self, encoded):
+        decoded = self.decode(encoded)
+        return (decoded['n'], decoded['r'], decoded['p']) != (self.work_factor, self.block_size, self.parallelism)
+
+    def harden_runtime(self, password, encoded):
+        # The parameters of a hash are its own, nothing to make up
+        pass
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """Django's Argon2 hasher with the parameters of PASSWORD_ARGON2,
+    needs argon2-cffi
+    """
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2['time_cost']
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2['memory_cost']
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2['parallelism']
+
+
+def calibrate_scrypt(target, r=8, p=1) -> dict:
+    """The smallest power of two n whose hash takes 'target' seconds"""
+    hasher = ScryptPasswordHasher()
+    n = 2 ** 12
+    while True:
+        seconds = min(
+            time_of(lambda: hasher.encode('calibrate', hasher.salt(), n, r, p))
+            for attempt in range(3)
+        )
+        if seconds >= target or n >= 2 ** 20:
+            return {'n': n, 'r': r, 'p': p}
+        n *= 2
+
+
+def calibrate_argon2(target, memory_cost=102400, parallelism=8) -> dict:
+    """The time cost whose hash takes 'target' seconds at 'memory_cost' KiB"""
+    argon2 = Argon2PasswordHasher()._load_library()
+    time_cost = 1
+    while True:
+        seconds = min(
+            time_of(lambda: argon2.low_level.hash_secret(
+                b'calibrate', os.urandom(16),
+                time_cost=time_cost,
+                memory_cost=memory_cost,
+                parallelism=parallelism,
+                hash_len=32,
+                type=argon2.low_level.Type.ID,
+            ))
+            for attempt in range(3)
+        )
+        if seconds >= target or time_cost >= 32:
+            return {'time_cost': time_cost, 'memory_cost': memory_cost, 'parallelism': parallelism}
+        time_cost += 1
+
+
+def time_of(run) -> float:
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+class HashingBusy(Exception):
+    """Every hash slot stayed taken for the whole wait"""
+
+
+class HashSlots:
+    """At most 'size' password hashes at once, see the module docstring"""
+
+    def __init__(self, size):
+        self.size = size
+        self.semaphore = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def hold(self, timeout=None):
+        if timeout is None:
+            timeout = settings.LOGIN_HASH_TIMEOUT
+        if not self.semaphore.acquire(timeout=timeout):
+            raise HashingBusy()
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+
+hash_slots = HashSlots(getattr(settings, 'LOGIN_HASH_CONCURRENCY', None) or os.cpu_count() or 1)
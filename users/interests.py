@@ -0,0 +1,62 @@
+"""Profile interests. set_interests replaces a user's interests with a
+fixed number of queries however many there are: one lookup of the
+titles that exist, one insert of those that don't and a diff of the
+user's interests. autocomplete finds titles by prefix in a sorted
+index kept in process by interest_index
+"""
+from bisect import bisect_left
+
+from django.db import transaction
+
+from .caches import interest_index
+from .models import Interest
+
+AUTOCOMPLETE_LIMIT = 10
+TITLE_LENGTH = Interest._meta.get_field('title').max_length
+
+
+def valid_title(title) -> bool:
+    return isinstance(title, str) and 0 < len(title) <= TITLE_LENGTH
+
+
+def set_interests(user, titles):
+    """Makes 'titles' the interests of 'user', creating the missing
+    ones. Raises ValueError on a title Interest cannot hold
+    """
+    titles = list(dict.fromkeys(titles))
+    if not all(valid_title(title) for title in titles):
+        raise ValueError("Invalid interest title")
+
+    with transaction.atomic():
+        pks = dict(Interest.objects.filter(title__in=titles).values_list('title', 'pk'))
+        missing = [title for title in titles if title not in pks]
+        if missing:
+            # Titles created meanwhile by another request are kept
+            Interest.objects.bulk_create([Interest(title=title) for title in missing], ignore_conflicts=True)
+            pks.update(Interest.objects.filter(title__in=missing).values_list('title', 'pk'))
+            # bulk_create sends no post_save to invalidate it
+            interest_index.invalidate()
+
+        wanted = set(pks.values())
+        current = set(user.interests.values_list('pk', flat=True))
+        if current - wanted:
+            user.interests.remove(*(current - wanted))
+        if wanted - current:
+            user.interests.add(*(wanted - current))
+
+
+def load_index() -> list:
+    """(lowercased title, title) of every interest, sorted"""
+    return sorted((title.lower(), title) for title in Interest.objects.values_list('title', flat=True))
+
+
+def autocomplete(prefix, limit=AUTOCOMPLETE_LIMIT) -> list:
+    """Titles starting with 'prefix' in any case, alphabetically"""
+    prefix = prefix.lower()
+    index = interest_index.items(load_index)
+    matches = []
+    for key, title in index[bisect_left(index, (prefix,)):]:
+        if not key.startswith(prefix) or len(matches) == limit:
+            break
+        matches.append(title)
+    return matches
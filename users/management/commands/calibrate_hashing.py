@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.hashers import calibrate_scrypt, calibrate_argon2
+
+
+class Command(BaseCommand):
+    help = "Measures the password hash parameters that take --target-ms on this server, " \
+           "to set as PASSWORD_SCRYPT or PASSWORD_ARGON2"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms', type=int, default=100, help="Milliseconds one hash should take")
+        parser.add_argument(
+            '--algorithm',
+            choices=['scrypt', 'argon2'],
+            default=None,
+            help="Defaults to PASSWORD_HASH_ALGORITHM",
+        )
+
+    def handle(self, *args, **options):
+        algorithm = options['algorithm'] or settings.PASSWORD_HASH_ALGORITHM
+        target = options['target_ms'] / 1000
+        if algorithm == 'scrypt':
+            self.stdout.write(self.style.SUCCESS(f'PASSWORD_SCRYPT = {calibrate_scrypt(target)}'))
+        elif algorithm == 'argon2':
+            try:
+                parameters = calibrate_argon2(target)
+            except ValueError as error:
+                raise CommandError(error)
+            self.stdout.write(self.style.SUCCESS(f'PASSWORD_ARGON2 = {parameters}'))
+        else:
+            raise CommandError(f"Only scrypt and argon2 take parameters, not {algorithm}")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from users.avatars import file_digest, process_avatar
+from users.models import User, AvatarImage
+
+
+class Command(BaseCommand):
+    help = "Makes the avatar variants of every uploaded avatar that has none yet, " \
+           "as for avatars uploaded before the pipeline or whose processing failed"
+
+    def handle(self, *args, **options):
+        pending = User.objects.filter(avatar_image=None)\
+            .exclude(avatar__startswith='avatars/DEFAULT/')\
+            .exclude(avatar='')\
+            .values_list('pk', 'avatar')
+        storage = User._meta.get_field('avatar').storage
+        processed = missing = 0
+        for pk, source in pending.iterator():
+            if not storage.exists(source):
+                missing += 1
+                continue
+            with storage.open(source) as file:
+                digest = file_digest(file)
+            AvatarImage.objects.get_or_create(digest=digest, defaults={'source': source})
+            process_avatar(digest, source, pk)
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} avatars, {missing} files missing'))
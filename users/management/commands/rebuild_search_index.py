@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from users.models import User, SearchKey, index_users
+
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the user search index from scratch"
+
+    def handle(self, *args, **options):
+        SearchKey.objects.all().delete()
+        users = User.objects.only('pk', 'username', 'first_name', 'display_full_name').order_by('pk')
+        indexed = 0
+        last_pk = 0
+        while True:
+            chunk = list(users.filter(pk__gt=last_pk)[:CHUNK_SIZE])
+            if not chunk:
+                break
+            indexed += index_users(chunk)
+            last_pk = chunk[-1].pk
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} values'))
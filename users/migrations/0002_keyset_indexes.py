@@ -0,0 +1,17 @@
+# Generated by Django 3.0.4 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['joined_on', 'id'], name='user_joined_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.0.4 on 2026-10-18 18:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_users(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    SearchKey = apps.get_model('users', 'SearchKey')
+    SearchGram = apps.get_model('users', 'SearchGram')
+    for user in User.objects.iterator():
+        values = {'username': (user.username or '').lower()}
+        if user.display_full_name:
+            values['first_name'] = (user.first_name or '').lower()
+        for field, value in values.items():
+            if not value:
+                continue
+            key = SearchKey.objects.create(user=user, field=field, value=value)
+            SearchGram.objects.bulk_create([
+                SearchGram(key=key, gram=gram)
+                for gram in {value[i:i + 3] for i in range(len(value) - 2)}
+            ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('username', 'Username'), ('first_name', 'First name')], max_length=20)),
+                ('value', models.CharField(db_index=True, max_length=250)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_keys', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchGram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=3)),
+                ('key', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grams', to='users.SearchKey')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchgram',
+            index=models.Index(fields=['gram', 'key'], name='search_gram_idx'),
+        ),
+        migrations.RunPython(index_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.4 on 2026-10-18 18:48
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_search_index'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='user',
+            name='online',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.4 on 2026-10-18 18:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_remove_online'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvatarImage',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('source', models.CharField(max_length=250)),
+                ('formats', models.CharField(blank=True, default='', max_length=50)),
+                ('processed_on_date', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='avatar_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='users', to='users.AvatarImage'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.4 on 2026-10-18 18:57
+
+from django.db import migrations, models
+import users.models
+import vivacity_api.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_avatar_images'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(blank=True, default='avatars/DEFAULT/dressedAvatar-300x516.png', null=True, storage=vivacity_api.storage.ContentAddressedStorage(), upload_to=users.models.User.upload_to_avatar_dir),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='avatar_thumbnail',
+            field=models.ImageField(blank=True, default='avatars/DEFAULT/thumbnail/avatar-120x120.png', null=True, storage=vivacity_api.storage.ContentAddressedStorage(), upload_to=users.models.User.upload_to_thumbnail_dir),
+        ),
+    ]
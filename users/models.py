@@ -8,15 +8,22 @@ from django.conf import settings
 from django.contrib.auth.models import (
     BaseUserManager, AbstractBaseUser
 )
+from django.contrib.auth.signals import user_logged_out
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction, connections
+from django.db.models import Max
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 from rest_framework.authtoken.models import Token
 
 from boards.models import Board, Comment, BoardLike, CommentLike
 # from main.models import FullSizeNPC
+from stats.activity import user_activity
+from users.caches import interest_index
+from users.presence import presence
+from vivacity_api.authentication import token_cache, forget_user
+from vivacity_api.storage import content_storage
 from wallet.models import Wallet
 
 
@@ -26,6 +33,27 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
         Token.objects.create(user=instance)
 
 
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance=None, **kwargs):
+    #  Rotated or revoked tokens stop authenticating at once
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def forget_user_tokens(sender, instance=None, **kwargs):
+    #  Cached users are rebuilt from the saved row, or gone when
+    #  deactivated or deleted
+    forget_user(instance.pk)
+
+
+@receiver(user_logged_out)
+def forget_logged_out(sender, user=None, **kwargs):
+    if user is not None:
+        forget_user(user.pk)
+
+
 def get_auth_token(sender):
     if Token.objects.filter(user=sender).exists():
         token = Token.objects.get(user=sender)
@@ -49,8 +77,94 @@ class Role(models.Model):
         super(Role, self).save(*args, **kwargs)
 
 
+#  Roles given to users that have none, created when first needed
+DEFAULT_ROLES = {
+    'user': {'desc': "User", 'clearance': 0},
+    'staff': {'desc': "Basic staff role. No extended authorizations granted", 'clearance': 1},
+}
+
+
+class RoleRegistry:
+    """Every Role by pk and by title, loaded with one query when first
+    needed and dropped whenever a Role is saved or deleted, so role
+    lookups and clearance checks cost no query. Rows read inside a
+    transaction are not kept, as the transaction could be rolled back
+    """
+
+    def __init__(self):
+        self.loaded = None
+
+    def load(self) -> tuple:
+        if self.loaded is not None:
+            return self.loaded
+        by_pk = {role.pk: role for role in Role.objects.order_by('-pk')}
+        # Lowest pk wins when titles repeat
+        by_title = {role.title: role for role in by_pk.values()}
+        loaded = by_pk, by_title
+        if not transaction.get_connection().in_atomic_block:
+            self.loaded = loaded
+        return loaded
+
+    def clear(self):
+        self.loaded = None
+
+    def get(self, pk):
+        return self.load()[0].get(pk)
+
+    def by_title(self, title):
+        return self.load()[1].get(title.lower())
+
+    def clearance(self, pk) -> int:
+        """Clearance of the role with 'pk', 0 for none"""
+        role = self.get(pk)
+        return role.clearance if role is not None else 0
+
+
+role_registry = RoleRegistry()
+
+
+def default_role(title='user') -> Role:
+    role = role_registry.by_title(title)
+    if role is None:
+        role, _ = Role.objects.get_or_create(title=title, defaults=DEFAULT_ROLES[title])
+    return role
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def clear_role_registry(sender, **kwargs):
+    role_registry.clear()
+
+
+def bulk_insert(model, objects, using, key) -> list:
+    """bulk_create that leaves the pks set on 'objects', even on
+    backends that don't return them from bulk inserts. There the new
+    rows are read back by their 'key' field, which tells 'objects'
+    apart, among the rows past the last pk before the insert. Rows
+    other connections insert meanwhile, and gaps in the pks, don't
+    shift the pks given out
+    """
+    manager = model.objects.using(using)
+    if connections[using].features.can_return_rows_from_bulk_insert:
+        return manager.bulk_create(objects)
+    last = manager.aggregate(last=Max('pk'))['last'] or 0
+    manager.bulk_create(objects)
+    values = [getattr(obj, key) for obj in objects]
+    pks = dict(
+        manager.filter(pk__gt=last, **{f'{key}__in': values})
+        .order_by('pk')
+        .values_list(key, 'pk')
+    )
+    for obj, value in zip(objects, values):
+        obj.pk = pks[value]
+        obj._state.adding = False
+        obj._state.db = using
+    return objects
+
+
 class MyUserManager(BaseUserManager):
-    def create_user(self, email, username, password=None, date_of_birth=None, age_verified=None) -> object:
+    def create_user(self, email, username, password=None, date_of_birth=None, age_verified=None,
+                    **extra_fields) -> object:
         """
         Creates and saves a User with the given email, date of
         birth and password.
@@ -61,40 +175,55 @@ class MyUserManager(BaseUserManager):
         user = self.model(
             email=self.normalize_email(email),
             username=username,
-            password=password,
             date_of_birth=date_of_birth,
+            **extra_fields
         )
 
         user.set_password(password)
         user.save(using=self._db)
         return user
 
+    def provision(self, users) -> list:
+        """Bulk creates the unsaved 'users' with their wallets, tokens
+        and search index in one transaction, for importing users in
+        batches. No post_save is sent and passwords are not hashed,
+        set them beforehand (one make_password for a batch of users
+        that share an initial password)
+        """
+        using = self.db
+        role = default_role()
+        with transaction.atomic(using=using):
+            for user in users:
+                user.username = user.check_username()
+                if not user.role_id and not user.is_admin:
+                    user.role = role
+            unfunded = [user for user in users if user.wallet_id is None]
+            wallets = bulk_insert(Wallet, [Wallet(owner=user.username) for user in unfunded], using, 'owner')
+            for user, wallet in zip(unfunded, wallets):
+                user.wallet = wallet
+            bulk_insert(self.model, users, using, 'username')
+            Token.objects.using(using).bulk_create([
+                Token(key=Token().generate_key(), user=user) for user in users
+            ])
+            index_users(users)
+        return users
+
     def create_superuser(self, email, username, date_of_birth=None, password=None) -> object:
         """
         Creates and saves a superuser with the given email, date of
         birth and password.
         """
-        user = self.create_user(
+        #  If user is_admin and no role has been assigned
+        # the role of staff will be assigned. There is no further
+        # authorizations for this role but to be a placeholder
+        return self.create_user(
             email=email,
             username=username,
             password=password,
             date_of_birth=date_of_birth,
+            role=default_role('staff'),
+            is_admin=True,
         )
-        #  If user is_admin and no role has been assigned
-        # the role of staff will be assigned. There is no further
-        # authorizations for this role but to be a placeholder
-        role_exists = Role.objects.filter(title="staff").exists()
-        if not role_exists:
-            Role.objects.create(
-                title="staff",
-                desc="Basic staff role. No extended authorizations granted",
-                clearance=1
-            )
-        user_role = Role.objects.get(title="staff")
-        user.role = user_role
-        user.is_admin = True
-        user.save(using=self._db)
-        return user
 
 
 class Interest(models.Model):
@@ -110,7 +239,42 @@ class Interest(models.Model):
         return self.title
 
 
+@receiver(post_save, sender=Interest)
+@receiver(post_delete, sender=Interest)
+def invalidate_interest_index(sender, **kwargs):
+    interest_index.invalidate()
+
+
+class AvatarImage(models.Model):
+    """Processed variants of one uploaded avatar image, identified by
+    the sha256 of the upload so identical uploads are processed once.
+    See users/avatars.py
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    # Storage name of the first upload with this content
+    source = models.CharField(max_length=250)
+    # Comma separated formats of the variants, empty until processed
+    formats = models.CharField(max_length=50, blank=True, default="")
+    processed_on_date = models.DateTimeField(blank=True, null=True)
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.formats)
+
+    @property
+    def format_list(self) -> list:
+        return self.formats.split(',') if self.formats else []
+
+    def __str__(self):
+        return self.digest
+
+
 class User(AbstractBaseUser):
+    class Meta:
+        indexes = [
+            # Backs the keyset pagination of the user listing
+            models.Index(fields=['joined_on', 'id'], name='user_joined_idx'),
+        ]
 
     def upload_to_avatar_dir(self, file):
         """Uploads to avatars directory"""
@@ -142,7 +306,6 @@ class User(AbstractBaseUser):
     is_admin = models.BooleanField(blank=True, default=False)
     isAuthenticated = models.BooleanField(default=True)
     joined_on = models.DateField(default=timezone.now)
-    online = models.BooleanField(default=False)
     email_confirmed = models.BooleanField(default=False)
     primary_color = models.CharField(
         max_length=10,
@@ -200,14 +363,25 @@ class User(AbstractBaseUser):
         null=True,
         blank=True,
         upload_to=upload_to_avatar_dir,
+        storage=content_storage,
         default="avatars/DEFAULT/dressedAvatar-300x516.png"
     )
     avatar_thumbnail = models.ImageField(
         null=True,
         blank=True,
         upload_to=upload_to_thumbnail_dir,
+        storage=content_storage,
         default="avatars/DEFAULT/thumbnail/avatar-120x120.png"
     )
+    # Variants of the uploaded avatar, set once they are processed
+    avatar_image = models.ForeignKey(
+        AvatarImage,
+        related_name="users",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        editable=False
+    )
 
     # For use before avatar Builder becomes active
     # Uses an NPC character as avatar for now
@@ -234,11 +408,7 @@ class User(AbstractBaseUser):
     @property
     def board_count(self) -> int:
         """Returns the amount of boards the user has"""
-        user_boards = Board.objects.filter(author=self)
-        if user_boards.count() > 0:
-            return user_boards.count()
-        else:
-            return 0
+        return Board.objects.filter(author=self).count()
 
     @property
     def comment_count(self, show=None) -> int:
@@ -250,9 +420,14 @@ class User(AbstractBaseUser):
     @property
     def has_liked_count(self) -> int:
         # TODO Add AvatarLikes once Avatar component is up
-        user_has_liked_boards = BoardLike.objects.filter(author=self).count()
-        user_has_liked_comments = CommentLike.objects.filter(author=self).count()
-        return user_has_liked_boards + user_has_liked_comments
+        return user_activity(self).likes_given
+
+    @property
+    def online(self) -> bool:
+        """Heartbeat seen within PRESENCE_TTL, see users/presence.py.
+        Use presence.online() to look up many users at once
+        """
+        return presence.is_online(self.pk)
 
     @property
     def shinies(self):
@@ -315,12 +490,8 @@ class User(AbstractBaseUser):
             return True
 
     def add_friend(self, friend):
-        try:
-            new_friend = User.objects.get(username=friend.username)
-            self.friends.add(new_friend)
-            return True
-        except ObjectDoesNotExist:
-            return False
+        from .friends import add_friends
+        return bool(add_friends(self, [friend.username]))
 
     def get_clearance(self, req=None):
         #  Checks clearance leveled required vs clearance
@@ -328,14 +499,15 @@ class User(AbstractBaseUser):
         if req is not None and type(req) is int:
             # If required clearance is within bounds
             if 10 >= req >= 0:
-                return self.role.clearance >= req
+                return role_registry.clearance(self.role_id) >= req
             else:
                 raise ValueError("Clearance level out of range")
         else:
-            return self.role.clearance
+            return role_registry.clearance(self.role_id)
 
     def get_friends(self):
-        #  Returns full list of friends from the ManyToMany
+        #  Returns full list of friends from the ManyToMany, page
+        #  through users.friends for users with many
         return self.friends.all()
 
     def check_username(self) -> str:
@@ -363,22 +535,133 @@ class User(AbstractBaseUser):
             #  Format username before saving
             self.username = user
 
-        if not self.role:
-            if not self.is_admin:
-                #  If user is not admin and no role is assigned
-                # the role of 'user' will be used- Role will be
-                # created if not existent
-                role_exists = Role.objects.filter(title="user").exists()
-                if not role_exists:
-                    Role.objects.create(
-                        title="user",
-                        desc="User",
-                        clearance=0
-                    )
-                user_role = Role.objects.get(title="user")
-
-                self.role = user_role
-        super(User, self).save(*args, **kwargs)
-        if self.wallet is None:
-            self.create_wallet()
-            self.save()
+        from .avatars import prepare_avatar, schedule_avatar
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            #  Partial saves write only what they were asked to, and
+            # the variants of an avatar they write
+            uploaded = False
+            if 'avatar' in update_fields:
+                uploaded = prepare_avatar(self)
+                kwargs['update_fields'] = {*update_fields, 'avatar_image'}
+            super(User, self).save(*args, **kwargs)
+            if uploaded:
+                schedule_avatar(self)
+            return
+
+        if not self.role_id and not self.is_admin:
+            #  If user is not admin and no role is assigned
+            # the role of 'user' will be used- Role will be
+            # created if not existent
+            self.role = default_role()
+        uploaded = prepare_avatar(self)
+        if self.wallet_id is not None:
+            super(User, self).save(*args, **kwargs)
+        else:
+            with transaction.atomic(using=kwargs.get('using')):
+                #  Wallet first so the user is written with a single
+                # INSERT, the token and search index follow in post_save
+                self.wallet = Wallet.objects.create(owner=self.username)
+                super(User, self).save(*args, **kwargs)
+        if uploaded:
+            #  Variants are made off the request, see users/avatars.py
+            schedule_avatar(self)
+
+
+#  Search index
+#  Lowercased usernames (and first names the user chose to display)
+#  with their trigrams, so UserSearch uses indexed lookups instead
+#  of scanning the user table. Searching lives in users/search.py
+SEARCH_FIELDS = (
+    ('username', 'Username'),
+    ('first_name', 'First name'),
+)
+
+
+class SearchKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="search_keys")
+    field = models.CharField(max_length=20, choices=SEARCH_FIELDS)
+    value = models.CharField(max_length=250, db_index=True)
+
+    def __str__(self):
+        return f'{self.user_id} {self.field}: {self.value}'
+
+
+class SearchGram(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['gram', 'key'], name='search_gram_idx'),
+        ]
+
+    key = models.ForeignKey(SearchKey, on_delete=models.CASCADE, related_name="grams")
+    gram = models.CharField(max_length=3)
+
+    def __str__(self):
+        return self.gram
+
+
+def trigrams(value) -> set:
+    """All three character slices of 'value'"""
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def search_values(user) -> dict:
+    """The lowercased values of 'user' that should be searchable"""
+    values = {}
+    if user.username:
+        values['username'] = user.username.lower()
+    if user.display_full_name and user.first_name:
+        values['first_name'] = user.first_name.lower()
+    return values
+
+
+def index_user(user) -> bool:
+    """Brings the search index of 'user' up to date, only writing
+    when a searchable value changed. Returns True if it wrote
+    """
+    wanted = search_values(user)
+    keys = {key.field: key for key in SearchKey.objects.filter(user=user)}
+    stale = [key.pk for field, key in keys.items() if wanted.get(field) != key.value]
+    missing = {field: value for field, value in wanted.items()
+               if field not in keys or keys[field].value != value}
+    if not stale and not missing:
+        return False
+
+    if stale:
+        SearchKey.objects.filter(pk__in=stale).delete()
+    if missing:
+        SearchKey.objects.bulk_create([
+            SearchKey(user=user, field=field, value=value) for field, value in missing.items()
+        ])
+        new_keys = SearchKey.objects.filter(user=user, field__in=missing)
+        SearchGram.objects.bulk_create([
+            SearchGram(key=key, gram=gram) for key in new_keys for gram in trigrams(key.value)
+        ])
+    return True
+
+
+def index_users(users) -> int:
+    """Indexes 'users' that have no search index yet in bulk, as
+    after bulk_create which sends no post_save. Returns the amount
+    of values indexed
+    """
+    SearchKey.objects.bulk_create([
+        SearchKey(user=user, field=field, value=value)
+        for user in users for field, value in search_values(user).items()
+    ])
+    new_keys = SearchKey.objects.filter(user__in=[user.pk for user in users])
+    grams = [SearchGram(key=key, gram=gram) for key in new_keys for gram in trigrams(key.value)]
+    SearchGram.objects.bulk_create(grams)
+    return len(new_keys)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def update_search_index(sender, instance=None, created=False, update_fields=None, **kwargs):
+    if created:
+        #  Nothing indexed yet, nothing to compare against
+        index_users([instance])
+        return
+    if update_fields is not None and \
+            not {'username', 'first_name', 'display_full_name'} & set(update_fields):
+        return
+    index_user(instance)
@@ -0,0 +1,97 @@
+"""Who is online. Every authenticated request heartbeats its user into
+a sorted set of user pk -> last seen timestamp, users whose heartbeat
+is older than PRESENCE_TTL seconds count as offline. The set lives in
+Redis when PRESENCE_REDIS_URL is set and in process otherwise, through
+LocalRedis which implements the few sorted set commands used here
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class LocalRedis:
+    """In-process stand-in for the Redis sorted set commands Presence
+    uses. Scores are timestamps, so members are kept in the order they
+    were last set and trimmed from the oldest
+    """
+
+    def __init__(self):
+        self.sets = {}
+        self.lock = threading.Lock()
+
+    def zadd(self, name, mapping):
+        with self.lock:
+            members = self.sets.setdefault(name, OrderedDict())
+            for member, score in mapping.items():
+                members[member] = score
+                members.move_to_end(member)
+
+    def zrem(self, name, *members):
+        with self.lock:
+            stored = self.sets.get(name, {})
+            for member in members:
+                stored.pop(member, None)
+
+    def zremrangebyscore(self, name, min, max):
+        with self.lock:
+            members = self.sets.get(name, OrderedDict())
+            removed = 0
+            while members:
+                member, score = next(iter(members.items()))
+                if score > max:
+                    break
+                del members[member]
+                removed += 1
+            return removed
+
+    def zcard(self, name):
+        with self.lock:
+            return len(self.sets.get(name, {}))
+
+    def zmscore(self, name, members):
+        with self.lock:
+            stored = self.sets.get(name, {})
+            return [stored.get(member) for member in members]
+
+
+def connect(url):
+    if url is None:
+        return LocalRedis()
+    import redis
+    return redis.Redis.from_url(url)
+
+
+class Presence:
+
+    def __init__(self, client, ttl=300, name='presence'):
+        self.client = client
+        self.ttl = ttl
+        self.name = name
+
+    def heartbeat(self, user_pk, now=None):
+        self.client.zadd(self.name, {user_pk: now or time.time()})
+
+    def leave(self, user_pk):
+        self.client.zrem(self.name, user_pk)
+
+    def online_count(self, now=None) -> int:
+        # Expired heartbeats are trimmed first so the count is exact
+        self.client.zremrangebyscore(self.name, '-inf', (now or time.time()) - self.ttl)
+        return self.client.zcard(self.name)
+
+    def online(self, user_pks, now=None) -> set:
+        """Which of 'user_pks' are online, in one lookup"""
+        user_pks = list(user_pks)
+        if not user_pks:
+            return set()
+        since = (now or time.time()) - self.ttl
+        scores = self.client.zmscore(self.name, user_pks)
+        return {pk for pk, score in zip(user_pks, scores) if score is not None and float(score) > since}
+
+    def is_online(self, user_pk) -> bool:
+        return user_pk in self.online([user_pk])
+
+
+presence = Presence(connect(settings.PRESENCE_REDIS_URL), ttl=settings.PRESENCE_TTL)
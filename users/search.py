@@ -0,0 +1,65 @@
+"""User search over the SearchKey/SearchGram index. Terms of three
+or more characters match anywhere in a username or displayed first
+name through the trigram index, shorter terms match as a prefix
+"""
+from django.db.models import Count
+
+from .friends import friend_ids
+from .models import User, SearchKey, SearchGram, trigrams
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+
+#  Score of a term matching a value, summed over every term
+EXACT = 3
+PREFIX = 2
+CONTAINS = 1
+
+
+def prefix_keys(term, keys):
+    # Range scan on the indexed value, no LIKE needed
+    return keys.filter(value__gte=term, value__lt=term + '\U0010ffff')
+
+
+def contains_keys(term, keys):
+    grams = trigrams(term)
+    key_ids = SearchGram.objects.filter(gram__in=grams)\
+        .values('key')\
+        .annotate(found=Count('gram', distinct=True))\
+        .filter(found=len(grams))\
+        .values('key')
+    return keys.filter(pk__in=key_ids)
+
+
+def score(term, value) -> int:
+    if value == term:
+        return EXACT
+    if value.startswith(term):
+        return PREFIX
+    if term in value:
+        return CONTAINS
+    return 0
+
+
+def search_users(terms, friends_of=None, limit=DEFAULT_LIMIT) -> list:
+    """Users matching any of 'terms', best match first. With
+    'friends_of' only that user's friends are searched
+    """
+    keys = SearchKey.objects.all()
+    if friends_of is not None:
+        keys = keys.filter(user__in=friend_ids(friends_of.pk))
+
+    scores = {}
+    for term in {term.lower() for term in terms if term}:
+        matched = contains_keys(term, keys) if len(term) >= 3 else prefix_keys(term, keys)
+        best = {}
+        for user_id, value in matched.values_list('user_id', 'value'):
+            # Trigrams can match out of order, so confirm the match
+            best[user_id] = max(best.get(user_id, 0), score(term, value))
+        for user_id, points in best.items():
+            if points:
+                scores[user_id] = scores.get(user_id, 0) + points
+
+    ranked = sorted(scores, key=lambda user_id: (-scores[user_id], user_id))[:limit]
+    users = User.objects.select_related('avatar_image').in_bulk(ranked)
+    return [users[user_id] for user_id in ranked if user_id in users]
@@ -1,5 +1,10 @@
+from django.core.exceptions import FieldDoesNotExist
 from rest_framework import serializers
 
+from stats.activity import user_activity
+from vivacity_api.middleware import TimedSerializerMixin
+from .avatars import avatar_url, avatar_sources
+from .friends import preview, friend_count
 from .models import User, Interest
 
 INFO = [
@@ -29,6 +34,7 @@ PROFILE = [
     'tag',
     'bio',
     'friends',
+    'friend_count',
     'occupation',
     'interests',
     'board_count',
@@ -39,25 +45,85 @@ PROFILE = [
 ]
 
 
-class InterestSerializer(serializers.ModelSerializer):
+def selected_fields(request):
+    """Field names asked for with ?fields=a,b, None for every field"""
+    if request is None or not request.query_params.get('fields'):
+        return None
+    return [name.strip() for name in request.query_params['fields'].split(',') if name.strip()]
+
+
+class SelectableFieldsMixin:
+    """Serializes only the 'fields' passed in, or asked for with
+    ?fields= on the request in the context. 'sources' names the model
+    fields a serializer field reads when that is not the field itself,
+    so project can load just those columns
+    """
+    sources = {}
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None:
+            fields = selected_fields(self.context.get('request'))
+        if fields:
+            selected = set(fields) & set(self.fields)
+            # Unknown names alone leave every field in
+            if selected:
+                for name in set(self.fields) - selected:
+                    self.fields.pop(name)
+
+    def project(self, queryset):
+        """'queryset' loading the columns and relations the fields read"""
+        model = self.Meta.model
+        columns, prefetch = {model._meta.pk.name}, []
+        for name in self.fields:
+            if name in self.sources:
+                columns.update(self.sources[name])
+                continue
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.many_to_many:
+                prefetch.append(name)
+            elif field.concrete:
+                columns.add(name)
+        return queryset.only(*columns).prefetch_related(*prefetch)
+
+
+class InterestSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Interest
         fields = '__all__'
 
 
-class QuickUserSerializer(serializers.ModelSerializer):
+class QuickUserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Load users with select_related('avatar_image')"""
     class Meta:
         model = User
         fields = [
             'id',
             'username',
             'avatar_thumbnail',
+            'avatar_sources',
             'primary_color',
             'secondary_color'
         ]
 
+    avatar_thumbnail = serializers.SerializerMethodField()
+    avatar_sources = serializers.SerializerMethodField()
 
-class LoginSerializer(serializers.ModelSerializer):
+    def absolute(self, url):
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def get_avatar_thumbnail(self, user):
+        return self.absolute(avatar_url(user, 'thumbnail'))
+
+    def get_avatar_sources(self, user):
+        return {fmt: self.absolute(url) for fmt, url in avatar_sources(user, 'thumbnail').items()}
+
+
+class LoginSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = [
@@ -76,7 +142,7 @@ class LoginSerializer(serializers.ModelSerializer):
         ]
 
 
-class ColorSerializer(serializers.ModelSerializer):
+class ColorSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = [
@@ -85,7 +151,7 @@ class ColorSerializer(serializers.ModelSerializer):
         ]
 
 
-class NewUserSerializer(serializers.ModelSerializer):
+class NewUserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = [
@@ -96,18 +162,40 @@ class NewUserSerializer(serializers.ModelSerializer):
         ]
 
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(SelectableFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    sources = {
+        'first_name': ['display_full_name', 'first_name'],
+        'last_name': ['display_full_name', 'last_name'],
+        'date_of_birth': ['display_date_of_birth', 'date_of_birth'],
+        'location': ['display_location', 'location'],
+        'occupation': ['display_occupation', 'occupation'],
+        'board_count': [],
+        'friends': [],
+        'friend_count': [],
+    }
 
     first_name = serializers.SerializerMethodField()
     last_name = serializers.SerializerMethodField()
     date_of_birth = serializers.SerializerMethodField()
     location = serializers.SerializerMethodField()
     occupation = serializers.SerializerMethodField()
+    board_count = serializers.SerializerMethodField()
+    friends = serializers.SerializerMethodField()
+    friend_count = serializers.SerializerMethodField()
 
     class Meta:
         model = User
         fields = INFO + PROFILE
 
+    def get_board_count(self, user):
+        return user_activity(user).boards
+
+    def get_friends(self, user):
+        return [friend.pk for friend in preview(user.pk)]
+
+    def get_friend_count(self, user):
+        return friend_count(user.pk)
+
     def get_first_name(self, user):
         display = user.display_full_name
         return None if not display else user.first_name
@@ -129,21 +217,41 @@ class ProfileSerializer(serializers.ModelSerializer):
         return None if not display else user.occupation
 
 
-class OwnProfileSerializer(serializers.ModelSerializer):
+class OwnProfileSerializer(SelectableFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         # fields = '__all__'
         exclude = ['password', ]
 
+    sources = {
+        'board_count': [],
+        'friends': [],
+        'friend_count': [],
+    }
+
     interests = InterestSerializer(read_only=True, many=True)
     board_count = serializers.SerializerMethodField()
-    friends = QuickUserSerializer(many=True)
+    friends = serializers.SerializerMethodField()
+    friend_count = serializers.SerializerMethodField()
 
     def get_board_count(self, user):
-        return user.board_count
+        return user_activity(user).boards
+
+    def get_friends(self, user):
+        return QuickUserSerializer(preview(user.pk), many=True, context=self.context).data
+
+    def get_friend_count(self, user):
+        return friend_count(user.pk)
+
+
+class FriendSuggestionSerializer(QuickUserSerializer):
+    class Meta(QuickUserSerializer.Meta):
+        fields = QuickUserSerializer.Meta.fields + ['mutual']
+
+    mutual = serializers.IntegerField(read_only=True)
     
 
-class DailyChanceSerializer(serializers.ModelSerializer):
+class DailyChanceSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['dailyChance', 'dailyChanceDate']
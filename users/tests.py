@@ -1,12 +1,41 @@
 import datetime
+import io
 import json
-
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import QuerySet
 from django.test import Client
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIRequestFactory
 
 from boards.models import Board, Comment, BoardLike, Topic
-from users.models import User, Role, get_auth_token, CommentLike
+from boards.serializers import BoardSerializer
+from users import avatars, friends
+from users.avatars import avatar_url, available_formats, variant_name
+from users.caches import interest_index
 from users.factories import UserFactory
+from users.hashers import ScryptPasswordHasher, HashSlots
+from users.interests import set_interests, autocomplete
+from users.models import User, Role, get_auth_token, CommentLike, SearchKey, default_role, role_registry, \
+    Interest
+from users.presence import presence, Presence, LocalRedis
+from users.search import search_users
+from users.serializers import QuickUserSerializer
+from vivacity_api.authentication import CachedTokenAuthentication, token_cache
+from vivacity_api.cache import LocalCache
+from wallet.models import Wallet
 
 
 class UserTestCase(TestCase):
@@ -134,14 +163,14 @@ class UserTestCase(TestCase):
             data,
         )
         userObj = User.objects.get(username=user['username'])
-        self.assertTrue(userObj.online)
+        self.assertTrue(presence.is_online(userObj.pk))
         passed = c.get(
             url,
             HTTP_AUTHORIZATION=f'Token {userObj.auth_token}'
         )
         userObj = User.objects.get(username=user['username'])
         self.assertEqual(passed.status_code, 200)
-        self.assertFalse(userObj.online)
+        self.assertFalse(presence.is_online(userObj.pk))
 
     def test_create_user_success(self):
         """Test create user functionality"""
@@ -356,6 +385,16 @@ class ProfileTestCase(TestCase):
         )
         self.c = Client()
 
+    def test_view_all_pages(self):
+        self.c.login(username=self.su.username, password="sudoPassword1")
+        usernames = []
+        url = '/api/user/view/all'
+        while url:
+            data = self.c.get(url).json()
+            usernames += [user['username'] for user in data['results']]
+            url = data['next']
+        self.assertEqual(usernames, [self.su.username, self.u.username])
+
     def test_profile_api(self):
         # Hit the view profile API for displayed information
 
@@ -607,3 +646,711 @@ class SerializerTest(TestCase):
 
     def test_factory_success(self):
         self.assertEqual(self.auth_user.is_active, self.unAuth_user.is_active)
+
+
+class SearchTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.names = ['annabelle', 'hannah', 'joanne', 'bob', 'anna']
+        for name in self.names:
+            User.objects.create_user(
+                email=f"{name}@email.com",
+                date_of_birth="1980-03-20",
+                username=name,
+                password="nonAuthPassword"
+            )
+        self.searcher = User.objects.get(username='bob')
+        self.c = Client()
+        self.c.login(username='bob', password="nonAuthPassword")
+
+    def usernames(self, users):
+        return [user.username for user in users]
+
+    def test_ranked_matches(self):
+        #  Exact match, then prefix, then anywhere in the username
+        self.assertEqual(
+            self.usernames(search_users(['ANNA'])),
+            ['anna', 'annabelle', 'hannah']
+        )
+        #  Short terms only match the start
+        self.assertEqual(self.usernames(search_users(['bo'])), ['bob'])
+        self.assertEqual(self.usernames(search_users(['ob'])), [])
+        self.assertEqual(len(search_users(['ann'], limit=2)), 2)
+
+    def test_display_full_name(self):
+        user = User.objects.get(username='joanne')
+        user.first_name = "Zelda"
+        user.save()
+        self.assertEqual(search_users(['zelda']), [])
+
+        user.display_full_name = True
+        user.save()
+        self.assertEqual(self.usernames(search_users(['zelda'])), ['joanne'])
+        self.assertEqual(SearchKey.objects.filter(user=user).count(), 2)
+
+    def test_rename_reindexes(self):
+        user = User.objects.get(username='hannah')
+        user.username = 'zoe'
+        user.save()
+        self.assertEqual(self.usernames(search_users(['hannah'])), [])
+        self.assertEqual(self.usernames(search_users(['zoe'])), ['zoe'])
+
+    def test_search_api(self):
+        r = self.c.get('/api/user/search', {'search_terms': 'bob_anna'})
+        self.assertEqual(r.status_code, 200)
+        #  Exact matches tie and go in the order users joined
+        self.assertEqual(
+            [user['username'] for user in r.json()],
+            ['bob', 'anna', 'annabelle', 'hannah']
+        )
+
+        #  Only friends of the searching user
+        self.searcher.friends.add(User.objects.get(username='hannah'))
+        r = self.c.get('/api/user/search', {'search_terms': 'anna', 'friends': ''})
+        self.assertEqual([user['username'] for user in r.json()], ['hannah'])
+
+    def test_search_api_limit(self):
+        r = self.c.get('/api/user/search', {'search_terms': 'bob_anna', 'limit': 2})
+        self.assertEqual([user['username'] for user in r.json()], ['bob', 'anna'])
+        #  Out of range limits are brought back in
+        for limit in (0, -3):
+            r = self.c.get('/api/user/search', {'search_terms': 'bob_anna', 'limit': limit})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual([user['username'] for user in r.json()], ['bob'])
+
+
+class ProvisioningTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.first = User.objects.create_user(email="first@email.com", username="first", password="pw")
+
+    def loaded_registry(self):
+        """The registry as kept outside a transaction, tests always
+        run inside one
+        """
+        return mock.patch.object(role_registry, 'loaded', role_registry.load())
+
+    def test_create_user(self):
+        with self.loaded_registry():
+            #  Wallet, user and token INSERTs, 3 to index the user for
+            #  search and the transaction's savepoint around them
+            with self.assertNumQueries(8):
+                user = User.objects.create_user(email="new@email.com", username="new@user", password="pw")
+        user = User.objects.get(pk=user.pk)
+        self.assertEqual(user.username, "new")
+        self.assertEqual(user.role.title, "user")
+        self.assertEqual(user.wallet.owner, "new")
+        self.assertTrue(user.check_password("pw"))
+        self.assertEqual(get_auth_token(user).user, user)
+        self.assertEqual(search_users(["new"])[0], user)
+
+    def test_role_registry(self):
+        moderator = Role.objects.create(title="Moderator", desc="Mod", clearance=5)
+        user = User.objects.get(pk=self.first.pk)
+        with self.loaded_registry():
+            with self.assertNumQueries(0):
+                self.assertEqual(role_registry.by_title("moderator"), moderator)
+                self.assertEqual(role_registry.get(moderator.pk), moderator)
+                self.assertEqual(default_role(), self.first.role)
+                self.assertEqual(user.get_clearance(), 0)
+                self.assertFalse(user.get_clearance(1))
+        self.assertIsNone(role_registry.by_title("nobody"))
+
+    def test_role_registry_invalidation(self):
+        with self.loaded_registry():
+            #  Saving or deleting a role drops what was loaded
+            moderator = Role.objects.create(title="moderator", desc="Mod", clearance=5)
+            self.assertIsNone(role_registry.loaded)
+            self.assertEqual(role_registry.by_title("moderator").clearance, 5)
+            moderator.clearance = 6
+            moderator.save()
+            self.assertEqual(role_registry.clearance(moderator.pk), 6)
+            moderator.delete()
+            self.assertIsNone(role_registry.get(moderator.pk))
+        #  Never kept while inside a transaction
+        self.assertIsNone(role_registry.loaded)
+
+    def test_provision(self):
+        password = make_password("imported")
+
+        def provision(names):
+            return User.objects.provision([
+                User(username=name, email=f"{name}@email.com", password=password) for name in names
+            ])
+
+        with self.assertNumQueries(13) as small:
+            provision(["one", "two"])
+        #  The same queries however many users are imported
+        with self.assertNumQueries(len(small.captured_queries)):
+            users = provision(["three", "four", "five", "six", "seven"])
+
+        self.assertEqual(User.objects.count(), 8)
+        self.assertEqual(len({user.wallet_id for user in User.objects.all()}), 8)
+        user = User.objects.get(username="five")
+        self.assertEqual(user.pk, users[2].pk)
+        self.assertEqual(user.wallet.owner, "five")
+        self.assertEqual(user.role.title, "user")
+        self.assertTrue(user.check_password("imported"))
+        self.assertEqual(get_auth_token(user).user, user)
+        self.assertEqual(search_users(["five"])[0], user)
+
+    def test_provision_concurrent_insert(self):
+        bulk_create = QuerySet.bulk_create
+
+        def interleaved(queryset, objs, *args, **kwargs):
+            #  Another connection's rows land between the pk read and
+            #  the insert
+            if queryset.model is Wallet:
+                Wallet.objects.create(owner="elsewhere")
+            if queryset.model is User:
+                User.objects.create_user(username="elsewhere", email="elsewhere@email.com")
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'bulk_create', interleaved):
+            users = User.objects.provision([
+                User(username=name, email=f"{name}@email.com") for name in ["one", "two"]
+            ])
+        for user in users:
+            self.assertEqual(User.objects.get(pk=user.pk).username, user.username)
+            self.assertEqual(Wallet.objects.get(pk=user.wallet_id).owner, user.username)
+
+
+class TokenAuthenticationTestCase(TestCase):
+
+    def setUp(self) -> None:
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.user = User.objects.create_user(email="token@email.com", username="tokenUser", password="pw")
+        self.key = get_auth_token(self.user).key
+
+    def authenticate(self, key=None):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {key or self.key}')
+        return CachedTokenAuthentication().authenticate(request)
+
+    def test_cached(self):
+        with self.assertNumQueries(1):
+            first, token = self.authenticate()
+        with self.assertNumQueries(0):
+            second, token = self.authenticate()
+        self.assertEqual(second, self.user)
+        self.assertEqual(second.username, "tokenUser")
+        self.assertEqual(token.key, self.key)
+        self.assertEqual(token.user, second)
+        #  Every request gets its own user object
+        self.assertIsNot(first, second)
+        second.first_name = "changed"
+        self.assertEqual(self.authenticate()[0].first_name, "")
+
+    def test_rotated_token(self):
+        self.authenticate()
+        Token.objects.filter(user=self.user).delete()
+        Token.objects.create(user=self.user)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+        self.assertEqual(self.authenticate(get_auth_token(self.user).key)[0], self.user)
+
+    def test_deactivated_user(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_logout(self):
+        self.authenticate()
+        response = Client().get('/api/user/logout', HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(token_cache), 0)
+
+    def test_forget_user(self):
+        other = User.objects.create_user(email="other@email.com", username="otherUser", password="pw")
+        other_key = get_auth_token(other).key
+        self.authenticate()
+        self.authenticate(other_key)
+        self.user.first_name = "changed"
+        self.user.save()
+        #  Only the saved user's tokens are dropped
+        self.assertIsNone(token_cache.get(self.key))
+        self.assertIsNotNone(token_cache.get(other_key))
+        self.assertEqual(set(token_cache.by_user), {other.pk})
+        #  Evicted entries leave the index too
+        with mock.patch.object(token_cache, 'size', 0):
+            token_cache.set('evicting', (self.user.pk, 'default', (), None))
+        self.assertEqual(token_cache.by_user, {})
+
+    def test_loaded_alias(self):
+        self.authenticate()
+        pk, using, values, created = token_cache.get(self.key)
+        token_cache.set(self.key, (pk, 'replica', values, created))
+        #  Users come back as loaded from the same database
+        self.assertEqual(self.authenticate()[0]._state.db, 'replica')
+
+    def test_local_cache(self):
+        local = LocalCache(size=2, ttl=60)
+        local.set('a', 1)
+        local.set('b', 2)
+        local.get('a')
+        local.set('c', 3)
+        #  Least recently used goes first
+        self.assertIsNone(local.get('b'))
+        self.assertEqual(local.get('a'), 1)
+        local.ttl = 0
+        local.set('d', 4)
+        self.assertIsNone(local.get('d'))
+
+
+class PresenceTestCase(TestCase):
+
+    def setUp(self) -> None:
+        patcher = mock.patch.object(presence, 'client', LocalRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(email="here@email.com", username="hereUser", password="pw")
+
+    def test_presence(self):
+        tracked = Presence(LocalRedis(), ttl=60)
+        tracked.heartbeat(1, now=1000)
+        tracked.heartbeat(2, now=1030)
+        tracked.heartbeat(3, now=1050)
+        self.assertEqual(tracked.online_count(now=1055), 3)
+        self.assertEqual(tracked.online([1, 2, 3, 4], now=1070), {2, 3})
+        #  Expired heartbeats drop out of the count
+        self.assertEqual(tracked.online_count(now=1070), 2)
+        tracked.leave(3)
+        self.assertEqual(tracked.online_count(now=1070), 1)
+        #  A new heartbeat keeps a user online
+        tracked.heartbeat(2, now=1080)
+        self.assertEqual(tracked.online_count(now=1100), 1)
+
+    def test_login_logout(self):
+        client = Client()
+        client.post('/api/user/login', {'username': "hereUser", 'password': "pw"})
+        with CaptureQueriesContext(connection) as queries:
+            client.post('/api/user/login', {'username': "hereUser", 'password': "pw"})
+        #  Logging in only writes the user row when the daily chance resets
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE "users_user"')])
+        self.assertTrue(self.user.online)
+        self.assertEqual(Client().get('/api/main/home').json()['online_users'], 1)
+
+        client.get('/api/user/logout', HTTP_AUTHORIZATION=f'Token {get_auth_token(self.user).key}')
+        self.assertFalse(self.user.online)
+        self.assertEqual(presence.online_count(), 0)
+
+    def test_requests_heartbeat(self):
+        Client().get('/api/user/view/all', HTTP_AUTHORIZATION=f'Token {get_auth_token(self.user).key}')
+        self.assertTrue(self.user.online)
+        #  Anonymous requests don't
+        Client().get('/api/main/home')
+        self.assertEqual(presence.online_count(), 1)
+
+
+class AvatarPipelineTestCase(TestCase):
+
+    def setUp(self) -> None:
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media, AVATAR_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        #  Nothing commits inside a test, run what waits on it
+        patcher = mock.patch.object(transaction, 'on_commit', side_effect=lambda run: run())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(email="avatar@email.com", username="avatarUser", password="pw")
+
+    def upload(self, user, color='red', size=(400, 600), **kwargs):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, color).save(buffer, 'PNG')
+        user.avatar = SimpleUploadedFile("avatar.png", buffer.getvalue(), content_type="image/png")
+        user.save(**kwargs)
+        return User.objects.select_related('avatar_image').get(pk=user.pk)
+
+    def test_variants(self):
+        user = self.upload(self.user)
+        image = user.avatar_image
+        self.assertEqual(image.format_list, available_formats())
+        self.assertIn('png', image.format_list)
+        for variant, size in (('thumbnail', (120, 120)), ('icon', (48, 48)), ('full', (300, 450))):
+            with default_storage.open(variant_name(image.pk, variant, 'png')) as file:
+                self.assertEqual(Image.open(file).size, size)
+        self.assertEqual(avatar_url(user, 'icon'), f'/media/avatars/variants/{image.pk[:2]}/{image.pk}-icon.png')
+        self.assertEqual(
+            QuickUserSerializer(user).data['avatar_thumbnail'],
+            f'/media/{variant_name(image.pk, "thumbnail", "png")}'
+        )
+
+        board = Board.objects.create(author=user, title="Avatar", content="Board")
+        self.assertEqual(BoardSerializer(board).data['author']['thumbnail'], avatar_url(user, 'icon'))
+
+    def test_partial_save(self):
+        user = self.upload(self.user, update_fields=['avatar'])
+        self.assertTrue(user.avatar_image.ready)
+        self.assertIn('png', user.avatar_image.format_list)
+        #  Saves that leave the avatar out don't touch it
+        user.first_name = "Partial"
+        with mock.patch.object(avatars, 'submit') as submit:
+            user.save(update_fields=['first_name'])
+        submit.assert_not_called()
+
+    def test_identical_uploads_processed_once(self):
+        first = self.upload(self.user)
+        other = User.objects.create_user(email="same@email.com", username="sameAvatar", password="pw")
+        with mock.patch.object(avatars, 'submit') as submit:
+            other = self.upload(other)
+        submit.assert_not_called()
+        self.assertEqual(other.avatar_image, first.avatar_image)
+        self.assertEqual(len(os.listdir(os.path.dirname(default_storage.path(
+            variant_name(first.avatar_image.pk, 'icon', 'png'))))), 3 * len(available_formats()))
+
+    def test_served_uploads_until_processed(self):
+        with mock.patch.object(avatars, 'submit'):
+            user = self.upload(self.user)
+        self.assertIsNone(user.avatar_image)
+        self.assertEqual(avatar_url(user, 'thumbnail'), user.avatar_thumbnail.url)
+        self.assertEqual(avatar_url(user, 'full'), user.avatar.url)
+
+        #  Unprocessed uploads are picked up by the command
+        call_command('process_avatars', stdout=open(os.devnull, 'w'))
+        user = User.objects.select_related('avatar_image').get(pk=user.pk)
+        self.assertTrue(user.avatar_image.ready)
+
+    def test_new_upload_replaces_variants(self):
+        first = self.upload(self.user).avatar_image
+        second = self.upload(self.user, color='blue').avatar_image
+        self.assertNotEqual(first, second)
+        self.assertTrue(second.ready)
+
+
+class FriendsTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.users = {}
+        for name in ['me', 'amy', 'ben', 'cal', 'dee', 'eve']:
+            self.users[name] = User.objects.create_user(
+                email=f"{name}@email.com",
+                date_of_birth="1980-03-20",
+                username=name,
+                password="friendPassword"
+            )
+        self.me = self.users['me']
+        self.c = Client()
+        self.c.login(username='me', password="friendPassword")
+
+    def befriend(self, name, *others):
+        friends.add_friends(self.users[name], others)
+
+    def usernames(self, data):
+        return [user['username'] for user in data]
+
+    def test_bulk_add_and_remove(self):
+        r = self.c.post('/api/user/friends', {'usernames': ['amy', 'ben', 'cal', 'nobody', 'me']})
+        self.assertEqual(r.json(), {'found': 3, 'friend_count': 3})
+        #  Friendships go both ways
+        self.assertIn(self.me, self.users['amy'].get_friends())
+
+        r = self.c.delete(
+            '/api/user/friends',
+            json.dumps({'usernames': ['amy', 'ben', 'dee']}),
+            content_type='application/json'
+        )
+        self.assertEqual(r.json(), {'removed': 2, 'friend_count': 1})
+        self.assertEqual(friends.friend_count(self.users['amy'].pk), 0)
+
+    def test_friend_list_pages(self):
+        self.befriend('me', 'eve', 'cal', 'amy', 'dee', 'ben')
+        usernames = []
+        url = '/api/user/friends/of/me?page_size=2'
+        while url:
+            data = self.c.get(url).json()
+            self.assertLessEqual(len(data['results']), 2)
+            usernames += self.usernames(data['results'])
+            url = data['next']
+        self.assertEqual(usernames, ['amy', 'ben', 'cal', 'dee', 'eve'])
+        self.assertEqual(self.c.get('/api/user/friends/of/nobody').status_code, 404)
+
+    def test_mutual_friends_and_suggestions(self):
+        self.befriend('me', 'amy', 'ben')
+        self.befriend('amy', 'cal', 'dee')
+        self.befriend('ben', 'cal')
+
+        r = self.c.get('/api/user/friends/mutual/cal')
+        self.assertEqual(self.usernames(r.json()['results']), ['amy', 'ben'])
+
+        #  Ranked by friends in common, friends and self left out
+        r = self.c.get('/api/user/friends/suggestions')
+        self.assertEqual(
+            [(user['username'], user['mutual']) for user in r.json()],
+            [('cal', 2), ('dee', 1)]
+        )
+        self.assertEqual(len(self.c.get('/api/user/friends/suggestions', {'limit': 1}).json()), 1)
+        #  Out of range limits are brought back in
+        for limit in (0, -1):
+            r = self.c.get('/api/user/friends/suggestions', {'limit': limit})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(len(r.json()), 1)
+
+    def test_bulk_too_large(self):
+        usernames = ['amy'] + [f'nobody{i}' for i in range(friends.MAX_BULK)]
+        r = self.c.post('/api/user/friends', json.dumps({'usernames': usernames}), content_type='application/json')
+        self.assertEqual(r.status_code, 400)
+        self.assertIn('usernames', r.json())
+        self.assertEqual(friends.friend_count(self.me.pk), 0)
+        with self.assertRaises(ValueError):
+            friends.remove_friends(self.me, usernames)
+
+    def test_profile_previews_friends(self):
+        self.befriend('me', 'amy', 'ben', 'cal', 'dee', 'eve')
+        with mock.patch.object(friends, 'FRIENDS_PREVIEW', 2):
+            r = self.c.get('/api/user/profile/me')
+            self.assertEqual(r.json()['friend_count'], 5)
+            self.assertEqual(r.json()['friends'], [self.users['amy'].pk, self.users['ben'].pk])
+
+            r = self.c.patch('/api/user/profile/edit/me', content_type='application/json')
+            self.assertEqual(self.usernames(r.json()['friends']), ['amy', 'ben'])
+            self.assertEqual(r.json()['friend_count'], 5)
+
+    def test_search_friends_of(self):
+        self.befriend('amy', 'ben', 'cal')
+        r = self.c.get('/api/user/search', {'search_terms': 'ben_cal_dee', 'friends': 'amy'})
+        self.assertEqual(sorted(self.usernames(r.json())), ['ben', 'cal'])
+        r = self.c.get('/api/user/search', {'search_terms': 'ben', 'friends': 'nobody'})
+        self.assertEqual(r.json(), [])
+
+
+class ProfileFieldsTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            email="fields@email.com",
+            date_of_birth="1980-03-20",
+            username="fieldsUser",
+            password="fieldsPassword"
+        )
+        self.user.first_name = "Fields"
+        self.user.display_full_name = True
+        self.user.bio = "Bio"
+        self.user.save()
+        self.c = Client()
+        self.c.login(username="fieldsUser", password="fieldsPassword")
+
+    def profile_queries(self, url, params):
+        """The response and the queries that loaded the profile"""
+        with CaptureQueriesContext(connection) as queries:
+            r = self.c.get(url, params)
+        loads = [query['sql'] for query in queries if '"users_user"."username" = ' in query['sql']]
+        return r, loads
+
+    def test_selected_fields(self):
+        r, loads = self.profile_queries('/api/user/profile/fieldsUser', {'fields': 'username,bio,first_name'})
+        self.assertEqual(r.json(), {'username': 'fieldsUser', 'bio': 'Bio', 'first_name': 'Fields'})
+        #  One load of just the columns those fields read
+        self.assertEqual(len(loads), 1)
+        self.assertIn('"display_full_name"', loads[0])
+        self.assertNotIn('"password"', loads[0])
+        self.assertNotIn('"location"', loads[0])
+
+        #  Unknown names are ignored, every field when none is known
+        r = self.c.get('/api/user/profile/fieldsUser', {'fields': 'username,password'})
+        self.assertEqual(r.json(), {'username': 'fieldsUser'})
+        r = self.c.get('/api/user/profile/fieldsUser', {'fields': 'password'})
+        self.assertIn('friend_count', r.json())
+
+    def test_related_fields_loaded_when_selected(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.c.get('/api/user/profile/fieldsUser', {'fields': 'username'})
+        self.assertFalse([query for query in queries if 'interest' in query['sql']])
+
+        r = self.c.get('/api/user/profile/fieldsUser', {'fields': 'username,interests'})
+        self.assertEqual(r.json(), {'username': 'fieldsUser', 'interests': []})
+
+    def test_own_profile_fields(self):
+        r = self.c.patch('/api/user/profile/edit/fieldsUser?fields=username,interests,friend_count')
+        self.assertEqual(r.json(), {'username': 'fieldsUser', 'interests': [], 'friend_count': 0})
+        r = self.c.patch('/api/user/profile/edit/fieldsUser')
+        self.assertEqual(r.json()['bio'], 'Bio')
+        self.assertNotIn('password', r.json())
+
+
+class InterestsTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            email="interests@email.com",
+            date_of_birth="1980-03-20",
+            username="interestsUser",
+            password="interestsPassword"
+        )
+        self.c = Client()
+        self.c.login(username="interestsUser", password="interestsPassword")
+        #  The index as kept outside a transaction, tests always run in one
+        patcher = mock.patch.object(interest_index, 'keepable', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(interest_index.invalidate)
+
+    def titles(self, user):
+        return sorted(user.interests.values_list('title', flat=True))
+
+    def test_patch_interests(self):
+        Interest.objects.create(title="Chess")
+        interests = json.dumps([{'title': "Chess"}, {'title': "Piano"}, {'title': "Piano"}])
+        r = self.c.patch(
+            '/api/user/profile/edit/interestsUser',
+            json.dumps({'interests': interests}),
+            content_type='application/json'
+        )
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.titles(self.user), ["Chess", "Piano"])
+        self.assertEqual(Interest.objects.count(), 2)
+
+        r = self.c.patch(
+            '/api/user/profile/edit/interestsUser',
+            json.dumps({'interests': json.dumps([{'title': "x" * 51}])}),
+            content_type='application/json'
+        )
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(self.titles(self.user), ["Chess", "Piano"])
+
+        #  Only a list of interests is taken
+        for interests in ('"chess"', '{"chess": 1}', '3'):
+            r = self.c.patch(
+                '/api/user/profile/edit/interestsUser',
+                json.dumps({'interests': interests}),
+                content_type='application/json'
+            )
+            self.assertEqual(r.status_code, 400)
+        self.assertEqual(self.titles(self.user), ["Chess", "Piano"])
+        self.assertEqual(Interest.objects.count(), 2)
+
+        #  Interests are left as they were when the rest of a patch fails
+        r = self.c.patch(
+            '/api/user/profile/edit/interestsUser',
+            json.dumps({'interests': json.dumps(["Golf"]), 'primary_color': "#" * 20}),
+            content_type='application/json'
+        )
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(self.titles(self.user), ["Chess", "Piano"])
+        self.assertFalse(Interest.objects.filter(title="Golf").exists())
+
+    def test_queries_do_not_grow_with_interests(self):
+        set_interests(self.user, ["Old", "Kept"])
+        few = [f"Few {i}" for i in range(2)]
+        many = [f"Many {i}" for i in range(20)]
+        with CaptureQueriesContext(connection) as queries:
+            set_interests(self.user, ["Kept"] + few)
+        with self.assertNumQueries(len(queries)):
+            set_interests(self.user, ["Kept"] + many)
+        self.assertEqual(self.titles(self.user), sorted(["Kept"] + many))
+
+    def test_autocomplete(self):
+        for title in ["Painting", "pottery", "Piano", "Chess"]:
+            Interest.objects.create(title=title)
+        self.assertEqual(autocomplete("P"), ["Painting", "Piano", "pottery"])
+        self.assertEqual(autocomplete("pi"), ["Piano"])
+        self.assertEqual(autocomplete("z"), [])
+
+        #  Kept in process until interests change
+        with self.assertNumQueries(0):
+            autocomplete("c")
+        set_interests(self.user, ["Pinball"])
+        r = self.c.get('/api/user/interests/autocomplete', {'q': 'pi', 'limit': 5})
+        self.assertEqual(r.json(), ["Piano", "Pinball"])
+        #  Out of range limits are brought back in
+        for limit in (0, -1):
+            r = self.c.get('/api/user/interests/autocomplete', {'q': 'p', 'limit': limit})
+            self.assertEqual(r.json(), ["Painting"])
+
+
+class LoginTestCase(TestCase):
+
+    def setUp(self) -> None:
+        patcher = mock.patch.object(presence, 'client', LocalRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(email="login@email.com", username="loginUser", password="pw")
+        self.c = Client()
+
+    def login(self, password="pw", username="loginUser"):
+        return self.c.post('/api/user/login', {'username': username, 'password': password})
+
+    def test_login_is_one_query(self):
+        #  The first login may reset the daily chance
+        self.login()
+        with self.assertNumQueries(1):
+            r = self.login()
+        self.assertEqual(r.status_code, 200)
+        data = r.json()
+        self.assertEqual(data['auth_token'], get_auth_token(self.user).key)
+        self.assertEqual((data['shinies'], data['muns']), (self.user.shinies, self.user.muns))
+
+    def test_failed_logins_hash_the_password(self):
+        with mock.patch('django.contrib.auth.base_user.make_password', wraps=make_password) as hashed:
+            self.assertEqual(self.login(username="nobody").status_code, 401)
+        self.assertEqual(hashed.call_count, 1)
+        self.assertEqual(self.login(password="wrong").status_code, 401)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.login().status_code, 401)
+
+
+class HashingTestCase(TestCase):
+
+    def setUp(self) -> None:
+        patcher = mock.patch.object(presence, 'client', LocalRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(email="hash@email.com", username="hashUser", password="pw")
+        self.c = Client()
+
+    def login(self):
+        return self.c.post('/api/user/login', {'username': "hashUser", 'password': "pw"})
+
+    def password(self):
+        return User.objects.get(pk=self.user.pk).password
+
+    def test_scrypt(self):
+        hasher = ScryptPasswordHasher()
+        encoded = hasher.encode("secret", "salt")
+        self.assertTrue(encoded.startswith('scrypt$16384$salt$8$1$'))
+        self.assertTrue(hasher.verify("secret", encoded))
+        self.assertFalse(hasher.verify("wrong", encoded))
+        self.assertFalse(hasher.must_update(encoded))
+        with override_settings(PASSWORD_SCRYPT={'n': 2 ** 12, 'r': 8, 'p': 1}):
+            self.assertTrue(hasher.must_update(encoded))
+        #  New passwords use the configured hasher
+        self.assertTrue(self.password().startswith('scrypt$'))
+
+    def test_rehash_on_login(self):
+        User.objects.filter(pk=self.user.pk).update(password=make_password("pw", hasher='pbkdf2_sha256'))
+        self.assertEqual(self.login().status_code, 200)
+        self.assertTrue(self.password().startswith('scrypt$16384$'))
+
+        #  Rehashed once, not on every login
+        with CaptureQueriesContext(connection) as queries:
+            self.login()
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE "users_user"')])
+
+        #  And again when the parameters change
+        with override_settings(PASSWORD_SCRYPT={'n': 2 ** 12, 'r': 8, 'p': 1}):
+            self.assertEqual(self.login().status_code, 200)
+        self.assertTrue(self.password().startswith('scrypt$4096$'))
+
+    @override_settings(LOGIN_HASH_TIMEOUT=0.01)
+    def test_busy(self):
+        slots = HashSlots(1)
+        with mock.patch('users.backends.hash_slots', slots):
+            with slots.hold():
+                r = self.login()
+                #  Other callers of authenticate see a failed login
+                self.assertFalse(Client().login(username="hashUser", password="pw"))
+                admin_login = Client().post('/admin/login/', {'username': "hashUser", 'password': "pw"})
+            self.assertEqual(r.status_code, 503)
+            self.assertEqual(r['Retry-After'], '1')
+            self.assertEqual(admin_login.status_code, 200)
+            self.assertEqual(self.login().status_code, 200)
+
+    def test_calibrate_hashing(self):
+        out = io.StringIO()
+        call_command('calibrate_hashing', '--target-ms', '1', stdout=out)
+        self.assertIn("PASSWORD_SCRYPT = {'n': ", out.getvalue())
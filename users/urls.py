@@ -9,7 +9,7 @@ from rest_framework.generics import RetrieveAPIView, ListAPIView, UpdateAPIView
 from . import views
 from .models import User
 from .serializers import QuickUserSerializer, OwnProfileSerializer
-from .views import OwnProfileView
+from .views import OwnProfileView, UserPagination
 
 urlpatterns = [
     path(
@@ -46,7 +46,8 @@ urlpatterns = [
         authentication_classes=settings.AUTH_CLASSES,
         permission_classes=settings.PERM_CLASSES,
         serializer_class=QuickUserSerializer,
-        queryset=User.objects.all(),
+        pagination_class=UserPagination,
+        queryset=User.objects.select_related('avatar_image'),
     )),
 
     path('view/<str:username>', RetrieveAPIView.as_view(
@@ -54,7 +55,7 @@ urlpatterns = [
         permission_classes=settings.PERM_CLASSES,
         serializer_class=QuickUserSerializer,
         lookup_field="username",
-        queryset=User.objects.all(),
+        queryset=User.objects.select_related('avatar_image'),
     )),
 
     path('validate', views.ValidateUserData.as_view(), name="validate_username"),
@@ -63,5 +64,10 @@ urlpatterns = [
         views.Activate.as_view(), name='activate'
     ),
     path('search', views.UserSearch.as_view(), name="user_search"),
+    path('interests/autocomplete', views.InterestAutocomplete.as_view(), name="interest_autocomplete"),
+    path('friends', views.Friends.as_view(), name="friends"),
+    path('friends/suggestions', views.FriendSuggestions.as_view(), name="friend_suggestions"),
+    path('friends/of/<str:username>', views.FriendList.as_view(), name="friend_list"),
+    path('friends/mutual/<str:username>', views.MutualFriendList.as_view(), name="mutual_friends"),
     path('color/<str:username>', views.UserColorView.as_view(), name="user_colors"),
 ]
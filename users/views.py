@@ -4,19 +4,35 @@ from django.conf import settings
 from django.contrib.auth import authenticate, logout
 from django.contrib.sites.shortcuts import get_current_site
 from django.core.exceptions import ObjectDoesNotExist
-from django.core.mail import EmailMessage
-from django.shortcuts import redirect
+from django.db import transaction
+from django.shortcuts import get_object_or_404, redirect
 from django.template.loader import render_to_string
 from django.utils.encoding import force_bytes, force_text
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from rest_framework import status
-from rest_framework.generics import RetrieveAPIView, UpdateAPIView
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import ListAPIView, RetrieveAPIView, UpdateAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import User, Interest
+from main.mail import queue_mail
+from vivacity_api.pagination import KeysetPagination
+from .friends import friends_of, friend_count, add_friends, remove_friends, mutual_friends, suggestions, \
+    SUGGESTIONS, MAX_BULK
+from .interests import set_interests, autocomplete, valid_title, AUTOCOMPLETE_LIMIT
+from .models import User
+from .presence import presence
+from .search import search_users, DEFAULT_LIMIT, MAX_LIMIT
 from .serializers import NewUserSerializer, LoginSerializer, ProfileSerializer, OwnProfileSerializer, \
-    InterestSerializer, QuickUserSerializer, ColorSerializer
+    QuickUserSerializer, ColorSerializer, FriendSuggestionSerializer, selected_fields
+
+
+class UserPagination(KeysetPagination):
+    ordering = ('joined_on', 'pk')
+
+
+class FriendPagination(KeysetPagination):
+    ordering = ('username', 'pk')
 
 
 class Login(APIView):
@@ -25,11 +41,16 @@ class Login(APIView):
         username = request.data['username']
         password = request.data['password']
         user = authenticate(request, username=username, password=password)
+        if getattr(request, 'hashing_busy', False):
+            # More logins than hashes can keep up with, try again shortly
+            return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
 
         if user is not None:
-            user.online = True
+            presence.heartbeat(user.pk)
+            daily_chance = user.dailyChance
             user.set_dailyChance(state="reset")  # Checks and sets dailyChance item bool
-            user.save()
+            if user.dailyChance != daily_chance:
+                user.save(update_fields=['dailyChance'])
             loggedUser = LoginSerializer(user, context={"request": request})
             loggedIn = loggedUser.data
         else:
@@ -43,9 +64,7 @@ class Logout(APIView):
     permission_classes = settings.PERM_CLASSES
 
     def get(self, request):
-        request.user.online = False
-        print("User should be offline NOW")
-        request.user.save()
+        presence.leave(request.user.pk)
         logout(request)
         return Response({"loggedOut": True}, status=status.HTTP_200_OK)
 
@@ -61,11 +80,8 @@ class CreateUser(APIView):
             'token': user.auth_token,
         })
         to_email = ['jsyme222@gmail.com', ]
-        email = EmailMessage(
-            mail_subject, message, to=to_email
-        )
-        email.send()
-        print("Sent Mail")
+        #  Sent by the send_queued_mail worker, not during the request
+        queue_mail(mail_subject, message, to_email)
 
     def post(self, request):
         data = request.data
@@ -112,6 +128,10 @@ class ProfileView(RetrieveAPIView):
     queryset = User.objects.all()
     serializer_class = ProfileSerializer
 
+    def get_queryset(self):
+        #  Only what the ?fields asked for is loaded
+        return self.get_serializer().project(self.queryset.all())
+
 
 class OwnProfileView(UpdateAPIView):
     authentication_classes = settings.AUTH_CLASSES
@@ -119,57 +139,47 @@ class OwnProfileView(UpdateAPIView):
     lookup_field = "username"
     queryset = User.objects.all()
 
-    def token_from_string(self, token_string):
-        """Token is in Authorization: Token <TOKEN> - format
-        so must this pulls just the TOKEN from string
-        """
-        token = token_string.split()[1]
-        return token
-
-    def authorized(self, username, token_string):
-        token = self.token_from_string(token_string)
-        try:
-            user = User.objects.get(username=username)
-            requesting_token = user.auth_token
-        except ObjectDoesNotExist:
-            return False
-        return str(token) == str(requesting_token)
+    def authorized(self, request, username):
+        #  The requesting user, already resolved from the token by
+        # authentication, must own the profile
+        return request.user.is_authenticated and request.user.username == username
 
     def patch(self, request, *args, **kwargs):
-        token_string = request.headers['Authorization']
-        if self.authorized(kwargs['username'], token_string):
+        if self.authorized(request, kwargs['username']):
             # User is owner of profile
             data = request.data
-            profile_user = User.objects.get(username=kwargs['username'])
             if not data:
-                # No patch data sent so return is full user profile data
-                serialized_profile = OwnProfileSerializer(profile_user)
+                # No patch data sent so return is the user profile data,
+                # only the ?fields asked for when given
+                serialized_profile = OwnProfileSerializer(fields=selected_fields(request))
+                profile_user = serialized_profile.project(User.objects.all()).get(pk=request.user.pk)
+                serialized_profile.instance = profile_user
                 user_data = serialized_profile.data
                 return Response(
                     user_data,
                     status=status.HTTP_200_OK
                 )
             else:
-                # Check for interest and create/add interests
+                profile_user = User.objects.get(username=kwargs['username'])
+                # Everything is checked before anything is written
+                titles = None
                 if 'interests' in data.keys():
-                    interests = data['interests']
-                    interests = json.loads(interests)
-                    profile_user.interests.set([])
-                    for interest in interests:
-                        try:
-                            obj = Interest.objects.get(title=interest['title'])
-                        except ObjectDoesNotExist:
-                            serialized_interest = InterestSerializer(data=interest)
-                            if serialized_interest.is_valid():
-                                serialized_interest.save()
-                                obj = Interest.objects.get(title=serialized_interest.data['title'])
-                            else:
-                                return Response(
-                                    {"Value Error": "Value error in data"},
-                                    status=status.HTTP_400_BAD_REQUEST
-                                )
-                        profile_user.interests.add(obj)  # Add interest to profile
-                        profile_user.save()
+                    try:
+                        interests = json.loads(data['interests'])
+                        # A string or object would be read a character
+                        # or key at a time
+                        if isinstance(interests, list):
+                            titles = [
+                                interest['title'] if isinstance(interest, dict) else interest
+                                for interest in interests
+                            ]
+                    except (ValueError, TypeError, KeyError):
+                        titles = None
+                    if titles is None or not all(valid_title(title) for title in titles):
+                        return Response(
+                            {"Value Error": "Value error in data"},
+                            status=status.HTTP_400_BAD_REQUEST
+                        )
 
                 serialized_profile_data = OwnProfileSerializer(
                     profile_user,
@@ -177,7 +187,11 @@ class OwnProfileView(UpdateAPIView):
                     partial=True
                 )
                 if serialized_profile_data.is_valid():
-                    serialized_profile_data.save()
+                    with transaction.atomic():
+                        # Replace the interests, creating the new ones
+                        if titles is not None:
+                            set_interests(profile_user, titles)
+                        serialized_profile_data.save()
                     serialized_return_data = LoginSerializer(profile_user, context={'request': request})
                     return Response(
                         serialized_return_data.data,
@@ -242,28 +256,6 @@ class UserSearch(APIView):
     authentication_classes = settings.AUTH_CLASSES
     permission_classes = settings.PERM_CLASSES
 
-    def search(self, term, user=None):
-        users = User.objects.all()
-        if user:
-            users = user.get_friends()
-
-        matches = []
-        names = users.filter(display_full_name=True)\
-            .filter(first_name__icontains=term)
-        matches += [name for name in names]
-
-        usernames = users.filter(username__icontains=term)
-        matches += [user for user in usernames]
-
-        cleaned_matches = []
-        for match in matches:
-            if match not in cleaned_matches:
-                cleaned_matches.append(match)
-
-        cleaned_matches = [user for user in cleaned_matches]
-
-        return cleaned_matches
-
     def get(self, *args, **kwargs):
         payload = []
         user = None
@@ -271,23 +263,104 @@ class UserSearch(APIView):
         if 'search_terms' in get.keys():
             terms = get['search_terms'].split('_')
             if 'friends' in get.keys():
-                user = self.request.user
-            for term in terms:
-                matches = self.search(term, user)
-                payload += matches
+                #  Friends of the named user, or of the searching user
+                if get['friends']:
+                    user = User.objects.filter(username=get['friends']).first()
+                    if user is None:
+                        return Response(payload, status=status.HTTP_200_OK)
+                else:
+                    user = self.request.user
+            try:
+                limit = max(1, min(int(get.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+            except ValueError:
+                limit = DEFAULT_LIMIT
+            matches = search_users(terms, friends_of=user, limit=limit)
+            payload = QuickUserSerializer(matches, many=True).data
 
-            if len(payload) >= 2:
-                cleaned_payload = []
-                for user in payload:
-                    if user not in cleaned_payload:
-                        cleaned_payload.append(user)
-                payload = cleaned_payload
+        return Response(payload, status=status.HTTP_200_OK)
 
-            payload = [QuickUserSerializer(user).data for user in payload]
 
+class Friends(APIView):
+    """Befriends (post) or unfriends (delete) the requesting user and
+    every user in 'usernames'
+    """
+    authentication_classes = settings.AUTH_CLASSES
+    permission_classes = settings.PERM_CLASSES
+
+    def usernames(self, request) -> list:
+        data = request.data
+        if hasattr(data, 'getlist'):
+            usernames = data.getlist('usernames')
+        else:
+            usernames = data.get('usernames', [])
+            usernames = usernames if isinstance(usernames, list) else [usernames]
+        if len(usernames) > MAX_BULK:
+            raise ValidationError({'usernames': f'At most {MAX_BULK} usernames at once'})
+        return usernames
+
+    def post(self, request):
+        found = add_friends(request.user, self.usernames(request))
+        return Response(
+            {'found': len(found), 'friend_count': friend_count(request.user.pk)},
+            status=status.HTTP_200_OK
+        )
+
+    def delete(self, request):
+        removed = remove_friends(request.user, self.usernames(request))
+        return Response(
+            {'removed': removed, 'friend_count': friend_count(request.user.pk)},
+            status=status.HTTP_200_OK
+        )
+
+
+class FriendList(ListAPIView):
+    """Friends of 'username' by username, a page at a time"""
+    authentication_classes = settings.AUTH_CLASSES
+    permission_classes = settings.PERM_CLASSES
+    serializer_class = QuickUserSerializer
+    pagination_class = FriendPagination
+
+    def get_user_pk(self):
+        return get_object_or_404(User.objects.only('pk'), username=self.kwargs['username']).pk
+
+    def get_queryset(self):
+        return friends_of(self.get_user_pk()).select_related('avatar_image')
+
+
+class MutualFriendList(FriendList):
+    """Friends the requesting user and 'username' have in common"""
+
+    def get_queryset(self):
+        return mutual_friends(self.request.user.pk, self.get_user_pk()).select_related('avatar_image')
+
+
+class FriendSuggestions(APIView):
+    authentication_classes = settings.AUTH_CLASSES
+    permission_classes = settings.PERM_CLASSES
+
+    def get(self, request):
+        try:
+            limit = max(1, min(int(request.GET.get('limit', SUGGESTIONS)), MAX_LIMIT))
+        except ValueError:
+            limit = SUGGESTIONS
+        suggested = suggestions(request.user.pk, limit)
+        payload = FriendSuggestionSerializer(suggested, many=True, context={'request': request}).data
         return Response(payload, status=status.HTTP_200_OK)
 
 
+class InterestAutocomplete(APIView):
+    authentication_classes = settings.AUTH_CLASSES
+    permission_classes = settings.PERM_CLASSES
+
+    def get(self, request):
+        try:
+            limit = max(1, min(int(request.GET.get('limit', AUTOCOMPLETE_LIMIT)), MAX_LIMIT))
+        except ValueError:
+            limit = AUTOCOMPLETE_LIMIT
+        titles = autocomplete(request.GET.get('q', ''), limit)
+        return Response(titles, status=status.HTTP_200_OK)
+
+
 class UserColorView(APIView):
     def get(self, username, request):
         print(username)
@@ -0,0 +1,68 @@
+"""Token authentication that remembers which user a token belongs to,
+so authenticated requests usually resolve their user without a query.
+Entries are dropped by the receivers in users/models.py when a token
+is deleted, its user is saved or deleted (deactivation included) and
+when the user logs out. Other processes only see such a change once
+the entry expires after TOKEN_CACHE_TTL seconds
+"""
+from rest_framework.authentication import TokenAuthentication
+
+from .cache import LocalCache
+
+#  Set here rather than in settings, which imports this module
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 60
+
+
+class TokenCache(LocalCache):
+    """LocalCache of token key -> (user pk, database alias, user row
+    values, token created), indexed by user pk so forgetting a user
+    only touches that user's tokens
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.by_user = {}
+
+    def added(self, key, value):
+        self.by_user.setdefault(value[0], set()).add(key)
+
+    def removed(self, key, value):
+        keys = self.by_user.get(value[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_user[value[0]]
+
+    def forget_user(self, pk):
+        with self.lock:
+            for key in list(self.by_user.get(pk, ())):
+                self.delete_locked(key)
+
+
+token_cache = TokenCache(size=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+
+def forget_user(pk):
+    """Drops every cached token of the user with 'pk'"""
+    token_cache.forget_user(pk)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is None:
+            user, token = super().authenticate_credentials(key)
+            values = tuple(getattr(user, field.attname) for field in user._meta.concrete_fields)
+            token_cache.set(key, (user.pk, user._state.db, values, token.created))
+            return user, token
+
+        # A new instance every request, requests never share a user
+        _, using, values, created = entry
+        model = self.get_model()
+        user_model = model._meta.get_field('user').related_model
+        user = user_model.from_db(using, [field.attname for field in user_model._meta.concrete_fields], values)
+        token = model(key=key, user=user, created=created)
+        token._state.adding = False
+        return user, token
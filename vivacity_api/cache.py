@@ -0,0 +1,193 @@
+"""Read-through cache for whole API payloads. Payloads are kept in a
+Django cache backend (local memory unless configured otherwise) and
+rebuilt by a single worker when they expire or are invalidated.
+LocalCache is a small in-process cache for hot lookups and WarmPool an
+in-process pool of small, rarely changing payloads
+"""
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.db import transaction
+
+
+class PayloadCache:
+    """Caches the result of a build callable under 'name'.
+
+    Invalidating rotates a version token instead of deleting, so a
+    payload built from data read before the invalidation is never
+    served. Once 'timeout' passes the payload goes stale: the worker
+    that takes the lock rebuilds it while the others keep serving the
+    stale copy. With nothing to serve the others wait on the lock for
+    up to 'lock_timeout' seconds before building it themselves
+    """
+    poll_interval = 0.05
+
+    def __init__(self, name, timeout=300, alias='default', lock_timeout=10):
+        self.name = name
+        self.timeout = timeout
+        self.alias = alias
+        self.lock_timeout = lock_timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, part):
+        return f'{self.name}:{part}'
+
+    def version(self):
+        version = self.cache.get(self.key('version'))
+        if version is None:
+            self.cache.add(self.key('version'), uuid.uuid4().hex, None)
+            version = self.cache.get(self.key('version'))
+        return version
+
+    def invalidate(self):
+        self.cache.set(self.key('version'), uuid.uuid4().hex, None)
+
+    def current(self, version):
+        entry = self.cache.get(self.key('payload'))
+        if entry is not None and entry[0] == version:
+            return entry
+        return None
+
+    def get(self, build):
+        version = self.version()
+        entry = self.current(version)
+        if entry is not None:
+            _, fresh_until, payload = entry
+            if fresh_until > time.time() or not self.lock():
+                return payload
+            return self.rebuild(build, version)
+
+        deadline = time.time() + self.lock_timeout
+        while not self.lock():
+            time.sleep(self.poll_interval)
+            entry = self.current(self.version())
+            if entry is not None:
+                return entry[2]
+            if time.time() > deadline:
+                return build()
+        return self.rebuild(build, version)
+
+    def lock(self):
+        return self.cache.add(self.key('lock'), True, self.lock_timeout)
+
+    def rebuild(self, build, version):
+        try:
+            payload = build()
+            # Kept past its timeout so there is a stale copy to serve
+            entry = (version, time.time() + self.timeout, payload)
+            self.cache.set(self.key('payload'), entry, self.timeout * 2)
+            return payload
+        finally:
+            self.cache.delete(self.key('lock'))
+
+
+class LocalCache:
+    """Process-local LRU cache of at most 'size' entries, each expiring
+    'ttl' seconds after it was set. Every process has its own, so a
+    change made elsewhere is only seen once the entry expires
+    """
+
+    def __init__(self, size=1000, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                self.removed(key, value)
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.removed(key, self.entries[key][1])
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            self.added(key, value)
+            while len(self.entries) > self.size:
+                oldest, (_, evicted) = self.entries.popitem(last=False)
+                self.removed(oldest, evicted)
+
+    def delete(self, key):
+        with self.lock:
+            self.delete_locked(key)
+
+    def delete_locked(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.removed(key, entry[1])
+
+    def delete_where(self, test):
+        """Deletes every entry whose value passes 'test'"""
+        with self.lock:
+            for key in [key for key, (_, value) in self.entries.items() if test(value)]:
+                self.delete_locked(key)
+
+    def clear(self):
+        with self.lock:
+            for key, (_, value) in self.entries.items():
+                self.removed(key, value)
+            self.entries.clear()
+
+    def added(self, key, value):
+        """Called with the lock held for every entry set, for subclasses
+        that index the entries"""
+
+    def removed(self, key, value):
+        """Called with the lock held for every entry that leaves"""
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class WarmPool:
+    """Keeps every item returned by a load callable in process and picks
+    from them at random in constant time. invalidate() drops the items
+    so the next pick reloads them, as does 'ttl' seconds passing, which
+    bounds how long a change made in another process goes unseen.
+    Items loaded inside a transaction are not kept, as it could be
+    rolled back
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.loaded = None
+        self.generation = 0
+
+    def keepable(self) -> bool:
+        return not transaction.get_connection().in_atomic_block
+
+    def items(self, load) -> list:
+        loaded = self.loaded
+        if loaded is not None and loaded[0] > time.monotonic():
+            return loaded[1]
+        generation = self.generation
+        items = list(load())
+        # Items invalidated while loading may already be stale
+        if generation == self.generation and self.keepable():
+            self.loaded = (time.monotonic() + self.ttl, items)
+        return items
+
+    def pick(self, load):
+        items = self.items(load)
+        return random.choice(items) if items else None
+
+    def invalidate(self):
+        self.generation += 1
+        self.loaded = None
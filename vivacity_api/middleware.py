@@ -0,0 +1,152 @@
+"""Per view timing for the whole API. Every request records its SQL
+query count, time spent in the database, time spent serializing and
+wall time. They are sent back as a Server-Timing header and kept in
+bounded per view samples served by main.views.MetricsView. Serializer
+time is that of the serializers with TimedSerializerMixin.
+PresenceMiddleware heartbeats the users making requests
+"""
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils.functional import SimpleLazyObject, empty
+
+from users.presence import presence
+
+METRICS = ('queries', 'db', 'serializer', 'wall')
+PERCENTILES = (50, 95, 99)
+
+_local = threading.local()
+
+
+class ViewStats:
+    """Last 'samples' measurements of every metric for one view"""
+
+    def __init__(self, view, samples):
+        self.view = view
+        self.requests = 0
+        self.samples = {metric: deque(maxlen=samples) for metric in METRICS}
+
+    def add(self, measured):
+        self.requests += 1
+        for metric in METRICS:
+            self.samples[metric].append(measured[metric])
+
+    def summary(self) -> dict:
+        summary = {'view': self.view, 'requests': self.requests}
+        for metric, samples in self.samples.items():
+            ordered = sorted(samples)
+            summary[metric] = {
+                f'p{p}': ordered[min(len(ordered) - 1, len(ordered) * p // 100)] if ordered else None
+                for p in PERCENTILES
+            }
+        return summary
+
+
+class Metrics:
+
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, route, view, measured):
+        with self.lock:
+            if route not in self.views:
+                self.views[route] = ViewStats(view, self.samples)
+            self.views[route].add(measured)
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {route: stats.summary() for route, stats in self.views.items()}
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+
+metrics = Metrics(getattr(settings, 'METRICS_SAMPLES', 1000))
+
+
+class TimedSerializerMixin:
+    """Adds the time serializing each object to the serializer time
+    of the request. Serializers nested in a timed one are not counted
+    twice, list serializers time every item through their child
+    """
+
+    def to_representation(self, instance):
+        timings = getattr(_local, 'timings', None)
+        if timings is None or timings['depth']:
+            return super().to_representation(instance)
+        timings['depth'] += 1
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timings['serializer'] += time.perf_counter() - start
+            timings['depth'] -= 1
+
+
+class TimingMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def count_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            _local.timings['db'] += time.perf_counter() - start
+            _local.timings['queries'] += 1
+
+    def __call__(self, request):
+        _local.timings = timings = {'queries': 0, 'db': 0.0, 'serializer': 0.0, 'depth': 0}
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self.count_query))
+                response = self.get_response(request)
+        finally:
+            _local.timings = None
+        timings['wall'] = time.perf_counter() - start
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={timings["db"] * 1000:.1f};desc="{timings["queries"]} queries"',
+            f'ser;dur={timings["serializer"] * 1000:.1f}',
+            f'total;dur={timings["wall"] * 1000:.1f}',
+        ])
+        match = request.resolver_match
+        if match is not None:
+            view = getattr(match.func, 'view_class', match.func).__name__
+            metrics.record(match.route, view, {
+                'queries': timings['queries'],
+                'db': round(timings['db'] * 1000, 3),
+                'serializer': round(timings['serializer'] * 1000, 3),
+                'wall': round(timings['wall'] * 1000, 3),
+            })
+        return response
+
+
+class PresenceMiddleware:
+    """Marks the user of every authenticated request as online. Only
+    users something already looked up count, a session user nobody
+    asked for is not loaded just for this
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        # DRF authentication replaces the lazy session user
+        user = request.__dict__.get('user')
+        if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+            return response
+        if user is not None and user.is_authenticated:
+            presence.heartbeat(user.pk)
+        return response
@@ -0,0 +1,119 @@
+"""Keyset pagination shared by the API listings. Pages are found by
+filtering past the (value, pk) of the last row seen instead of an
+OFFSET, so any page costs the same as the first
+"""
+import base64
+import json
+from urllib import parse
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Subclasses set 'ordering' to a (field, 'pk') pair, prefixed
+    with '-' for newest first. A composite index over the field and
+    the pk is expected to back it
+    """
+    ordering = None
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        field = self.ordering[0].lstrip('-')
+        self.field = field
+        descending = self.ordering[0].startswith('-')
+
+        cursor = self.decode_cursor(request, queryset.model._meta.get_field(field))
+        reverse = cursor is not None and cursor['reverse']
+        if reverse:
+            # Walking back a page reads the other way and flips after
+            descending = not descending
+
+        order_by = [f'-{field}', '-pk'] if descending else [field, 'pk']
+        queryset = queryset.order_by(*order_by)
+        if cursor is not None:
+            queryset = queryset.filter(self.past(field, cursor, descending))
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            if has_more or reverse:
+                self.next_position = results[-1]
+            if (has_more and reverse) or (cursor is not None and not reverse):
+                self.previous_position = results[0]
+        return results
+
+    def past(self, field, cursor, descending):
+        lookup = 'lt' if descending else 'gt'
+        value, pk = cursor['value'], cursor['pk']
+        return Q(**{f'{field}__{lookup}': value}) | \
+            Q(**{field: value, f'pk__{lookup}': pk})
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def cursor_for(self, obj, reverse=False) -> str:
+        """Opaque cursor for the page after (or before) 'obj'"""
+        value = getattr(obj, self.ordering[0].lstrip('-'))
+        position = {
+            'value': value.isoformat() if hasattr(value, 'isoformat') else value,
+            'pk': obj.pk,
+            'reverse': reverse,
+        }
+        return base64.urlsafe_b64encode(json.dumps(position).encode('ascii')).decode('ascii')
+
+    def encode_cursor(self, obj, reverse):
+        return replace_query_param(self.base_url, self.cursor_query_param, self.cursor_for(obj, reverse))
+
+    def decode_cursor(self, request, model_field):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(parse.unquote(encoded).encode('ascii')))
+            return {
+                'value': model_field.to_python(position['value']),
+                'pk': int(position['pk']),
+                'reverse': bool(position['reverse']),
+            }
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
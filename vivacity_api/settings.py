@@ -5,9 +5,10 @@ Django settings for vivacity_api project.
 
 import os
 
-from rest_framework.authentication import TokenAuthentication, SessionAuthentication
+from rest_framework.authentication import SessionAuthentication
 from rest_framework.permissions import IsAuthenticated
 
+from .authentication import CachedTokenAuthentication
 from .base_settings import KEY
 
 URL = 'localhost:8000'
@@ -42,9 +43,36 @@ INSTALLED_APPS = [
 ]
 
 AUTH_USER_MODEL = 'users.User'
+AUTHENTICATION_BACKENDS = [
+    #  ModelBackend loading the wallet and token with the user
+    'users.backends.LoginBackend',
+]
+
+#  Hasher of new passwords, and of old ones as they log in: 'scrypt',
+#  'argon2' (needs argon2-cffi) or 'pbkdf2'. See users/hashers.py
+PASSWORD_HASH_ALGORITHM = 'scrypt'
+#  Hash parameters, measured for the servers with calibrate_hashing.
+#  Changing them rehashes passwords as they log in
+PASSWORD_SCRYPT = {'n': 2 ** 14, 'r': 8, 'p': 1}
+PASSWORD_ARGON2 = {'time_cost': 2, 'memory_cost': 102400, 'parallelism': 8}
+#  Hasher of each PASSWORD_HASH_ALGORITHM
+PASSWORD_HASHER_PATHS = {
+    'scrypt': 'users.hashers.ScryptPasswordHasher',
+    'argon2': 'users.hashers.Argon2PasswordHasher',
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+}
+PASSWORD_HASHERS = [PASSWORD_HASHER_PATHS[PASSWORD_HASH_ALGORITHM]] + [
+    hasher for algorithm, hasher in PASSWORD_HASHER_PATHS.items() if algorithm != PASSWORD_HASH_ALGORITHM
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+#  Password hashes logins compute at once per process, the CPU count
+#  when None. Others wait up to LOGIN_HASH_TIMEOUT seconds for a turn
+#  and are answered 503 after
+LOGIN_HASH_CONCURRENCY = None
+LOGIN_HASH_TIMEOUT = 5
 
 AUTH_CLASSES = [
-    TokenAuthentication,
+    #  TokenAuthentication that caches token -> user in process
+    CachedTokenAuthentication,
     SessionAuthentication,
 ]
 PERM_CLASSES = [IsAuthenticated, ]
@@ -59,18 +87,50 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'vivacity_api.middleware.TimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'vivacity_api.middleware.PresenceMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 CORS_ORIGIN_ALLOW_ALL = True
 
+#  Users count as online for PRESENCE_TTL seconds after their last
+#  authenticated request. Presence is kept in process (so per worker)
+#  unless PRESENCE_REDIS_URL points at a Redis shared by every worker
+PRESENCE_TTL = 300
+PRESENCE_REDIS_URL = None
+
+#  Seconds the home page NPC pool is kept before reloading, changes
+#  made in this process reload it at once
+NPC_POOL_TTL = 300
+
+#  Seconds the interest autocomplete index is kept before reloading,
+#  interests created in this process reload it at once
+INTEREST_INDEX_TTL = 300
+
+# Requests per view kept for the percentiles at api/main/metrics
+METRICS_SAMPLES = 1000
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Cache alias and seconds before the forum widget payload is rebuilt
+FORUM_WIDGET_CACHE = 'default'
+FORUM_WIDGET_TIMEOUT = 300
+
+# Seconds between writes of the buffered board views
+BOARD_VIEWS_FLUSH_INTERVAL = 10
+
 ROOT_URLCONF = 'vivacity_api.urls'
 
 TEMPLATES = [
@@ -131,6 +191,16 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Browser cache lifetime of media whose name is not content addressed,
+# see vivacity_api/storage.py
+MEDIA_MAX_AGE = 3600
+
+# Avatar variants, see users/avatars.py. Formats the installed Pillow
+# cannot write are skipped, png is always made. AVATAR_WORKERS threads
+# process uploads, 0 processes them in the saving thread on commit
+AVATAR_FORMATS = ('avif', 'webp', 'png')
+AVATAR_WORKERS = 2
+
 # Email settings
 
 EMAIL_USE_TLS = True
@@ -138,3 +208,12 @@ EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_HOST_USER = 'jsyme222@gmail.com'
 EMAIL_HOST_PASSWORD = 'jwmxuihhndmpdrox'
 EMAIL_PORT = 587
+
+# Mail queue, see main/mail.py. The send_queued_mail worker sends
+# through MAIL_QUEUE_BACKEND (EMAIL_BACKEND when None) and retries
+# failures after MAIL_RETRY_DELAY seconds, doubling up to
+# MAIL_RETRY_MAX_DELAY, until MAIL_MAX_ATTEMPTS
+MAIL_QUEUE_BACKEND = None
+MAIL_RETRY_DELAY = 60
+MAIL_RETRY_MAX_DELAY = 3600
+MAIL_MAX_ATTEMPTS = 8
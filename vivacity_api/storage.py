@@ -0,0 +1,154 @@
+"""Content-addressed media storage. Files are stored under the sha256 of
+their content, so identical uploads share one file and a name never
+changes content, which lets clients cache them forever. Every name is
+reference counted in main.StoredFile: saving adds a reference, deleting
+drops one and only the last removes the file. References are counted
+from the file fields again, and unreferenced files removed, by the
+content_address_media command. The receivers in main/models.py drop
+the reference of a name a row stops using, by being deleted or saved
+with another file. serve_media adds the cache headers when
+Django serves media, set the same headers in front of it otherwise
+"""
+import hashlib
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F, FileField
+from django.utils.deconstruct import deconstructible
+from django.views.static import serve
+
+CONTENT_PREFIX = 'cas/'
+#  Names whose content never changes, avatar variants are named by
+#  their content hash as well
+IMMUTABLE_PREFIXES = (CONTENT_PREFIX, 'avatars/variants/')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def content_name(digest, name) -> str:
+    extension = os.path.splitext(name)[1].lower()
+    return f'{CONTENT_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """MEDIA_ROOT storage saving files by content hash. Names saved
+    before it (defaults included) are still opened and served
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The real name comes from the content in _save
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        name = content_name(digest.hexdigest(), name)
+        if not self.exists(name):
+            name = super()._save(name, content)
+        self.retain(name)
+        return name
+
+    def retain(self, name, count=1):
+        StoredFile = apps.get_model('main', 'StoredFile')
+        if StoredFile.objects.filter(name=name).update(refs=F('refs') + count):
+            return
+        try:
+            with transaction.atomic():
+                StoredFile.objects.create(name=name, refs=count)
+        except IntegrityError:
+            # Created by a concurrent save
+            StoredFile.objects.filter(name=name).update(refs=F('refs') + count)
+
+    def delete(self, name):
+        """Drops a reference, the file goes with the last one. Names
+        from before content addressing are deleted as usual
+        """
+        if not name.startswith(CONTENT_PREFIX):
+            return super().delete(name)
+        StoredFile = apps.get_model('main', 'StoredFile')
+        with transaction.atomic():
+            StoredFile.objects.filter(name=name, refs__gt=0).update(refs=F('refs') - 1)
+            released = StoredFile.objects.filter(name=name, refs__lte=0).delete()[0]
+        if released:
+            super().delete(name)
+
+
+content_storage = ContentAddressedStorage()
+
+
+def content_fields() -> list:
+    """(model, field name) of every file field kept in content_storage"""
+    return [
+        (model, field.name)
+        for model in apps.get_models()
+        for field in model._meta.concrete_fields
+        if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage)
+    ]
+
+
+def loaded_names(instance, fields) -> dict:
+    """The names 'instance' holds in its 'fields', deferred ones left out"""
+    names = {}
+    for field in fields:
+        value = instance.__dict__.get(field)
+        if value is not None:
+            names[field] = getattr(value, 'name', value)
+    return names
+
+
+def release(names):
+    """Drops a reference to each content addressed name once the
+    transaction commits. Names from before content addressing, defaults
+    included, are left alone
+    """
+    names = [name for name in names if name and name.startswith(CONTENT_PREFIX)]
+
+    def delete():
+        for name in names:
+            content_storage.delete(name)
+
+    if names:
+        transaction.on_commit(delete)
+
+
+def recount() -> dict:
+    """Sets every reference count to the rows using the name, removes
+    files nothing uses. Returns the amount of names counted and removed
+    """
+    StoredFile = apps.get_model('main', 'StoredFile')
+    counts = {}
+    for model, field in content_fields():
+        for name in model.objects.filter(**{f'{field}__startswith': CONTENT_PREFIX}).values_list(field, flat=True):
+            counts[name] = counts.get(name, 0) + 1
+    removed = 0
+    with transaction.atomic():
+        for stored in StoredFile.objects.select_for_update():
+            if stored.name not in counts:
+                stored.delete()
+                FileSystemStorage.delete(content_storage, stored.name)
+                removed += 1
+            elif stored.refs != counts[stored.name]:
+                StoredFile.objects.filter(pk=stored.pk).update(refs=counts[stored.name])
+        known = set(StoredFile.objects.values_list('name', flat=True))
+        StoredFile.objects.bulk_create([
+            StoredFile(name=name, refs=refs) for name, refs in counts.items() if name not in known
+        ])
+    return {'counted': len(counts), 'removed': removed}
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """django.views.static.serve with cache headers, forever for
+    content addressed names and MEDIA_MAX_AGE seconds for the rest
+    """
+    response = serve(request, path, document_root, show_indexes)
+    if path.startswith(IMMUTABLE_PREFIXES):
+        response['Cache-Control'] = IMMUTABLE
+    else:
+        response['Cache-Control'] = f'public, max-age={settings.MEDIA_MAX_AGE}'
+    return response
@@ -7,10 +7,12 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path
 
+from vivacity_api.storage import serve_media
+
 urlpatterns = [
                   path('admin/', admin.site.urls),
                   path('api/main/', include('main.urls')),
                   path('api/board/', include('boards.urls')),
                   path('api/user/', include('users.urls')),
                   path('api/auth/', include('djoser.urls.authtoken')),
-              ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+              ] + static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,141 @@
+"""Double-entry ledger for wallets. Every movement is a Transfer whose
+LedgerEntry rows add up to zero. Balances are changed with
+conditional F() updates inside the same transaction, so concurrent
+transfers never lose an update and a wallet can never overdraw. The
+shinies/muns columns stay the O(1) balance, rebuildable from the
+ledger with rebuild_balances()
+"""
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum
+
+from .models import Wallet, Transfer, LedgerEntry, CURRENCIES
+
+CURRENCY_FIELDS = [currency for currency, _ in CURRENCIES]
+
+
+class InsufficientFunds(ValueError):
+    pass
+
+
+def system_wallet() -> Wallet:
+    """The site's wallet, source of credits and sink of debits"""
+    wallet = Wallet.objects.filter(is_system=True).first()
+    if wallet is None:
+        with transaction.atomic():
+            # The one_system_wallet constraint makes a concurrent first
+            # call get the wallet the other created
+            wallet, _ = Wallet.objects.get_or_create(is_system=True, defaults={'owner': "vivacity"})
+    return wallet
+
+
+def validate(amount, currency):
+    if currency not in CURRENCY_FIELDS:
+        raise AttributeError(f'No attribute {currency}')
+    if type(amount) is not int:
+        raise TypeError(f'Must be integer, not: {type(amount)}')
+    if amount <= 0:
+        raise ValueError(f'Amount must be positive, not: {amount}')
+
+
+def move(entries, currency):
+    """Applies {wallet: amount} to the balances, locking the rows in
+    wallet pk order so concurrent transfers cannot deadlock. Returns
+    the balance each wallet was left with
+    """
+    for wallet in sorted(entries, key=lambda wallet: wallet.pk):
+        amount = entries[wallet]
+        rows = Wallet.objects.filter(pk=wallet.pk)
+        if amount < 0 and not wallet.is_system:
+            # Only takes from a balance that covers it
+            rows = rows.filter(**{f'{currency}__gte': -amount})
+        if not rows.update(**{currency: F(currency) + amount}):
+            raise InsufficientFunds(f'Wallet #{wallet.pk} cannot pay {-amount} {currency}')
+    return dict(
+        Wallet.objects.filter(pk__in=[wallet.pk for wallet in entries]).values_list('pk', currency)
+    )
+
+
+def record(kind, entries, currency, idempotency_key=None, memo=""):
+    """Writes one balanced Transfer of 'entries' ({wallet: amount})
+    atomically. A repeated 'idempotency_key' returns the Transfer it
+    already made without moving anything again
+    """
+    if idempotency_key is not None:
+        done = Transfer.objects.filter(idempotency_key=idempotency_key).first()
+        if done is not None:
+            return done
+    try:
+        with transaction.atomic():
+            transfer = Transfer.objects.create(
+                idempotency_key=idempotency_key,
+                kind=kind,
+                currency=currency,
+                amount=max(entries.values()),
+                memo=memo,
+            )
+            balances = move(entries, currency)
+            LedgerEntry.objects.bulk_create([
+                LedgerEntry(
+                    transfer=transfer,
+                    wallet=wallet,
+                    currency=currency,
+                    amount=amount,
+                    balance_after=balances[wallet.pk],
+                ) for wallet, amount in entries.items()
+            ])
+    except IntegrityError:
+        if idempotency_key is None:
+            raise
+        # The same key was committed by a concurrent request
+        return Transfer.objects.get(idempotency_key=idempotency_key)
+
+    for wallet in entries:
+        # Keep the callers' objects in step with the database
+        setattr(wallet, currency, balances[wallet.pk])
+    return transfer
+
+
+def transfer(sender, receiver, amount, currency, idempotency_key=None, memo=""):
+    validate(amount, currency)
+    if sender.pk == receiver.pk:
+        raise ValueError("Cannot send to the same wallet")
+    return record('transfer', {sender: -amount, receiver: amount}, currency, idempotency_key, memo)
+
+
+def credit(wallet, amount, currency, idempotency_key=None, memo=""):
+    """Gives 'wallet' currency from the site"""
+    validate(amount, currency)
+    return record('credit', {system_wallet(): -amount, wallet: amount}, currency, idempotency_key, memo)
+
+
+def debit(wallet, amount, currency, idempotency_key=None, memo=""):
+    """Takes currency from 'wallet' back to the site"""
+    validate(amount, currency)
+    return record('debit', {wallet: -amount, system_wallet(): amount}, currency, idempotency_key, memo)
+
+
+def ledger_balances(wallet) -> dict:
+    """Balance of every currency summed from the ledger"""
+    totals = dict(
+        LedgerEntry.objects.filter(wallet=wallet)
+        .values_list('currency')
+        .annotate(total=Sum('amount'))
+    )
+    return {currency: totals.get(currency, 0) for currency in CURRENCY_FIELDS}
+
+
+def rebuild_balances(wallets=None) -> int:
+    """Resets the balance columns to what the ledger adds up to,
+    returns the amount of wallets that had drifted
+    """
+    wallets = Wallet.objects.all() if wallets is None else wallets
+    drifted = 0
+    for pk in [wallet.pk for wallet in wallets]:
+        with transaction.atomic():
+            # Locked so no transfer lands between summing and resetting
+            wallet = Wallet.objects.select_for_update().get(pk=pk)
+            balances = ledger_balances(wallet)
+            if any(getattr(wallet, currency) != balance for currency, balance in balances.items()):
+                Wallet.objects.filter(pk=pk).update(**balances)
+                drifted += 1
+    return drifted
@@ -0,0 +1,74 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import User
+from wallet.payouts import payout, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = "Credits or debits currency to many users at once. Interrupted payouts " \
+           "are resumed by running the command again with the same --key"
+
+    def add_arguments(self, parser):
+        parser.add_argument('currency', choices=['shinies', 'muns'])
+        parser.add_argument('--key', required=True, help="Names the payout, wallets already paid under it are skipped")
+        parser.add_argument('--amount', type=int, help="Amount for every user")
+        parser.add_argument('--users', nargs='+', metavar='USERNAME', help="Only these users, default every user")
+        parser.add_argument('--file', help="CSV of username,amount rows for per user amounts")
+        parser.add_argument('--debit', action='store_true', help="Take the currency instead of giving it")
+        parser.add_argument('--memo', default="")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def amounts(self, options) -> dict:
+        if options['file']:
+            if options['amount'] is not None or options['users']:
+                raise CommandError("--file cannot be combined with --amount or --users")
+            by_username = {}
+            lines = {}
+            with open(options['file'], newline='') as file:
+                for line, row in enumerate(csv.reader(file), start=1):
+                    try:
+                        username, amount = row
+                        by_username[username] = int(amount)
+                    except ValueError:
+                        raise CommandError(f"Line {line} of {options['file']} is not username,amount: {row}")
+                    lines[username] = line
+            users = User.objects.filter(username__in=by_username)
+            found = set(users.values_list('username', flat=True))
+            for username in by_username:
+                if username not in found:
+                    self.unknown += 1
+                    self.stderr.write(f"Line {lines[username]} of {options['file']} names no user: {username}")
+        else:
+            if options['amount'] is None:
+                raise CommandError("Give an --amount or a --file of amounts")
+            users = User.objects.all()
+            if options['users']:
+                users = users.filter(username__in=options['users'])
+            by_username = None
+
+        wallets = users.exclude(wallet=None).values_list('username', 'wallet_id')
+        if by_username is None:
+            return {wallet: options['amount'] for _, wallet in wallets}
+        return {wallet: by_username[username] for username, wallet in wallets}
+
+    def handle(self, *args, **options):
+        self.unknown = 0
+        amounts = self.amounts(options)
+        try:
+            report = payout(
+                amounts,
+                options['currency'],
+                options['key'],
+                kind='debit' if options['debit'] else 'credit',
+                memo=options['memo'],
+                chunk_size=options['chunk_size'],
+                log=self.stdout.write,
+            )
+        except (TypeError, ValueError) as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Paid {report["paid"]} wallets {report["total"]} {options["currency"]}, '
+            f'{report["already_paid"]} already paid, {report["skipped"]} skipped, {self.unknown} unknown users'
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from wallet.ledger import rebuild_balances
+
+
+class Command(BaseCommand):
+    help = "Resets every wallet balance to the total of its ledger entries"
+
+    def handle(self, *args, **options):
+        drifted = rebuild_balances()
+        self.stdout.write(self.style.SUCCESS(f'Corrected {drifted} wallets'))
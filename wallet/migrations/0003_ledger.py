@@ -0,0 +1,74 @@
+# Generated by Django 3.0.4 on 2026-10-18 18:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def open_balances(apps, schema_editor):
+    # Balances from before the ledger become opening transfers from
+    # the system wallet so the ledger adds up to them
+    Wallet = apps.get_model('wallet', 'Wallet')
+    Transfer = apps.get_model('wallet', 'Transfer')
+    LedgerEntry = apps.get_model('wallet', 'LedgerEntry')
+    system = None
+    for wallet in Wallet.objects.filter(is_system=False):
+        for currency in ('shinies', 'muns'):
+            balance = getattr(wallet, currency)
+            if not balance:
+                continue
+            if system is None:
+                system = Wallet.objects.create(owner="vivacity", is_system=True)
+            setattr(system, currency, getattr(system, currency) - balance)
+            transfer = Transfer.objects.create(kind='opening', currency=currency, amount=balance)
+            LedgerEntry.objects.bulk_create([
+                LedgerEntry(transfer=transfer, wallet=wallet, currency=currency,
+                            amount=balance, balance_after=balance),
+                LedgerEntry(transfer=transfer, wallet=system, currency=currency,
+                            amount=-balance, balance_after=getattr(system, currency)),
+            ])
+    if system is not None:
+        system.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0002_wallet_owner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Transfer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idempotency_key', models.CharField(blank=True, max_length=100, null=True, unique=True)),
+                ('kind', models.CharField(choices=[('transfer', 'Transfer'), ('credit', 'Credit'), ('debit', 'Debit'), ('opening', 'Opening balance')], default='transfer', max_length=20)),
+                ('currency', models.CharField(choices=[('shinies', 'Shinies'), ('muns', 'Muns')], max_length=20)),
+                ('amount', models.IntegerField()),
+                ('memo', models.CharField(blank=True, default='', max_length=250)),
+                ('created_on_date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='wallet',
+            name='is_system',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(choices=[('shinies', 'Shinies'), ('muns', 'Muns')], max_length=20)),
+                ('amount', models.IntegerField()),
+                ('balance_after', models.IntegerField()),
+                ('created_on_date', models.DateTimeField(auto_now_add=True)),
+                ('transfer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='wallet.Transfer')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='wallet.Wallet')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['wallet', 'currency', 'id'], name='ledger_wallet_idx'),
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
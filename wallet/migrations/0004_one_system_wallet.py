@@ -0,0 +1,27 @@
+# Generated by Django 3.0.4 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+def keep_first_system_wallet(apps, schema_editor):
+    # Wallets created by concurrent first calls stay, as ordinary
+    # wallets, with their ledger entries
+    Wallet = apps.get_model('wallet', 'Wallet')
+    first = Wallet.objects.filter(is_system=True).order_by('pk').first()
+    if first is not None:
+        Wallet.objects.filter(is_system=True).exclude(pk=first.pk).update(is_system=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0003_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(keep_first_system_wallet, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='wallet',
+            constraint=models.UniqueConstraint(condition=models.Q(is_system=True), fields=('is_system',), name='one_system_wallet'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.4 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+def fill_batch_keys(apps, schema_editor):
+    # Payouts keyed their chunks '<batch key>:<first wallet pk>'
+    Transfer = apps.get_model('wallet', 'Transfer')
+    chunks = Transfer.objects.filter(kind__in=['credit', 'debit'], idempotency_key__regex=r':[0-9]+$')
+    for transfer in chunks.only('pk', 'idempotency_key'):
+        batch_key = transfer.idempotency_key.rsplit(':', 1)[0]
+        Transfer.objects.filter(pk=transfer.pk).update(batch_key=batch_key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0004_one_system_wallet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='batch_key',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+        migrations.RunPython(fill_batch_keys, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,17 @@
 from django.db import models
 
+CURRENCIES = (
+    ('shinies', 'Shinies'),
+    ('muns', 'Muns'),
+)
+
 
 class Wallet(models.Model):
 
     owner = models.CharField(max_length=50, blank=False, null=False, default="")
+    # The site's own wallet, the other side of every credit/debit.
+    # Its balance may go negative
+    is_system = models.BooleanField(default=False)
     shinies = models.IntegerField(
         default=0
     )
@@ -11,6 +19,12 @@ class Wallet(models.Model):
         default=0
     )
 
+    class Meta:
+        constraints = [
+            # At most one system wallet, see ledger.system_wallet
+            models.UniqueConstraint(fields=['is_system'], condition=models.Q(is_system=True), name='one_system_wallet'),
+        ]
+
     @property
     def balance(self):
         currencies = {
@@ -21,8 +35,7 @@ class Wallet(models.Model):
 
     def transact_currency(self, amount, currency):
         """Adds/Removes 'amount' of 'currency' from current wallet,
-        this is the base function used in all currency
-        transactions
+        in memory only. Use wallet.ledger to move currency for real
         """
         if currency == "shinies":
             self.shinies += amount
@@ -31,9 +44,10 @@ class Wallet(models.Model):
             self.muns += amount
             return self.muns
 
-    def send_currency(self, send_to, amount, currency):
+    def send_currency(self, send_to, amount, currency, idempotency_key=None):
         """Send currency to another wallet, all transactions
-        are one way, no reception required.
+        are one way, no reception required. Recorded in the ledger,
+        returns the Transfer
         """
         if type(send_to) is type(self):
             # Make sure sending to another wallet object
@@ -43,8 +57,8 @@ class Wallet(models.Model):
                 raise AttributeError(f'No attribute {currency}')
             else:
                 if type(amount) is int:
-                    self.transact_currency(-amount, currency.lower())
-                    send_to.transact_currency(amount, currency.lower())
+                    from .ledger import transfer
+                    return transfer(self, send_to, amount, currency.lower(), idempotency_key)
                 else:
                     raise TypeError(f'Must be integer, not: {type(amount)}')
         else:
@@ -52,3 +66,47 @@ class Wallet(models.Model):
 
     def __str__(self):
         return f'{type(self).__name__}#{self.owner.pk}'
+
+
+class Transfer(models.Model):
+    """One movement of currency, made of LedgerEntry rows that add
+    up to zero. Append only
+    """
+    KINDS = (
+        ('transfer', 'Transfer'),
+        ('credit', 'Credit'),
+        ('debit', 'Debit'),
+        ('opening', 'Opening balance'),
+    )
+
+    idempotency_key = models.CharField(max_length=100, unique=True, blank=True, null=True)
+    # Key of the bulk payout the transfer is a chunk of, see wallet/payouts.py
+    batch_key = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    kind = models.CharField(max_length=20, choices=KINDS, default='transfer')
+    currency = models.CharField(max_length=20, choices=CURRENCIES)
+    amount = models.IntegerField()
+    memo = models.CharField(max_length=250, blank=True, default="")
+    created_on_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.kind} {self.amount} {self.currency}'
+
+
+class LedgerEntry(models.Model):
+    """A signed change to one wallet's balance, with the balance it
+    left behind. Append only
+    """
+    class Meta:
+        indexes = [
+            models.Index(fields=['wallet', 'currency', 'id'], name='ledger_wallet_idx'),
+        ]
+
+    transfer = models.ForeignKey(Transfer, on_delete=models.PROTECT, related_name="entries")
+    wallet = models.ForeignKey(Wallet, on_delete=models.PROTECT, related_name="entries")
+    currency = models.CharField(max_length=20, choices=CURRENCIES)
+    amount = models.IntegerField()
+    balance_after = models.IntegerField()
+    created_on_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.wallet_id} {self.amount:+} {self.currency}'
@@ -0,0 +1,135 @@
+"""Bulk credits and debits, for airdrops and rewards to many wallets
+at once. Wallets are paid a chunk at a time, each chunk being one
+Transfer applied with a single UPDATE and its LedgerEntry rows written
+with one bulk_create. Every payout has a key, wallets already paid
+under it are skipped, so an interrupted payout is resumed by running
+it again with the same key
+"""
+import hashlib
+
+from django.db import transaction
+from django.db.models import Case, When, F, Value, IntegerField
+
+from .ledger import validate, system_wallet
+from .models import Wallet, Transfer, LedgerEntry
+
+CHUNK_SIZE = 1000
+KEY_LENGTH = Transfer._meta.get_field('batch_key').max_length
+CHUNK_KEY_LENGTH = Transfer._meta.get_field('idempotency_key').max_length
+
+
+def chunk_key(key, first_pk) -> str:
+    """Idempotency key of the chunk starting at wallet 'first_pk', the
+    batch key is hashed when the two don't fit the column together
+    """
+    chunk = f'{key}:{first_pk}'
+    if len(chunk) <= CHUNK_KEY_LENGTH:
+        return chunk
+    return f'{hashlib.sha256(key.encode()).hexdigest()}:{first_pk}'
+
+
+def paid_under(key) -> set:
+    """Pks of the wallets a payout with 'key' already reached"""
+    return set(
+        LedgerEntry.objects
+        .filter(transfer__batch_key=key)
+        .exclude(wallet__is_system=True)
+        .values_list('wallet_id', flat=True)
+    )
+
+
+def increment(currency, amounts, sign):
+    """F() expression adding each wallet's amount in one UPDATE"""
+    if len(set(amounts.values())) == 1:
+        change = Value(sign * next(iter(amounts.values())))
+    else:
+        change = Case(
+            *[When(pk=pk, then=Value(sign * amount)) for pk, amount in amounts.items()],
+            output_field=IntegerField(),
+        )
+    return F(currency) + change
+
+
+def pay_chunk(kind, amounts, currency, key, system, memo=""):
+    """Credits or debits {wallet pk: amount} as one Transfer, returns
+    the amounts that were actually moved. Debits skip wallets that
+    cannot cover their amount
+    """
+    sign = 1 if kind == 'credit' else -1
+    with transaction.atomic():
+        if kind == 'debit':
+            balances = dict(
+                Wallet.objects.select_for_update()
+                .filter(pk__in=amounts)
+                .values_list('pk', currency)
+            )
+            amounts = {pk: amount for pk, amount in amounts.items() if balances.get(pk, 0) >= amount}
+        if not amounts:
+            return {}
+        total = sum(amounts.values())
+        transfer = Transfer.objects.create(
+            idempotency_key=chunk_key(key, min(amounts)),
+            batch_key=key,
+            kind=kind,
+            currency=currency,
+            amount=total,
+            memo=memo,
+        )
+        Wallet.objects.filter(pk__in=amounts).update(**{currency: increment(currency, amounts, sign)})
+        Wallet.objects.filter(pk=system.pk).update(**{currency: F(currency) - sign * total})
+        balances = dict(
+            Wallet.objects.filter(pk__in=[*amounts, system.pk]).values_list('pk', currency)
+        )
+        entries = [
+            LedgerEntry(
+                transfer=transfer,
+                wallet_id=pk,
+                currency=currency,
+                amount=sign * amount,
+                balance_after=balances[pk],
+            ) for pk, amount in amounts.items()
+        ]
+        entries.append(LedgerEntry(
+            transfer=transfer,
+            wallet=system,
+            currency=currency,
+            amount=-sign * total,
+            balance_after=balances[system.pk],
+        ))
+        LedgerEntry.objects.bulk_create(entries)
+    return amounts
+
+
+def payout(amounts, currency, key, kind='credit', memo="", chunk_size=CHUNK_SIZE, log=None) -> dict:
+    """Pays {wallet pk: amount} of 'currency' under 'key'. Returns the
+    amount of wallets paid, already paid before and skipped for lack
+    of funds, and the total moved
+    """
+    if kind not in ('credit', 'debit'):
+        raise ValueError(f'Payouts are credits or debits, not: {kind}')
+    for amount in amounts.values():
+        validate(amount, currency)
+    key = str(key)
+    if len(key) > KEY_LENGTH:
+        raise ValueError(f'Payout keys are at most {KEY_LENGTH} characters')
+    system = system_wallet()
+    done = paid_under(key)
+    pending = sorted(pk for pk in amounts if pk not in done and pk != system.pk)
+    report = {'paid': 0, 'already_paid': len(amounts) - len(pending), 'skipped': 0, 'total': 0}
+
+    for start in range(0, len(pending), chunk_size):
+        chunk = {pk: amounts[pk] for pk in pending[start:start + chunk_size]}
+        paid = pay_chunk(kind, chunk, currency, key, system, memo)
+        report['paid'] += len(paid)
+        report['skipped'] += len(chunk) - len(paid)
+        report['total'] += sum(paid.values())
+        if log:
+            log(f'{kind.title()}ed {min(start + chunk_size, len(pending))}/{len(pending)} wallets')
+    return report
+
+
+def payout_all(wallets, amount, currency, key, **kwargs) -> dict:
+    """Pays the same 'amount' to every wallet in 'wallets'"""
+    pks = wallets.values_list('pk', flat=True) if hasattr(wallets, 'values_list') \
+        else [wallet.pk for wallet in wallets]
+    return payout(dict.fromkeys(pks, amount), currency, key, **kwargs)
@@ -1,5 +1,15 @@
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command, CommandError
+from django.db import IntegrityError, transaction
 from django.test import TestCase, Client
+
 from users.models import User
+from wallet.ledger import credit, debit, transfer, ledger_balances, system_wallet, InsufficientFunds
+from wallet.models import Wallet, Transfer, LedgerEntry
+from wallet.payouts import payout, payout_all
 
 
 class WalletTestCase(TestCase):
@@ -62,14 +72,14 @@ class WalletTestCase(TestCase):
         self.assertEqual(wallet2.muns, 0)
 
         # Plump wallet1 so that a trade can take place
-        wallet1.transact_currency(20, 'shinies')
+        credit(wallet1, 20, 'shinies')
 
         wallet1.send_currency(wallet2, 7, 'shinies')
         self.assertEqual(wallet1.shinies, 13)
         self.assertEqual(self.user2.wallet.shinies, 7)
 
         # Plump wallet2 muns
-        wallet2.transact_currency(34, 'muns')
+        credit(wallet2, 34, 'muns')
 
         self.assertEqual(wallet2.muns, 34)
         self.assertEqual(wallet1.muns, 0)
@@ -96,3 +106,167 @@ class WalletTestCase(TestCase):
         # plump wallet1
         wallet1.transact_currency(30, 'shinies')
         self.assertEqual(wallet1.balance, {'shinies': 30, 'muns': 0})
+
+
+class LedgerTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.wallet1 = Wallet.objects.create(owner="one")
+        self.wallet2 = Wallet.objects.create(owner="two")
+        credit(self.wallet1, 50, 'shinies')
+
+    def balance(self, wallet, currency='shinies'):
+        return getattr(Wallet.objects.get(pk=wallet.pk), currency)
+
+    def test_one_system_wallet(self):
+        wallet = system_wallet()
+        self.assertEqual(system_wallet(), wallet)
+        #  What a concurrent first call would run into
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Wallet.objects.create(owner="vivacity", is_system=True)
+        self.assertEqual(Wallet.objects.filter(is_system=True).count(), 1)
+
+    def test_transfer(self):
+        transfer(self.wallet1, self.wallet2, 20, 'shinies')
+        self.assertEqual(self.balance(self.wallet1), 30)
+        self.assertEqual(self.balance(self.wallet2), 20)
+        self.assertEqual(self.wallet1.shinies, 30)
+
+        #  Double entry, every transfer adds up to zero
+        for transfer_ in Transfer.objects.all():
+            self.assertEqual(sum(transfer_.entries.values_list('amount', flat=True)), 0)
+        self.assertEqual(ledger_balances(self.wallet2), {'shinies': 20, 'muns': 0})
+
+    def test_insufficient_funds(self):
+        with self.assertRaises(InsufficientFunds):
+            transfer(self.wallet1, self.wallet2, 51, 'shinies')
+        with self.assertRaises(InsufficientFunds):
+            debit(self.wallet2, 1, 'muns')
+        #  Nothing moved and nothing was recorded
+        self.assertEqual(self.balance(self.wallet1), 50)
+        self.assertEqual(self.balance(self.wallet2), 0)
+        self.assertEqual(LedgerEntry.objects.filter(wallet=self.wallet2).count(), 0)
+
+    def test_stale_objects_do_not_overdraw(self):
+        stale = Wallet.objects.get(pk=self.wallet1.pk)
+        transfer(self.wallet1, self.wallet2, 40, 'shinies')
+        #  The stale copy still shows 50 but the database holds 10
+        with self.assertRaises(InsufficientFunds):
+            transfer(stale, self.wallet2, 40, 'shinies')
+        self.assertEqual(self.balance(self.wallet1), 10)
+
+    def test_idempotency_key(self):
+        first = transfer(self.wallet1, self.wallet2, 5, 'shinies', idempotency_key="trade-1")
+        again = transfer(self.wallet1, self.wallet2, 5, 'shinies', idempotency_key="trade-1")
+        self.assertEqual(first.pk, again.pk)
+        self.assertEqual(self.balance(self.wallet2), 5)
+
+    def test_rebuild_balances(self):
+        Wallet.objects.filter(pk=self.wallet1.pk).update(shinies=999)
+        call_command('rebuild_wallet_balances', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.balance(self.wallet1), 50)
+
+
+class PayoutTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.wallets = [Wallet.objects.create(owner=f"payee{i}") for i in range(5)]
+        self.pks = [wallet.pk for wallet in self.wallets]
+        #  Created once per database, not part of what payouts cost
+        system_wallet()
+
+    def balances(self, currency='shinies'):
+        return list(Wallet.objects.filter(pk__in=self.pks).order_by('pk').values_list(currency, flat=True))
+
+    def test_payout_all(self):
+        #  A few queries to set up, then the same 7 for every chunk of
+        #  wallets however many there are
+        with self.assertNumQueries(3 + 3 * 7):
+            report = payout_all(Wallet.objects.filter(pk__in=self.pks), 10, 'shinies', "event", chunk_size=2)
+        self.assertEqual(report['paid'], 5)
+        self.assertEqual(report['total'], 50)
+        self.assertEqual(self.balances(), [10] * 5)
+        self.assertEqual(Transfer.objects.filter(idempotency_key__startswith="event:").count(), 3)
+        for wallet in self.wallets:
+            self.assertEqual(ledger_balances(wallet)['shinies'], 10)
+
+    def test_payout_amounts(self):
+        payout(dict(zip(self.pks, [1, 2, 3, 4, 5])), 'muns', "rewards")
+        self.assertEqual(self.balances('muns'), [1, 2, 3, 4, 5])
+        transfer_ = Transfer.objects.get(idempotency_key__startswith="rewards:")
+        self.assertEqual(sum(transfer_.entries.values_list('amount', flat=True)), 0)
+
+    def test_resume(self):
+        #  An interrupted payout that only reached the first wallets
+        payout(dict.fromkeys(self.pks[:2], 10), 'shinies', "event")
+        report = payout(dict.fromkeys(self.pks, 10), 'shinies', "event", chunk_size=2)
+        self.assertEqual(report['already_paid'], 2)
+        self.assertEqual(report['paid'], 3)
+        self.assertEqual(self.balances(), [10] * 5)
+        #  Running it again pays nobody twice
+        report = payout(dict.fromkeys(self.pks, 10), 'shinies', "event")
+        self.assertEqual(report['paid'], 0)
+        self.assertEqual(self.balances(), [10] * 5)
+
+    def test_key_with_separator(self):
+        #  "event:1" is not a chunk of "event", nor the other way around
+        payout(dict.fromkeys(self.pks[:2], 10), 'shinies', "event:1")
+        report = payout(dict.fromkeys(self.pks, 10), 'shinies', "event")
+        self.assertEqual(report['already_paid'], 0)
+        self.assertEqual(report['paid'], 5)
+        self.assertEqual(self.balances(), [20, 20, 10, 10, 10])
+
+    def test_debit(self):
+        payout(dict.fromkeys(self.pks[:3], 10), 'shinies', "gift")
+        report = payout(dict.fromkeys(self.pks, 5), 'shinies', "fee", kind='debit')
+        #  Wallets that cannot cover it are skipped
+        self.assertEqual(report['paid'], 3)
+        self.assertEqual(report['skipped'], 2)
+        self.assertEqual(self.balances(), [5, 5, 5, 0, 0])
+        self.assertEqual(ledger_balances(self.wallets[0])['shinies'], 5)
+
+    def test_invalid_amount(self):
+        with self.assertRaises(ValueError):
+            payout({self.pks[0]: 0}, 'shinies', "event")
+        with self.assertRaises(AttributeError):
+            payout({self.pks[0]: 1}, 'walrus', "event")
+        self.assertEqual(self.balances(), [0] * 5)
+
+    def test_command(self):
+        users = [User.objects.create_user(username=f"payee_user{i}", email=f"payee{i}@example.com", password="pw")
+                 for i in range(2)]
+        call_command('payout', 'muns', '--key', "daily", '--amount', '3',
+                     '--users', users[0].username, stdout=open(os.devnull, 'w'))
+        call_command('payout', 'muns', '--key', "daily", '--amount', '3', stdout=open(os.devnull, 'w'))
+        for user in users:
+            self.assertEqual(Wallet.objects.get(pk=user.wallet_id).muns, 3)
+
+    def test_command_bad_file(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write("payee_user0,3\npayee_user1,three\n")
+        self.addCleanup(os.remove, file.name)
+        with self.assertRaisesMessage(CommandError, "Line 2"):
+            call_command('payout', 'muns', '--key', "daily", '--file', file.name, stdout=open(os.devnull, 'w'))
+        self.assertFalse(Transfer.objects.filter(batch_key="daily").exists())
+
+    def test_command_unknown_users(self):
+        user = User.objects.create_user(username="payee_user", email="payee@example.com", password="pw")
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write("payee_user,3\nghost,4\n")
+        self.addCleanup(os.remove, file.name)
+        out, err = StringIO(), StringIO()
+        call_command('payout', 'muns', '--key', "daily", '--file', file.name, stdout=out, stderr=err)
+        self.assertIn("Line 2", err.getvalue())
+        self.assertIn("ghost", err.getvalue())
+        self.assertIn("1 unknown users", out.getvalue())
+        self.assertEqual(Wallet.objects.get(pk=user.wallet_id).muns, 3)
+
+    def test_long_key(self):
+        key = "k" * 100
+        payout(dict.fromkeys(self.pks, 10), 'shinies', key, chunk_size=2)
+        for transfer_ in Transfer.objects.filter(batch_key=key):
+            self.assertLessEqual(len(transfer_.idempotency_key), 100)
+        #  Still resumed by its key
+        self.assertEqual(payout(dict.fromkeys(self.pks, 10), 'shinies', key)['already_paid'], 5)
+        with self.assertRaises(ValueError):
+            payout(dict.fromkeys(self.pks, 10), 'shinies', key + "k")